@@ -1,6 +1,8 @@
 import sqlite3
 import getpass
 import hashlib
+from user_directory import note_new_user
+from route_catalog import invalidate_routes
 
 def setup_database():
     conn = sqlite3.connect('travel.db')
@@ -39,6 +41,11 @@ def setup_database():
         user_type TEXT,
         min_points INTEGER DEFAULT 0
     )''')
+    # Ids of booked quotes, so each quote books once (see quotes.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS used_quotes (
+        quote_id TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL
+    )''')
     conn.commit()
     conn.close()
     print('Database setup complete.')
@@ -52,6 +59,7 @@ def add_user():
     try:
         c.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, hashed))
         conn.commit()
+        note_new_user(c.lastrowid, username)
         print('User added successfully!')
     except sqlite3.IntegrityError:
         print('Username already exists!')
@@ -70,6 +78,7 @@ def add_route():
               (origin, destination, departure_time, base_price, seats_total, seats_total, transport_type))
     conn.commit()
     conn.close()
+    invalidate_routes()
     print('Route added successfully!')
 
 def add_discount():
@@ -0,0 +1,381 @@
+"""
+Booking queries behind each TravelBookingAgent intent
+
+The agent's generated REPL code calls these functions. Each one returns a
+record from agent_results instead of printing, so callers decide how to
+show it. Every function takes an optional open connection.
+"""
+import sqlite3
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+
+from fetch_and_calculate import (
+    price_booking, priced_bookings_sql, breakdown_from_row, register_pricing_functions,
+)
+from agent_results import (
+    AgentMessage, MissingBooking, UserBookings, UserTotal, BookingOwner,
+    BookingListing, BookingListingRow, UserReport, SystemReport, MultipleBookings,
+    TopUsers, TopUserRow,
+)
+from user_directory import directory_for
+
+# Rows per page for paged booking listings
+BOOKINGS_PAGE_SIZE = 50
+
+# Rows between progress reports / cancellation checks in long commands
+PROGRESS_EVERY = 50
+
+# Booking IDs priced per query; each is bound twice, so this stays well
+# under SQLite's default limit of 999 parameters
+PRICE_BATCH_SIZE = 400
+
+_LISTING_SQL = """
+    SELECT b.id, u.username, r.origin, r.destination
+    FROM bookings b
+    JOIN users u ON b.user_id = u.id
+    JOIN routes r ON b.route_id = r.id
+"""
+
+
+@contextmanager
+def _connect(conn=None):
+    """Use the caller's connection, or open (and close) one on travel.db"""
+    if conn is not None:
+        yield conn
+        return
+    conn = sqlite3.connect('travel.db')
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _report_progress(done, total, progress, cancel):
+    """Stop if the caller cancelled, otherwise tell it how far we are"""
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    if progress is not None:
+        progress(done, total)
+
+
+def _price_or_missing(booking_id, conn):
+    try:
+        return price_booking(booking_id, conn)
+    except LookupError as e:
+        return MissingBooking(booking_id, str(e))
+
+
+def _add_to_route(route_totals, booking):
+    route_key = f"{booking.origin} -> {booking.destination}"
+    route_totals[route_key] = route_totals.get(route_key, 0.0) + booking.final_price
+
+
+def booking_details(booking_id, conn=None):
+    """Price breakdown of a single booking"""
+    with _connect(conn) as conn:
+        return _price_or_missing(booking_id, conn)
+
+
+def user_bookings(username, conn=None, progress=None, cancel=None, emit=None):
+    """Every booking of the user with this EXACT (case-sensitive) name
+    
+    ``progress(done, total)`` is called every PROGRESS_EVERY bookings, and a
+    cancelled ``cancel`` token (sandbox.CancellationToken) stops the command.
+    ``emit(booking)`` is called with each booking as soon as it is priced.
+    """
+    result = UserBookings(requested_user=username)
+    with _connect(conn) as conn:
+        c = conn.cursor()
+        directory = directory_for(conn)
+        if directory is not None:
+            result.user_id = directory.user_id(username)
+        else:
+            c.execute("SELECT id FROM users WHERE username = ?", (username,))
+            row = c.fetchone()
+            result.user_id = row[0] if row else None
+        if result.user_id is None:
+            # Offer case-insensitive matches (or similar names) as suggestions
+            if directory is not None:
+                result.similar_users = ([name for _, name in directory.matching(username)]
+                                        or directory.suggestions(username))
+            else:
+                c.execute("SELECT username FROM users WHERE lower(username) = lower(?)", (username,))
+                result.similar_users = [row[0] for row in c.fetchall()]
+            return result
+        result.username = username
+        c.execute("SELECT id FROM bookings WHERE user_id=?", (result.user_id,))
+        booking_ids = sorted(row[0] for row in c.fetchall())
+        for done, bid in enumerate(booking_ids, 1):
+            booking = _price_or_missing(bid, conn)
+            result.bookings.append(booking)
+            if emit is not None:
+                emit(booking)
+            if booking.final_price:
+                _add_to_route(result.route_totals, booking)
+                result.total += booking.final_price
+            if done % PROGRESS_EVERY == 0:
+                _report_progress(done, len(booking_ids), progress, cancel)
+        _report_progress(len(booking_ids), len(booking_ids), progress, cancel)
+    return result
+
+
+def user_total(username, conn=None):
+    """Route-wise and grand totals for every user matching the name in any case
+    
+    Totals are aggregated in SQL (GROUP BY route over the priced bookings), so
+    the number of queries does not grow with the number of bookings. They are
+    rounded to cents, as SQLite adds the prices in no particular order.
+    """
+    result = UserTotal(requested_user=username)
+    with _connect(conn) as conn:
+        register_pricing_functions(conn)
+        c = conn.cursor()
+        directory = directory_for(conn)
+        if directory is not None:
+            matching_users = directory.matching(username)
+        else:
+            c.execute("SELECT id, username FROM users WHERE lower(username) = lower(?) ORDER BY id", (username,))
+            matching_users = c.fetchall()
+        result.usernames = [user[1] for user in matching_users]
+        if not matching_users:
+            return result
+        user_ids = [user[0] for user in matching_users]
+        placeholders = ", ".join("?" * len(user_ids))
+        c.execute(f"SELECT COUNT(*) FROM bookings WHERE user_id IN ({placeholders})", user_ids)
+        result.booking_count = c.fetchone()[0]
+        if not result.booking_count:
+            return result
+        # Only routes these users booked need their seat counts worked out
+        routes_filter = f"b.route_id IN (SELECT route_id FROM bookings WHERE user_id IN ({placeholders}))"
+        c.execute(f"""
+            WITH priced AS (
+                SELECT booking_id, origin, destination,
+                       final_price(base_price, seats_total, seats_total - booked_so_far + 1,
+                                   traveller_type, discount) AS price
+                FROM ({priced_bookings_sql(conn, routes_filter)})
+                WHERE user_id IN ({placeholders}) AND has_route
+            )
+            SELECT origin, destination, total(price)
+            FROM priced
+            WHERE price
+            GROUP BY origin, destination
+            ORDER BY MIN(booking_id)
+        """, user_ids * 2)
+        route_rows = c.fetchall()
+        for origin, destination, total in route_rows:
+            result.route_totals[f"{origin} -> {destination}"] = round(total, 2)
+        result.grand_total = round(sum(total for _, _, total in route_rows), 2)
+    return result
+
+
+def booking_owner(booking_id, conn=None):
+    """Username that made a booking"""
+    with _connect(conn) as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT u.username
+            FROM bookings b
+            JOIN users u ON b.user_id = u.id
+            WHERE b.id = ?
+        """, (booking_id,))
+        row = c.fetchone()
+    return BookingOwner(booking_id, row[0] if row else None)
+
+
+def list_all_bookings(conn=None):
+    """One row per booking with its user and route (unbounded; see bookings_page)"""
+    with _connect(conn) as conn:
+        c = conn.cursor()
+        c.execute(_LISTING_SQL + "ORDER BY b.id")
+        return BookingListing([BookingListingRow(*row) for row in c.fetchall()])
+
+
+def bookings_page(page=1, after_id=None, page_size=BOOKINGS_PAGE_SIZE, conn=None):
+    """One page of the booking listing, keyset-paginated on bookings.id
+    
+    ``after_id`` continues right after that booking ID (the ``next_after`` of
+    the previous page) and reads only one page of rows. A page number is
+    turned into its first booking ID with one OFFSET over the primary key.
+    """
+    page = max(1, page)
+    listing = BookingListing(page=None if after_id is not None else page,
+                             after_id=after_id, page_size=page_size)
+    with _connect(conn) as conn:
+        c = conn.cursor()
+        if after_id is None and page > 1:
+            c.execute(_LISTING_SQL + "ORDER BY b.id LIMIT 1 OFFSET ?", ((page - 1) * page_size,))
+            first = c.fetchone()
+            if first is None:
+                return listing
+            after_id = first[0] - 1
+        if after_id is None:
+            c.execute(_LISTING_SQL + "ORDER BY b.id LIMIT ?", (page_size + 1,))
+        else:
+            c.execute(_LISTING_SQL + "WHERE b.id > ? ORDER BY b.id LIMIT ?", (after_id, page_size + 1))
+        rows = [BookingListingRow(*row) for row in c.fetchall()]
+    # The extra row only tells us whether there is another page
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        listing.next_after = rows[-1].booking_id
+    listing.rows = rows
+    return listing
+
+
+def latest_bookings(count, conn=None):
+    """The ``count`` most recent bookings, newest first"""
+    with _connect(conn) as conn:
+        c = conn.cursor()
+        c.execute(_LISTING_SQL + "ORDER BY b.id DESC LIMIT ?", (count,))
+        rows = [BookingListingRow(*row) for row in c.fetchall()]
+    return BookingListing(rows, heading=f"\n🕒 LATEST {count} BOOKINGS:")
+
+
+def top_users(count, conn=None):
+    """The ``count`` users with the highest total spend, rounded to cents"""
+    result = TopUsers(count)
+    with _connect(conn) as conn:
+        register_pricing_functions(conn)
+        c = conn.cursor()
+        c.execute(f"""
+            WITH priced AS (
+                SELECT username, user_id,
+                       final_price(base_price, seats_total, seats_total - booked_so_far + 1,
+                                   traveller_type, discount) AS price
+                FROM ({priced_bookings_sql(conn)})
+                WHERE username IS NOT NULL AND has_route
+            )
+            SELECT username, COUNT(*), round(total(price), 2) AS spend
+            FROM priced
+            WHERE price
+            GROUP BY user_id
+            ORDER BY spend DESC, username
+            LIMIT ?
+        """, (count,))
+        result.rows = [TopUserRow(*row) for row in c.fetchall()]
+    return result
+
+
+def system_report(conn=None, progress=None, cancel=None, emit=None):
+    """Every booking of every user with full calculations and totals
+    
+    Built from one ordered scan of the priced-bookings join, grouped by user.
+    Reports progress and checks ``cancel`` every PROGRESS_EVERY bookings, and
+    passes each booking to ``emit`` as the scan reaches it.
+    """
+    report = SystemReport()
+    with _connect(conn) as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM users")
+        report.user_count = c.fetchone()[0]
+        total_rows = done = 0
+        if progress is not None:
+            c.execute("SELECT COUNT(*) FROM bookings b JOIN users u ON u.id = b.user_id")
+            total_rows = c.fetchone()[0]
+        c.execute(f"""
+            SELECT * FROM ({priced_bookings_sql(conn)})
+            WHERE username IS NOT NULL
+            ORDER BY username, booking_id
+        """)
+        for username, rows in groupby(c, key=itemgetter(0)):
+            user = UserReport(username)
+            for row in rows:
+                try:
+                    booking = breakdown_from_row(row)
+                except LookupError as e:
+                    booking = MissingBooking(row[1], str(e))
+                user.bookings.append(booking)
+                if emit is not None:
+                    emit(booking)
+                if booking.final_price:
+                    user.total += booking.final_price
+                    report.total += booking.final_price
+                    report.booking_count += 1
+                done += 1
+                if done % PROGRESS_EVERY == 0:
+                    _report_progress(done, total_rows, progress, cancel)
+            report.users.append(user)
+        _report_progress(done, total_rows, progress, cancel)
+    return report
+
+
+def multiple_bookings(booking_ids, conn=None, skipped=0, progress=None, cancel=None, emit=None):
+    """Breakdowns of specific booking IDs and the sum of their prices
+    
+    ``skipped`` is how many further requested IDs were left out by the
+    agent's row limit; it is only reported, not looked up. Bookings go to
+    ``emit`` in request order once pricing is done.
+    """
+    result = MultipleBookings(skipped=skipped)
+    with _connect(conn) as conn:
+        priced = price_bookings(booking_ids, conn, progress, cancel)
+    # Output (and the running total) follow the request, repeats included
+    for bid in booking_ids:
+        booking = priced[bid]
+        result.bookings.append(booking)
+        if emit is not None:
+            emit(booking)
+        result.total += booking.final_price or 0
+    return result
+
+
+def price_bookings(booking_ids, conn, progress=None, cancel=None):
+    """{booking_id: BookingBreakdown or MissingBooking} for a set of IDs
+    
+    Each distinct ID is priced once, in batches of set-based queries over
+    priced_bookings_sql instead of five queries per booking. Progress is
+    reported (and ``cancel`` checked) after every batch.
+    """
+    unique_ids = list(dict.fromkeys(booking_ids))
+    priced = {}
+    c = conn.cursor()
+    for start in range(0, len(unique_ids), PRICE_BATCH_SIZE):
+        batch = unique_ids[start:start + PRICE_BATCH_SIZE]
+        placeholders = ", ".join("?" * len(batch))
+        # Seat counts need every booking on the routes involved, not just these
+        routes_filter = f"b.route_id IN (SELECT route_id FROM bookings WHERE id IN ({placeholders}))"
+        c.execute(f"""
+            SELECT * FROM ({priced_bookings_sql(conn, routes_filter)})
+            WHERE booking_id IN ({placeholders})
+        """, batch * 2)
+        for row in c.fetchall():
+            try:
+                priced[row[1]] = breakdown_from_row(row)
+            except LookupError as e:
+                priced[row[1]] = MissingBooking(row[1], str(e))
+        _report_progress(start + len(batch), len(unique_ids), progress, cancel)
+    for bid in unique_ids:
+        if bid not in priced:
+            priced[bid] = MissingBooking(bid, f"No booking found with ID {bid}")
+    return priced
+
+
+def my_bookings(conn=None):
+    """The CLI has no logged-in user, so explain how to ask instead"""
+    text = "\n".join([
+        "📋 To view your bookings, you have two options:",
+        "1. Use the web interface (login automatically provides your username)",
+        "2. In CLI, use: 'show bookings for [your_username]'",
+        "",
+        "Examples:",
+        "• 'show bookings for nikitha'",
+        "• 'show bookings for john'",
+        "• 'all bookings for [username]'",
+    ])
+    return AgentMessage(text, "Please specify username for booking queries")
+
+
+# Functions available to the agent's generated code, by name
+AGENT_FUNCTIONS = {
+    'booking_details': booking_details,
+    'user_bookings': user_bookings,
+    'user_total': user_total,
+    'booking_owner': booking_owner,
+    'list_all_bookings': list_all_bookings,
+    'bookings_page': bookings_page,
+    'latest_bookings': latest_bookings,
+    'top_users': top_users,
+    'system_report': system_report,
+    'multiple_bookings': multiple_bookings,
+    'my_bookings': my_bookings,
+}
@@ -1,8 +1,42 @@
 import re
+import sqlite3
 import subprocess
 import sys
 import os
+import json
+import time
+import argparse
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
 from fetch_and_calculate import fetch_all_bookings_for_user, fetch_and_explain_booking
+from agent_commands import AGENT_FUNCTIONS
+from agent_results import AgentMessage, format_result, result_value, result_to_dict
+from db import ConnectionPool, DB_PATH
+from sandbox import ExecutionLimits, CommandCutOff, deadline, cap_rows, cap_output, run_isolated
+from tracer import Tracer, NULL_TRACER
+from result_cache import ResultCache, CacheEntry
+from query_profiler import profile_code
+
+# How many distinct command strings keep their parse result cached
+PARSE_CACHE_SIZE = 1024
+
+# Agent functions that accept progress/cancel keyword arguments
+PROGRESS_FUNCTIONS = frozenset(
+    name for name, fn in AGENT_FUNCTIONS.items() if 'progress' in inspect.signature(fn).parameters)
+# Agent functions that hand each booking to an emit callback as it is priced
+STREAMING_FUNCTIONS = frozenset(
+    name for name, fn in AGENT_FUNCTIONS.items() if 'emit' in inspect.signature(fn).parameters)
+
+# Agent functions clients may call directly (agent_server's JSON-RPC);
+# list_all_bookings is unbounded, bookings_page is its paged form
+DIRECT_FUNCTIONS = frozenset(AGENT_FUNCTIONS) - {'list_all_bookings'}
+# Parameters the agent fills in itself, never a caller
+_RESERVED_PARAMS = frozenset(('conn', 'progress', 'cancel', 'emit'))
+
+# Import line for generated code that runs in a separate Python process
+AGENT_IMPORTS = f"from agent_commands import {', '.join(AGENT_FUNCTIONS)}"
 
 class TravelBookingAgent:
     """
@@ -29,10 +63,22 @@ class TravelBookingAgent:
 🔢 MULTIPLE SPECIFIC BOOKINGS:
 • "show bookings 1, 2, 3" - Sum of specific booking IDs"""
     
-    def __init__(self):
+    def __init__(self, pool=None, limits=None, tracer=None, use_cache=True):
+        # Optional db.ConnectionPool; without one every command opens its own connection
+        self.pool = pool
+        # Time, row, output and memory limits for every command (see sandbox.py)
+        self.limits = limits or ExecutionLimits()
+        # Opt-in tracer.Tracer recording per-stage and per-SQL spans
+        self.tracer = tracer or NULL_TRACER
+        # Results of repeated commands, dropped whenever the database changes
+        self.cache = ResultCache(pool.db_path if pool is not None else DB_PATH) if use_cache else None
         self.commands = {
+            'explain_plan': r'^(?:profile|explain\s+plan)\s+(?:for\s+)?(.+)',
             'booking_by_id': r'(?:show|explain|calculate|get)\s+(?:booking|price)\s+(?:for\s+)?(?:id\s+)?(\d+)',
             'booking_by_user': r'(?:show|get|find)\s+(?:me\s+)?(?:all\s+)?bookings?\s+(?:for|under|of)\s+(?:user\s+)?["\']?(\w+)["\']?',
+            'bookings_page': r'(?:show|list)\s+(?:all\s+)?bookings?\s+(?:page\s+(\d+)|after\s+(?:booking\s+)?(?:id\s+)?(\d+))',
+            'latest_bookings': r'(?:latest|last|newest|recent)\s+(\d+)\s+bookings?',
+            'top_users': r'top\s+(\d+)\s+users?',
             'provide_all_bookings': r'(?:provide|show)\s+(?:all\s+)?(?:my\s+)?(?:bookings?|all\s+bookings?)',
             'my_bookings': r'(?:show|get|find)\s+(?:all\s+)?(?:my)\s+bookings?',
             'user_total': r'(?:total|sum)\s+(?:price|cost)\s+(?:for|of|under)\s+(?:user\s+)?["\']?(\w+)["\']?',
@@ -41,46 +87,145 @@ class TravelBookingAgent:
             'all_bookings': r'(?:show|list)\s+(?:all\s+)?(?:bookings?|system\s+bookings?)',
             'help': r'(?:help|what\s+can\s+you\s+do|commands)',
         }
+        self.compile_commands()
     
-    def parse_natural_language(self, user_input):
-        """Parse natural language input and extract intent and parameters"""
-        original_input = user_input.strip()
-        user_input_lower = user_input.lower().strip()
+    def compile_commands(self):
+        """Combine every pattern in self.commands into one precompiled regex.
         
+        Each intent becomes a branch ``.*?(?P<intent>pattern)`` anchored at the
+        start of the input. The lazy prefix makes the engine try a branch at
+        every position before moving on to the next branch, so the first intent
+        in dict order still wins (same as searching the patterns one by one),
+        but the whole input is matched by a single compiled regex. Call this
+        again after changing self.commands.
+        """
+        branches = []
+        self._intent_groups = {}
+        group_index = 1
         for intent, pattern in self.commands.items():
-            # Use lowercase for pattern matching
-            match = re.search(pattern, user_input_lower)
-            if match:
-                # But extract parameters from original input to preserve case
-                if intent in ['booking_by_user', 'user_total']:
-                    # For user commands, extract username with original case
-                    original_match = re.search(pattern, original_input, re.IGNORECASE)
-                    if original_match:
-                        return intent, original_match.groups()
-                return intent, match.groups()
-        
-        return None, None
+            inner_groups = re.compile(pattern).groups
+            branches.append(f'.*?(?P<{intent}>{pattern})')
+            # The intent's own capture groups follow its named wrapper group
+            self._intent_groups[intent] = (group_index, group_index + inner_groups)
+            group_index += 1 + inner_groups
+        combined = '^(?:' + '|'.join(branches) + ')'
+        self._command_matcher = re.compile(combined, re.DOTALL)
+        # Only needed when lowercasing changes the length of the input
+        self._command_matcher_nocase = re.compile(combined, re.DOTALL | re.IGNORECASE)
+        self._parse_cached = lru_cache(maxsize=PARSE_CACHE_SIZE)(self._match_intent)
+    
+    def _match_intent(self, user_input):
+        """Run the combined matcher once and return (intent, params)"""
+        user_input_lower = user_input.lower()
+        if len(user_input_lower) == len(user_input):
+            # Match the lowercase text; parameters are sliced from the original
+            # input at the same offsets so usernames keep their case
+            match = self._command_matcher.match(user_input_lower)
+        else:
+            match = self._command_matcher_nocase.match(user_input)
+        if not match:
+            return None, None
+        # The named wrapper closes last, so it is the last matched group
+        intent = match.lastgroup
+        first, last = self._intent_groups[intent]
+        params = tuple(
+            user_input[start:end] if start != -1 else None
+            for start, end in (match.span(group) for group in range(first + 1, last + 1))
+        )
+        return intent, params
     
-    def execute_in_repl(self, code_to_execute):
+    def parse_natural_language(self, user_input):
+        """Parse natural language input and extract intent and parameters"""
+        return self._parse_cached(user_input.strip())
+    
+    def execute_in_repl(self, code_to_execute, progress=None, cancel=None, emit=None):
         """Execute Python code in a REPL-like environment"""
         try:
-            # Create a local namespace with our functions
-            local_namespace = {
+            return self.run_code(code_to_execute, progress, cancel, emit)
+        except CommandCutOff as e:
+            print(f"⛔ {e}")
+            return None
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            return None
+    
+    def run_code(self, code_to_execute, progress=None, cancel=None, emit=None):
+        """Run generated code under self.limits and return `result`
+        
+        ``progress(done, total)`` and the sandbox.CancellationToken ``cancel``
+        are handed to long-running functions (PROGRESS_FUNCTIONS), ``emit`` to
+        the booking reports (STREAMING_FUNCTIONS). Raises
+        sandbox.CommandCutOff when the command hits a limit or is cancelled.
+        """
+        limits = self.limits
+        db_path = self.pool.db_path if self.pool is not None else DB_PATH
+        with self.tracer.span('execute', code=code_to_execute):
+            if limits.isolate or limits.max_memory_mb:
+                # The worker process cannot report progress, but is killed on cancel
+                return run_isolated(code_to_execute, limits, db_path, cancel)
+            if self.pool is not None:
+                return self._exec_with_deadline(code_to_execute, self.pool.get(), progress, cancel, emit=emit)
+            conn = sqlite3.connect(db_path)
+            try:
+                return self._exec_with_deadline(code_to_execute, conn, progress, cancel, emit=emit)
+            finally:
+                conn.close()
+    
+    def call_function(self, name, *args, **kwargs):
+        """Call one of DIRECT_FUNCTIONS with caller-supplied arguments, under the same guard as commands
+        
+        Counts and page sizes are kept within 1..limits.max_rows, ID lists
+        are cut at max_rows (the rest counted in ``skipped``), and the call
+        runs through run_code, so the time limit is checked in Python loops
+        too. Raises TypeError for arguments the function does not take.
+        """
+        if name not in DIRECT_FUNCTIONS:
+            raise ValueError(f"Unknown agent function: {name}")
+        bound = inspect.signature(AGENT_FUNCTIONS[name]).bind(*args, **kwargs)
+        reserved = _RESERVED_PARAMS.intersection(bound.arguments)
+        if reserved:
+            raise TypeError(f"{name}() does not take {', '.join(sorted(reserved))} from callers")
+        params = bound.arguments
+        for key in ('count', 'page_size'):
+            if key in params:
+                params[key] = max(1, self._capped_count(params[key]))
+        if 'booking_ids' in params:
+            booking_ids, skipped = cap_rows([int(bid) for bid in params['booking_ids']], self.limits.max_rows)
+            params['booking_ids'] = booking_ids
+            if skipped:
+                params['skipped'] = int(params.get('skipped', 0)) + skipped
+        # The arguments are JSON values, whose repr is a Python literal
+        call = ", ".join([repr(value) for value in bound.args]
+                         + [f"{key}={value!r}" for key, value in bound.kwargs.items()])
+        return self.run_code(f"result = {name}({call})")
+    
+    def _exec_with_deadline(self, code_to_execute, conn, progress=None, cancel=None, tracer=None, emit=None):
+        tracer = tracer or self.tracer
+        with deadline(conn, self.limits.timeout, cancel) as limit, tracer.trace_connection(conn):
+            # Generated code sees the query functions as globals so that
+            # comprehensions and nested code can call them too
+            functions = {name: partial(fn, conn=conn) for name, fn in AGENT_FUNCTIONS.items()}
+            if progress is not None or cancel is not None or limit.expires is not None:
+                # Long loops check the deadline (and cancel) between batches, not just inside queries
+                for name in PROGRESS_FUNCTIONS:
+                    functions[name] = partial(AGENT_FUNCTIONS[name], conn=conn, progress=progress, cancel=limit)
+            if emit is not None:
+                for name in STREAMING_FUNCTIONS:
+                    functions[name] = partial(functions[name], emit=emit)
+            namespace = {
+                "__builtins__": __builtins__,
                 'fetch_all_bookings_for_user': fetch_all_bookings_for_user,
                 'fetch_and_explain_booking': fetch_and_explain_booking,
+                **functions,
             }
             
             # Execute the code in REPL-style using exec for multi-line code
-            exec(code_to_execute, {"__builtins__": __builtins__}, local_namespace)
-            
-            # Get the result from the local namespace
-            result = local_namespace.get('result', None)
-            
-            return result
-            
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return None
+            exec(code_to_execute, namespace)
+            # Work done in Python after the last query still counts against the limit
+            limit.raise_if_cancelled()
+        
+        # Get the result from the namespace
+        return namespace.get('result', None)
     
     def execute_system_repl(self, code_to_execute):
         """Execute code in actual Python REPL subprocess"""
@@ -94,9 +239,13 @@ import sys
 import os
 sys.path.append(os.getcwd())
 from fetch_and_calculate import fetch_all_bookings_for_user, fetch_and_explain_booking
+{AGENT_IMPORTS}
+from agent_results import format_result, result_value
 
 # Execute the agent command
 result = {code_to_execute}
+print(format_result(result))
+result = result_value(result)
 print("\\n" + "="*50)
 print(f"🔥 SYSTEM REPL RESULT: {{result}}")
 print("="*50)
@@ -107,10 +256,11 @@ print("="*50)
                 [sys.executable, '-c', full_code],
                 capture_output=True,
                 text=True,
-                cwd=os.getcwd()
+                cwd=os.getcwd(),
+                timeout=self.limits.timeout
             )
             
-            print(process.stdout)
+            print(cap_output(process.stdout, self.limits.max_output_chars))
             if process.stderr:
                 print(f"🚨 REPL Errors: {process.stderr}")
             
@@ -125,6 +275,9 @@ print("="*50)
             print("✅ SYSTEM REPL execution completed")
             return "Execution completed"
             
+        except subprocess.TimeoutExpired:
+            print(f"⛔ SYSTEM REPL stopped after {self.limits.timeout:g}s (time limit)")
+            return None
         except Exception as e:
             print(f"❌ Error in SYSTEM REPL: {e}")
             return None
@@ -142,16 +295,21 @@ import sys
 import os
 sys.path.append(os.getcwd())
 from fetch_and_calculate import fetch_all_bookings_for_user, fetch_and_explain_booking
+{AGENT_IMPORTS}
+from agent_results import format_result, result_value
 
 print("🤖 Agent REPL Environment Loaded!")
 print("Available functions:")
 print("- fetch_all_bookings_for_user(username)")
 print("- fetch_and_explain_booking(booking_id)")
+print("- {', '.join(AGENT_FUNCTIONS)}")
 print("\\nExecuting agent command: {code_to_execute}")
 print("=" * 50)
 
 # Execute the agent command
 result = {code_to_execute}
+print(format_result(result))
+result = result_value(result)
 
 print("=" * 50)
 print(f"🎯 Agent execution result: {{result}}")
@@ -179,338 +337,166 @@ code.interact(local=locals())
             print(f"❌ Error in INTERACTIVE REPL: {e}")
             return None
     
-    def process_command(self, user_input, repl_mode='local'):
-        """Process natural language command and execute appropriate function"""
-        intent, params = self.parse_natural_language(user_input)
-        
-        if intent is None:
-            return "❓ I don't understand that command. Type 'help' for available commands."
-        
-        # Generate the appropriate Python code to execute
-        code_to_execute = None
+    def generate_code(self, intent, params, user=None):
+        """Python expression that runs an intent, or None if there is none
         
+        ``user`` is the caller's logged-in username, if any (used by "my bookings").
+        """
         if intent == 'booking_by_id':
-            booking_id = params[0]
-            code_to_execute = f"result = fetch_and_explain_booking({booking_id})"
-            
+            return f"booking_details({int(params[0])})"
         elif intent == 'booking_by_user':
-            username = params[0]
             # EXACT case-sensitive search - shows only the exact username requested
-            code_to_execute = f'''
-import sqlite3
-conn = sqlite3.connect("travel.db")
-c = conn.cursor()
-
-# Find users with EXACT username match (case sensitive)
-c.execute("SELECT id, username FROM users WHERE username = ?", ("{username}",))
-exact_users = c.fetchall()
-
-if not exact_users:
-    print(f"No users found with EXACT name '{username}' (case sensitive)")
-    # Offer case-insensitive search as suggestion
-    c.execute("SELECT id, username FROM users WHERE lower(username) = lower(?)", ("{username}",))
-    similar_users = c.fetchall()
-    if similar_users:
-        similar_names = [user[1] for user in similar_users]
-        print(f"� Did you mean one of these similar users? {{similar_names}}")
-    result = 0.0
-else:
-    user_id, user_name = exact_users[0]
-    print(f"\\n� Found EXACT user: {{user_name}} (ID: {{user_id}})")
-    print("📋 SHOWING ALL BOOKINGS:")
-    print("="*60)
+            return f"user_bookings({params[0]!r})"
+        elif intent == 'user_total':
+            # Case-insensitive user search for totals - works for ANY username
+            return f"user_total({params[0]!r})"
+        elif intent == 'booking_owner':
+            return f"booking_owner({int(params[0])})"
+        elif intent == 'all_bookings':
+            # First page only; bigger systems page on with "show all bookings page 2"
+            return "bookings_page()"
+        elif intent == 'bookings_page':
+            page, after_id = params
+            if after_id is not None:
+                return f"bookings_page(after_id={int(after_id)})"
+            return f"bookings_page({int(page)})"
+        elif intent == 'latest_bookings':
+            return f"latest_bookings({self._capped_count(params[0])})"
+        elif intent == 'top_users':
+            return f"top_users({self._capped_count(params[0])})"
+        elif intent == 'provide_all_bookings':
+            # Show ALL bookings in the system for ALL users with calculations
+            return "system_report()"
+        elif intent == 'my_bookings':
+            # The CLI has no logged-in user; the web interface passes its session's user
+            if user:
+                return f"user_bookings({user!r})"
+            return "my_bookings()"
+        elif intent == 'multiple_bookings':
+            booking_ids = [int(bid.strip()) for bid in params[0].split(',') if bid.strip().isdigit()]
+            booking_ids, skipped = cap_rows(booking_ids, self.limits.max_rows)
+            if skipped:
+                return f"multiple_bookings({booking_ids}, skipped={skipped})"
+            return f"multiple_bookings({booking_ids})"
+        return None
     
-    c.execute("SELECT id FROM bookings WHERE user_id=?", (user_id,))
-    user_bookings = [row[0] for row in c.fetchall()]
+    def _capped_count(self, count):
+        """A requested "top N" / "latest N" count, kept within the row limit"""
+        count = int(count)
+        if self.limits.max_rows is not None:
+            count = min(count, self.limits.max_rows)
+        return count
     
-    if not user_bookings:
-        print(f"No bookings found for user '{{user_name}}'")
-        result = 0.0
-    else:
-        from collections import defaultdict
-        route_totals = defaultdict(float)
-        user_total = 0.0
+    def process_command(self, user_input, repl_mode='local', structured=False, progress=None, cancel=None,
+                        user=None, emit=None):
+        """Process natural language command and execute appropriate function
         
-        for bid in sorted(user_bookings):
-            price = fetch_and_explain_booking(bid)
-            if price:
-                # Get route info for this booking
-                c.execute("""
-                    SELECT r.origin, r.destination 
-                    FROM bookings b 
-                    JOIN routes r ON b.route_id = r.id 
-                    WHERE b.id = ?
-                """, (bid,))
-                route_info = c.fetchone()
-                if route_info:
-                    route_key = f"{{route_info[0]}} -> {{route_info[1]}}"
-                    route_totals[route_key] += price
-                user_total += price
+        In text mode the result is printed and its plain value returned. With
+        structured=True the command runs locally and the typed record from
+        agent_results is returned without printing anything.
         
-        # Show summary for this exact user
-        print("\\n" + "="*50)
-        print(f"📊 ROUTE-WISE SUMMARY FOR USER '{{user_name}}':")
-        print("="*50)
-        for route, total in route_totals.items():
-            print(f"Route {{route}}: {{total}}")
-        print("-"*30)
-        print(f"🎯 TOTAL FOR {{user_name}}: {{user_total}}")
-        print("="*50)
+        Long commands call ``progress(done, total)`` as they go and stop with
+        a "cancelled" cut-off once ``cancel`` (sandbox.CancellationToken) is
+        cancelled. Booking reports also pass each booking to ``emit(booking)``
+        as soon as it is priced; a cached result emits nothing. All three only
+        apply to local execution.
         
-        result = user_total
-
-conn.close()
-'''
-            
-        elif intent == 'user_total':
-            username = params[0]
-            # Dynamic case-insensitive user search for totals - works for ANY username
-            code_to_execute = f'''
-import sqlite3
-conn = sqlite3.connect("travel.db")
-c = conn.cursor()
-
-# Find all users with same name (case insensitive) - DYNAMIC for any username
-c.execute("SELECT id, username FROM users WHERE lower(username) = lower(?)", ("{username}",))
-matching_users = c.fetchall()
-
-if not matching_users:
-    print(f"No users found with name '{username}' (case insensitive)")
-    result = 0.0
-else:
-    if len(matching_users) > 1:
-        user_names = [user[1] for user in matching_users]
-        print(f"\\n📊 CALCULATING TOTAL FOR ALL '{username.upper()}' USERS: {{user_names}}")
-    else:
-        user_name = matching_users[0][1]
-        print(f"\\n📊 CALCULATING TOTAL FOR USER '{{user_name}}'...")
-    
-    all_booking_ids = []
-    for user_id, user_name in matching_users:
-        c.execute("SELECT id FROM bookings WHERE user_id=?", (user_id,))
-        user_bookings = [row[0] for row in c.fetchall()]
-        all_booking_ids.extend(user_bookings)
+        The agent keeps no per-caller state, so one instance can serve many
+        sessions; ``user`` is the calling session's logged-in username.
+        """
+        with self.tracer.span('command', command=user_input, structured=structured):
+            return self._process_command(user_input, repl_mode, structured, progress, cancel, user, emit)
     
-    if not all_booking_ids:
-        print(f"No bookings found for user(s) with name '{username}'")
-        result = 0.0
-    else:
-        from collections import defaultdict
-        route_totals = defaultdict(float)
-        grand_total = 0.0
+    def _process_command(self, user_input, repl_mode, structured, progress=None, cancel=None, user=None,
+                         emit=None):
+        with self.tracer.span('parse'):
+            intent, params = self.parse_natural_language(user_input)
+        
+        if intent is None:
+            message = "❓ I don't understand that command. Type 'help' for available commands."
+            return AgentMessage(message, message) if structured else message
         
-        for bid in all_booking_ids:
-            # Get price by calling fetch_and_explain_booking but suppress its output
-            import io
-            import sys
-            old_stdout = sys.stdout
-            sys.stdout = buffer = io.StringIO()
+        if intent == 'help':
+            help_text = self.show_help()
+            return AgentMessage(help_text, help_text) if structured else help_text
+        
+        if intent == 'explain_plan':
+            profile = self.explain_plan(params[0], user)
+            if structured:
+                return profile
+            print(format_result(profile))
+            return result_value(profile)
+        
+        # Generate the appropriate Python code to execute
+        with self.tracer.span('generate', intent=intent):
+            code_to_execute = self.generate_code(intent, params, user)
+        if not code_to_execute:
+            message = "❓ Could not generate executable code for that command."
+            return AgentMessage(message, message) if structured else message
+        
+        entry = version = None
+        if self.cache is not None and (structured or repl_mode not in ('system', 'interactive')):
+            with self.tracer.span('cache'):
+                entry, version = self.cache.lookup(code_to_execute)
+        
+        if structured:
+            if entry is not None:
+                return entry.copy_result()
             try:
-                price = fetch_and_explain_booking(bid)
-            finally:
-                sys.stdout = old_stdout
-            
-            if price:
-                # Get route info for this booking
-                c.execute("""
-                    SELECT r.origin, r.destination 
-                    FROM bookings b 
-                    JOIN routes r ON b.route_id = r.id 
-                    WHERE b.id = ?
-                """, (bid,))
-                route_info = c.fetchone()
-                if route_info:
-                    route_key = f"{{route_info[0]}} -> {{route_info[1]}}"
-                    route_totals[route_key] += price
-                grand_total += price
+                result = self.run_code(f"result = {code_to_execute}", progress, cancel, emit)
+            except CommandCutOff as e:
+                return AgentMessage(f"⛔ {e}", error=True)
+            except Exception as e:
+                return AgentMessage(f"❌ Error: {e}", error=True)
+            self._store(code_to_execute, result, version)
+            return result
         
-        print("\\n" + "="*50)
-        if len(matching_users) > 1:
-            print(f"📊 ROUTE-WISE SUMMARY FOR ALL '{username.upper()}' USERS:")
-        else:
-            print("📊 ROUTE-WISE SUMMARY:")
-        print("="*50)
-        for route, total in route_totals.items():
-            print(f"Route {{route}}: {{total}}")
-        print("-"*30)
-        if len(matching_users) > 1:
-            print(f"🎯 GRAND TOTAL FOR ALL '{username.upper()}': {{grand_total}}")
-        else:
-            print(f"🎯 GRAND TOTAL: {{grand_total}}")
-        print("="*50)
-        result = grand_total
-
-conn.close()
-result
-'''
-            
-        elif intent == 'booking_owner':
-            booking_id = params[0]
-            code_to_execute = f'''
-import sqlite3
-conn = sqlite3.connect("travel.db")
-c = conn.cursor()
-c.execute("""
-    SELECT u.username, b.id 
-    FROM bookings b 
-    JOIN users u ON b.user_id = u.id 
-    WHERE b.id = ?
-""", ({booking_id},))
-result_row = c.fetchone()
-if result_row:
-    username, bid = result_row
-    print(f"📍 Booking ID {{bid}} belongs to user: {{username}}")
-    result = f"Booking {{bid}} → User: {{username}}"
-else:
-    print(f"❌ Booking ID {{booking_id}} not found")
-    result = f"Booking {{booking_id}} not found"
-conn.close()
-result
-'''
-            
-        elif intent == 'all_bookings':
-            code_to_execute = f'''
-import sqlite3
-conn = sqlite3.connect("travel.db")
-c = conn.cursor()
-c.execute("""
-    SELECT b.id, u.username, r.origin, r.destination
-    FROM bookings b 
-    JOIN users u ON b.user_id = u.id 
-    JOIN routes r ON b.route_id = r.id
-    ORDER BY b.id
-""")
-all_bookings = c.fetchall()
-print("\\n📋 ALL BOOKINGS IN SYSTEM:")
-print("="*60)
-for bid, username, origin, dest in all_bookings:
-    print(f"Booking {{bid:2}} → User: {{username:10}} → Route: {{origin}} -> {{dest}}")
-print("="*60)
-print(f"Total bookings in system: {{len(all_bookings)}}")
-conn.close()
-result = f"Found {{len(all_bookings)}} total bookings"
-result
-'''
-
-        elif intent == 'provide_all_bookings':
-            # Show ALL bookings in the system for ALL users with calculations
-            code_to_execute = '''
-import sqlite3
-conn = sqlite3.connect("travel.db")
-c = conn.cursor()
-
-# Get all users
-c.execute("SELECT DISTINCT username FROM users ORDER BY username")
-all_users = [row[0] for row in c.fetchall()]
-
-if not all_users:
-    print("No users found in the system")
-    result = 0.0
-else:
-    print("📋 ALL BOOKINGS IN SYSTEM - COMPLETE ANALYSIS:")
-    print("="*70)
+        # Execute based on REPL mode
+        if repl_mode == 'system':
+            return self.execute_system_repl(code_to_execute)
+        elif repl_mode == 'interactive':
+            return self.execute_interactive_repl(code_to_execute)
+        else:  # local
+            if entry is None:
+                result = self.execute_in_repl(f"result = {code_to_execute}", progress, cancel, emit)
+                if result is None:
+                    return None
+                entry = self._store(code_to_execute, result, version)
+            if entry.text is None:
+                with self.tracer.span('format'):
+                    entry.text = cap_output(format_result(entry.result), self.limits.max_output_chars)
+            print(entry.text)
+            return result_value(entry.result)
     
-    total_system_price = 0.0
-    total_bookings = 0
-    users_with_bookings = 0
-    
-    for username in all_users:
-        c.execute("SELECT id FROM users WHERE username=?", (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            continue
-            
-        user_id = user_row[0]
-        c.execute("SELECT id FROM bookings WHERE user_id=?", (user_id,))
-        user_bookings = [row[0] for row in c.fetchall()]
+    def explain_plan(self, command, user=None):
+        """Run ``command`` once, uncached, and profile the SQL it issues
         
-        if user_bookings:
-            users_with_bookings += 1
-            print(f"\\n👤 USER: {username.upper()} ({len(user_bookings)} bookings)")
-            print("-" * 50)
-            
-            user_total = 0.0
-            for bid in user_bookings:
-                price = fetch_and_explain_booking(bid)
-                if price:
-                    user_total += price
-                    total_system_price += price
-                    total_bookings += 1
-                print("-" * 30)
-            
-            print(f"\\n💰 TOTAL FOR {username.upper()}: ${user_total:.2f}")
-            print("=" * 50)
-    
-    print(f"\\n🎯 GRAND TOTAL - ALL USERS: ${total_system_price:.2f}")
-    print(f"📊 TOTAL BOOKINGS: {total_bookings}")
-    print(f"👥 USERS WITH BOOKINGS: {users_with_bookings}")
-    
-    result = total_system_price
-
-conn.close()
-result
-'''
-
-        elif intent == 'my_bookings':
-            # For CLI usage, ask for username. For web usage, this will be handled by the web interface
-            # The web interface should pass the current username to this method
-            # We'll provide a helpful message for CLI users
-            code_to_execute = '''
-import sqlite3
-# Check if we can determine a current user (this will work when called from web interface)
-current_user = None
-
-# For CLI usage, we need the user to specify
-if not current_user:
-    print("📋 To view your bookings, you have two options:")
-    print("1. Use the web interface (login automatically provides your username)")
-    print("2. In CLI, use: 'show bookings for [your_username]'")
-    print("")
-    print("Examples:")
-    print("• 'show bookings for nikitha'")
-    print("• 'show bookings for john'")
-    print("• 'all bookings for [username]'")
-    result = "Please specify username for booking queries"
-else:
-    # This would execute if called with user context (from web interface)
-    result = fetch_all_bookings_for_user(current_user)
-result
-'''
-            
-        elif intent == 'my_bookings':
-            # For CLI usage, ask for username. For web usage, this will be handled by the web interface
-            code_to_execute = '''
-print("📋 To view your bookings, you have two options:")
-print("1. Use the web interface (login automatically provides your username)")
-print("2. In CLI, use: 'show bookings for [your_username]'")
-print("")
-print("Examples:")
-print("• 'show bookings for nikitha'")
-print("• 'show bookings for john'")
-print("• 'all bookings for [username]'")
-result = "Please specify username for booking queries"
-result
-'''
-            
-        elif intent == 'multiple_bookings':
-            booking_ids = [id.strip() for id in params[0].split(',')]
-            # Create a simple loop for multiple bookings
-            booking_ids_int = [int(bid) for bid in booking_ids if bid.isdigit()]
-            code_to_execute = f"sum([fetch_and_explain_booking(bid) or 0 for bid in {booking_ids_int}])"
-            
-        elif intent == 'help':
-            return self.show_help()
+        Returns an agent_results.CommandProfile (see query_profiler.py).
+        """
+        intent, params = self.parse_natural_language(command)
+        if intent in (None, 'help', 'explain_plan'):
+            message = f"❓ Nothing to profile: \"{command}\" does not run any queries."
+            return AgentMessage(message, message)
+        code_to_execute = self.generate_code(intent, params, user)
+        if not code_to_execute:
+            message = "❓ Could not generate executable code for that command."
+            return AgentMessage(message, message)
         
-        if code_to_execute:
-            # Execute based on REPL mode
-            if repl_mode == 'system':
-                return self.execute_system_repl(code_to_execute)
-            elif repl_mode == 'interactive':
-                return self.execute_interactive_repl(code_to_execute)
-            else:  # local
-                return self.execute_in_repl(code_to_execute)
+        def run(conn, tracer):
+            self._exec_with_deadline(f"result = {code_to_execute}", conn, tracer=tracer)
         
-        return "❓ Could not generate executable code for that command."
+        # A fresh connection so the profile doesn't share statement caches with the pool
+        conn = sqlite3.connect(self.pool.db_path if self.pool is not None else DB_PATH)
+        try:
+            return profile_code(command, intent, code_to_execute, conn, run)
+        finally:
+            conn.close()
+    
+    def _store(self, key, result, version):
+        """Cache a successful result; returns its CacheEntry either way"""
+        if self.cache is None or getattr(result, 'error', False):
+            return CacheEntry(result, 0)
+        return self.cache.put(key, result, version)
     
     def show_help(self):
         """Show available commands"""
@@ -531,6 +517,16 @@ result
 🔢 MULTIPLE SPECIFIC BOOKINGS:
 • "show bookings 1, 2, 3" - Sum of specific booking IDs
 
+📄 LISTINGS (paged):
+• "list all bookings" - First page of all bookings
+• "show all bookings page 3" / "show bookings after 150" - Later pages
+• "latest 10 bookings" - Most recent bookings
+• "top 5 users by spend" - Users who spent the most
+
+🔬 DIAGNOSTICS:
+• "profile total price for user nikitha" - SQL, query plans and timings
+• "explain plan show all bookings" - Flags full scans and N+1 queries
+
 🆘 OTHER:
 • "help" - Show this help
 • "quit" - Exit
@@ -572,10 +568,92 @@ result
 
 
 
-if __name__ == "__main__":
-    print("🚀 Travel Booking Agent")
-    print("=" * 30)
+def run_batch(agent, lines, output, workers=1, chunk_size=256):
+    """Run one command per input line and write one JSON line per result.
+    
+    Blank lines and lines starting with '#' are skipped. Results are written
+    in input order even when several worker threads run commands at once.
+    Returns the number of commands run.
+    """
+    def run_one(item):
+        line_number, command = item
+        started = time.perf_counter()
+        intent, _ = agent.parse_natural_language(command)
+        result = agent.process_command(command, structured=True)
+        return {
+            'line': line_number,
+            'command': command,
+            'intent': intent,
+            'ok': not getattr(result, 'error', False),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+            'result': result_to_dict(result),
+        }
+    
+    commands = ((number, line.strip()) for number, line in enumerate(lines, 1)
+                if line.strip() and not line.lstrip().startswith('#'))
+    count = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while True:
+            # Submit a chunk at a time so huge inputs are not all held in memory
+            chunk = list(islice(commands, chunk_size))
+            if not chunk:
+                break
+            for record in executor.map(run_one, chunk):
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            count += len(chunk)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Travel Booking Agent")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run commands from FILE ('-' for stdin) and print JSON lines")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker threads for --batch (default: 1)")
+    parser.add_argument('--output', metavar='FILE',
+                        help="write --batch results to FILE instead of stdout")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="record per-stage and SQL spans to FILE on exit "
+                             "(JSON lines for *.jsonl, Chrome trace-event JSON otherwise)")
+    args = parser.parse_args(argv)
+    tracer = Tracer() if args.trace else None
+    
+    if not args.batch:
+        print("🚀 Travel Booking Agent")
+        print("=" * 30)
+        
+        agent = TravelBookingAgent(tracer=tracer)
+        print(agent.show_help())
+        try:
+            agent.chat_loop()
+        finally:
+            if tracer:
+                tracer.export(args.trace)
+        return
     
-    agent = TravelBookingAgent()
-    print(agent.show_help())
-    agent.chat_loop()
+    pool = ConnectionPool()
+    agent = TravelBookingAgent(pool=pool, tracer=tracer)
+    source = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    started = time.perf_counter()
+    try:
+        count = run_batch(agent, source, output, workers=args.workers)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        pool.close_all()
+        if tracer:
+            tracer.export(args.trace)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Ran {count} commands in {elapsed:.2f}s", file=sys.stderr)
+    if agent.cache is not None:
+        stats = agent.cache.stats()
+        print(f"🗃️ Result cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"(hit rate {stats['hit_rate']:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
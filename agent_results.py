@@ -0,0 +1,361 @@
+"""
+Typed results returned by TravelBookingAgent.process_command(..., structured=True)
+
+Every record keeps ``value``: the plain number or string the agent used to
+return in text mode. ``format_result`` renders a record as the text the CLI
+prints; the Streamlit app renders the same records with its own markup.
+"""
+from dataclasses import dataclass, field, asdict, is_dataclass
+
+from fetch_and_calculate import BookingBreakdown, explain_booking
+
+
+@dataclass
+class AgentMessage:
+    """Plain text reply (help, instructions, errors, unknown commands)"""
+    text: str
+    value: object = None
+    error: bool = False
+
+
+@dataclass
+class MissingBooking:
+    """A requested booking that could not be priced"""
+    booking_id: int
+    message: str
+    final_price = None
+    value = None
+
+
+@dataclass
+class UserBookings:
+    """All bookings of one exact (case-sensitive) username"""
+    requested_user: str
+    user_id: int = None
+    username: str = None
+    similar_users: list = field(default_factory=list)
+    bookings: list = field(default_factory=list)
+    route_totals: dict = field(default_factory=dict)
+    total: float = 0.0
+
+    @property
+    def value(self):
+        return self.total
+
+
+@dataclass
+class UserTotal:
+    """Route-wise totals for every user whose name matches case-insensitively"""
+    requested_user: str
+    usernames: list = field(default_factory=list)
+    booking_count: int = 0
+    route_totals: dict = field(default_factory=dict)
+    grand_total: float = 0.0
+
+    @property
+    def value(self):
+        return self.grand_total
+
+
+@dataclass
+class BookingOwner:
+    """Which user a booking belongs to (username is None when not found)"""
+    booking_id: int
+    username: str = None
+
+    @property
+    def value(self):
+        if self.username is None:
+            return f"Booking {self.booking_id} not found"
+        return f"Booking {self.booking_id} → User: {self.username}"
+
+
+@dataclass
+class BookingListingRow:
+    booking_id: int
+    username: str
+    origin: str
+    destination: str
+
+
+@dataclass
+class BookingListing:
+    """One line per booking: id, user and route
+    
+    Paged listings set ``page`` (or ``after_id`` for "after X" cursors) and
+    ``next_after``, the booking ID to continue from when there are more rows.
+    """
+    rows: list = field(default_factory=list)
+    heading: str = None
+    page: int = None
+    after_id: int = None
+    page_size: int = None
+    next_after: int = None
+
+    @property
+    def complete(self):
+        """True when the rows are every booking in the system"""
+        return self.heading is None and self.after_id is None and self.page in (None, 1) and self.next_after is None
+
+    @property
+    def value(self):
+        if not self.complete:
+            return f"Showing {len(self.rows)} bookings"
+        return f"Found {len(self.rows)} total bookings"
+
+
+@dataclass
+class TopUserRow:
+    username: str
+    booking_count: int
+    total: float
+
+
+@dataclass
+class TopUsers:
+    """Users ranked by what they spent (sum of final prices)"""
+    count: int
+    rows: list = field(default_factory=list)
+
+    @property
+    def value(self):
+        return {row.username: row.total for row in self.rows}
+
+
+@dataclass
+class UserReport:
+    """One user's section of the system report"""
+    username: str
+    bookings: list = field(default_factory=list)
+    total: float = 0.0
+
+
+@dataclass
+class SystemReport:
+    """Every booking of every user, with per-user and system totals"""
+    users: list = field(default_factory=list)
+    user_count: int = 0
+    total: float = 0.0
+    booking_count: int = 0
+
+    @property
+    def value(self):
+        return self.total
+
+
+@dataclass
+class MultipleBookings:
+    """Specific booking IDs and the sum of their final prices"""
+    bookings: list = field(default_factory=list)
+    total: float = 0
+    skipped: int = 0
+
+    @property
+    def value(self):
+        return self.total
+
+
+@dataclass
+class StatementProfile:
+    """One SQL statement shape an agent command ran (see query_profiler.py)"""
+    sql: str
+    calls: int = 0
+    total_ms: float = 0.0
+    rows: int = None
+    plan: list = field(default_factory=list)
+    full_scans: list = field(default_factory=list)
+    n_plus_one: bool = False
+
+
+@dataclass
+class CommandProfile:
+    """SQL statements, query plans and timings of one agent command"""
+    command: str
+    intent: str
+    code: str
+    elapsed_ms: float = 0.0
+    statements: list = field(default_factory=list)
+    error: str = None
+
+    @property
+    def value(self):
+        return sum(s.calls for s in self.statements)
+
+
+def _format_booking(entry):
+    if isinstance(entry, MissingBooking):
+        return entry.message
+    return explain_booking(entry)
+
+
+def _format_user_bookings(r):
+    if r.user_id is None:
+        lines = [f"No users found with EXACT name '{r.requested_user}' (case sensitive)"]
+        if r.similar_users:
+            lines.append(f"� Did you mean one of these similar users? {r.similar_users}")
+        return lines
+    lines = [
+        f"\n� Found EXACT user: {r.username} (ID: {r.user_id})",
+        "📋 SHOWING ALL BOOKINGS:",
+        "=" * 60,
+    ]
+    if not r.bookings:
+        lines.append(f"No bookings found for user '{r.username}'")
+        return lines
+    lines += [_format_booking(b) for b in r.bookings]
+    lines += [
+        "\n" + "=" * 50,
+        f"📊 ROUTE-WISE SUMMARY FOR USER '{r.username}':",
+        "=" * 50,
+    ]
+    lines += [f"Route {route}: {total}" for route, total in r.route_totals.items()]
+    lines += ["-" * 30, f"🎯 TOTAL FOR {r.username}: {r.total}", "=" * 50]
+    return lines
+
+
+def _format_user_total(r):
+    if not r.usernames:
+        return [f"No users found with name '{r.requested_user}' (case insensitive)"]
+    many = len(r.usernames) > 1
+    if many:
+        lines = [f"\n📊 CALCULATING TOTAL FOR ALL '{r.requested_user.upper()}' USERS: {r.usernames}"]
+    else:
+        lines = [f"\n📊 CALCULATING TOTAL FOR USER '{r.usernames[0]}'..."]
+    if not r.booking_count:
+        lines.append(f"No bookings found for user(s) with name '{r.requested_user}'")
+        return lines
+    lines += [
+        "\n" + "=" * 50,
+        f"📊 ROUTE-WISE SUMMARY FOR ALL '{r.requested_user.upper()}' USERS:" if many else "📊 ROUTE-WISE SUMMARY:",
+        "=" * 50,
+    ]
+    lines += [f"Route {route}: {total}" for route, total in r.route_totals.items()]
+    lines.append("-" * 30)
+    if many:
+        lines.append(f"🎯 GRAND TOTAL FOR ALL '{r.requested_user.upper()}': {r.grand_total}")
+    else:
+        lines.append(f"🎯 GRAND TOTAL: {r.grand_total}")
+    lines.append("=" * 50)
+    return lines
+
+
+def _format_system_report(r):
+    if not r.user_count:
+        return ["No users found in the system"]
+    lines = ["📋 ALL BOOKINGS IN SYSTEM - COMPLETE ANALYSIS:", "=" * 70]
+    for user in r.users:
+        lines += [f"\n👤 USER: {user.username.upper()} ({len(user.bookings)} bookings)", "-" * 50]
+        for booking in user.bookings:
+            lines += [_format_booking(booking), "-" * 30]
+        lines += [f"\n💰 TOTAL FOR {user.username.upper()}: ${user.total:.2f}", "=" * 50]
+    lines += [
+        f"\n🎯 GRAND TOTAL - ALL USERS: ${r.total:.2f}",
+        f"📊 TOTAL BOOKINGS: {r.booking_count}",
+        f"👥 USERS WITH BOOKINGS: {len(r.users)}",
+    ]
+    return lines
+
+
+def _format_listing(r):
+    if r.heading:
+        heading = r.heading
+    elif r.complete:
+        heading = "\n📋 ALL BOOKINGS IN SYSTEM:"
+    elif r.page is not None:
+        heading = f"\n📋 ALL BOOKINGS IN SYSTEM (page {r.page}, {r.page_size} per page):"
+    else:
+        heading = f"\n📋 BOOKINGS AFTER ID {r.after_id}:"
+    lines = [heading, "=" * 60]
+    lines += [f"Booking {row.booking_id:2} → User: {row.username:10} → Route: {row.origin} -> {row.destination}"
+              for row in r.rows]
+    lines.append("=" * 60)
+    if r.complete:
+        lines.append(f"Total bookings in system: {len(r.rows)}")
+    elif not r.rows:
+        lines.append("No bookings on this page")
+    else:
+        lines.append(f"Showing {len(r.rows)} bookings")
+    if r.next_after is not None:
+        hint = f"'show bookings after {r.next_after}'"
+        if r.page is not None:
+            hint = f"'show all bookings page {r.page + 1}' or {hint}"
+        lines.append(f"➡️ More bookings: {hint}")
+    return lines
+
+
+def _format_top_users(r):
+    lines = [f"\n🏆 TOP {r.count} USERS BY SPEND:", "=" * 60]
+    lines += [f"{rank:2}. {row.username:10} → {row.booking_count} bookings → ${row.total:.2f}"
+              for rank, row in enumerate(r.rows, 1)]
+    if not r.rows:
+        lines.append("No priced bookings found")
+    lines.append("=" * 60)
+    return lines
+
+
+def _format_profile(r):
+    queries = sum(s.calls for s in r.statements)
+    lines = [f"\n🔬 QUERY PROFILE: \"{r.command}\"", "=" * 60,
+             f"🧭 Intent: {r.intent} → {r.code}",
+             f"⏱️ {r.elapsed_ms:.2f} ms, {queries} queries ({len(r.statements)} distinct)"]
+    if r.error:
+        lines.append(f"❌ Command failed: {r.error}")
+    for number, s in enumerate(r.statements, 1):
+        rows = f", {s.rows} rows" if s.rows is not None else ""
+        lines += ["-" * 60, f"#{number} ran {s.calls}x, {s.total_ms:.2f} ms{rows}", f"   {s.sql}"]
+        lines += [f"   📐 {detail}" for detail in s.plan]
+        lines += [f"   🐢 Full scan: {detail}" for detail in s.full_scans]
+        if s.n_plus_one:
+            lines.append(f"   🔁 N+1: same query ran {s.calls} times in one command")
+    scans = sum(1 for s in r.statements if s.full_scans)
+    repeats = sum(1 for s in r.statements if s.n_plus_one)
+    lines += ["=" * 60, f"📋 {scans} statements with full scans, {repeats} N+1 patterns"]
+    return lines
+
+
+def _format_owner(r):
+    if r.username is None:
+        return [f"❌ Booking ID {r.booking_id} not found"]
+    return [f"📍 Booking ID {r.booking_id} belongs to user: {r.username}"]
+
+
+def format_result(result):
+    """Render an agent record as the text the CLI prints"""
+    if isinstance(result, AgentMessage):
+        return result.text
+    if isinstance(result, (BookingBreakdown, MissingBooking)):
+        return _format_booking(result)
+    if isinstance(result, UserBookings):
+        return "\n".join(_format_user_bookings(result))
+    if isinstance(result, UserTotal):
+        return "\n".join(_format_user_total(result))
+    if isinstance(result, BookingOwner):
+        return "\n".join(_format_owner(result))
+    if isinstance(result, BookingListing):
+        return "\n".join(_format_listing(result))
+    if isinstance(result, TopUsers):
+        return "\n".join(_format_top_users(result))
+    if isinstance(result, SystemReport):
+        return "\n".join(_format_system_report(result))
+    if isinstance(result, CommandProfile):
+        return "\n".join(_format_profile(result))
+    if isinstance(result, MultipleBookings):
+        lines = [_format_booking(b) for b in result.bookings]
+        if result.skipped:
+            lines.append(f"✂️ Showed the first {len(result.bookings)} bookings; "
+                         f"{result.skipped} more IDs skipped (row limit)")
+        return "\n".join(lines)
+    return str(result)
+
+
+def result_value(result):
+    """The plain number/string a record stands for (text-mode return value)"""
+    if isinstance(result, BookingBreakdown):
+        return result.final_price
+    return getattr(result, 'value', result)
+
+
+def result_to_dict(result):
+    """JSON-ready dict of a record, tagged with its type and plain value"""
+    data = asdict(result) if is_dataclass(result) else {}
+    return {'type': type(result).__name__, 'value': result_value(result), **data}
@@ -0,0 +1,268 @@
+"""
+Local HTTP server exposing the Travel Booking Agent as JSON endpoints
+
+    python agent_server.py [--host 127.0.0.1] [--port 8765] [--workers 8]
+
+Endpoints:
+    GET  /health                   -> {"status": "ok", "cache": {...hit-rate stats}}
+    POST /command  {"command": "total price for user nikitha"}
+    GET  /bookings                 -> bookings_page(); ?page=N or ?after=<id>, &size=N
+    GET  /bookings/latest?n=10     -> latest_bookings(n)
+    GET  /users/top?n=10           -> top_users(n)
+    GET  /bookings/<id>            -> booking_details(id)
+    GET  /bookings/<id>/owner      -> booking_owner(id)
+    GET  /users/<name>/bookings    -> user_bookings(name)
+    GET  /users/<name>/total       -> user_total(name)
+    POST /rpc      JSON-RPC 2.0; methods: process_command and the functions
+                   in agent_repl.DIRECT_FUNCTIONS, e.g.
+                   {"jsonrpc": "2.0", "id": 1, "method": "user_total", "params": ["nikitha"]}
+
+Requests are handled by a fixed pool of worker threads, each with its own
+pooled SQLite connection, and connections are kept alive (HTTP/1.1).
+JSON-RPC notifications (requests without an "id") are run and answered
+with an empty 204.
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from agent_commands import BOOKINGS_PAGE_SIZE
+from agent_repl import DIRECT_FUNCTIONS, TravelBookingAgent
+from agent_results import result_to_dict
+from db import ConnectionPool
+from sandbox import CommandCutOff
+
+
+class BoundedThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer that serves each connection on a fixed-size worker pool.
+
+    At most ``workers`` connections are served at once; the accept loop waits
+    when ``workers + backlog`` connections are already in flight, so load
+    beyond that stays in the kernel's listen queue instead of spawning threads.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, agent, workers=8, backlog=64):
+        super().__init__(server_address, handler_class)
+        self.agent = agent
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='agent-http')
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._open = set()
+        self._open_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        with self._open_lock:
+            self._open.add(request)
+        try:
+            self._executor.submit(self._serve, request, client_address)
+        except RuntimeError:
+            # Executor already shut down
+            self._forget(request)
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _forget(self, request):
+        with self._open_lock:
+            self._open.discard(request)
+
+    def _serve(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self._forget(request)
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        # Idle keep-alive connections would otherwise hold their worker for
+        # the handler's whole timeout; shutting them down ends the read at once
+        with self._open_lock:
+            for request in self._open:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self._executor.shutdown(wait=True)
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """JSON request handler; keeps connections alive between requests"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'TravelBookingAgent/1.0'
+    # Idle keep-alive connections give their worker back after this long
+    timeout = 30
+    # Write headers and body in one segment; without these small responses
+    # wait on Nagle + delayed ACK (~40 ms) on keep-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep the console quiet under load; errors still go to stderr
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def _call(self, name, *args, **kwargs):
+        """Run an agent function on this worker's pooled connection, within the agent's limits"""
+        return self.server.agent.call_function(name, *args, **kwargs)
+
+    def _run_command(self, command):
+        agent = self.server.agent
+        started = time.perf_counter()
+        intent, _ = agent.parse_natural_language(command)
+        result = agent.process_command(command, structured=True)
+        return {
+            'command': command,
+            'intent': intent,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+            'result': result_to_dict(result),
+        }
+
+    def _count_param(self, query, name, default):
+        """Positive integer query parameter, capped at the agent's row limit"""
+        value = int(query.get(name, [default])[0])
+        max_rows = self.server.agent.limits.max_rows
+        return max(1, min(value, max_rows) if max_rows else value)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        query = parse_qs(url.query)
+        try:
+            if parts == ['health']:
+                cache = self.server.agent.cache
+                return self._send_json(200, {'status': 'ok', 'cache': cache.stats() if cache else None})
+            if parts == ['bookings']:
+                size = self._count_param(query, 'size', BOOKINGS_PAGE_SIZE)
+                if 'after' in query:
+                    listing = self._call('bookings_page', after_id=int(query['after'][0]), page_size=size)
+                else:
+                    listing = self._call('bookings_page', int(query.get('page', [1])[0]), page_size=size)
+                return self._send_json(200, result_to_dict(listing))
+            if parts == ['bookings', 'latest']:
+                return self._send_json(200, result_to_dict(self._call('latest_bookings', self._count_param(query, 'n', 10))))
+            if parts == ['users', 'top']:
+                return self._send_json(200, result_to_dict(self._call('top_users', self._count_param(query, 'n', 10))))
+            if len(parts) == 2 and parts[0] == 'bookings' and parts[1].isdigit():
+                return self._send_json(200, result_to_dict(self._call('booking_details', int(parts[1]))))
+            if len(parts) == 3 and parts[0] == 'bookings' and parts[1].isdigit() and parts[2] == 'owner':
+                return self._send_json(200, result_to_dict(self._call('booking_owner', int(parts[1]))))
+            if len(parts) == 3 and parts[0] == 'users' and parts[2] == 'bookings':
+                return self._send_json(200, result_to_dict(self._call('user_bookings', parts[1])))
+            if len(parts) == 3 and parts[0] == 'users' and parts[2] == 'total':
+                return self._send_json(200, result_to_dict(self._call('user_total', parts[1])))
+        except CommandCutOff as e:
+            return self._send_json(504, {'error': str(e), 'cut_off': e.reason})
+        except ValueError as e:
+            return self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            return self._send_json(500, {'error': str(e)})
+        self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def _send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.rstrip('/')
+        try:
+            payload = self._read_json()
+        except ValueError as e:
+            if path == '/rpc':
+                return self._send_json(200, {'jsonrpc': '2.0', 'id': None,
+                                             'error': {'code': -32700, 'message': f"Parse error: {e}"}})
+            return self._send_json(400, {'error': f"Invalid JSON: {e}"})
+        if path == '/command':
+            if not isinstance(payload, dict) or not isinstance(payload.get('command'), str):
+                return self._send_json(400, {'error': "Expected {\"command\": \"...\"}"})
+            return self._send_json(200, self._run_command(payload['command']))
+        if path == '/rpc':
+            response = self._rpc(payload)
+            if response is None:
+                return self._send_empty(204)
+            return self._send_json(200, response)
+        self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def _rpc(self, request):
+        """Handle one JSON-RPC 2.0 request object; None for a notification"""
+        request_id = request.get('id') if isinstance(request, dict) else None
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return {'jsonrpc': '2.0', 'id': request_id,
+                    'error': {'code': -32600, 'message': 'Invalid Request'}}
+        response = self._rpc_response(request, request_id)
+        # A notification has no "id" member and never gets a response, not even an error
+        return response if 'id' in request else None
+
+    def _rpc_response(self, request, request_id):
+        method = request['method']
+        params = request.get('params') or []
+        args, kwargs = (params, {}) if isinstance(params, list) else ([], params)
+        try:
+            if method == 'process_command':
+                result = self._run_command(*args, **kwargs)
+            elif method in DIRECT_FUNCTIONS:
+                result = result_to_dict(self._call(method, *args, **kwargs))
+            else:
+                return {'jsonrpc': '2.0', 'id': request_id,
+                        'error': {'code': -32601, 'message': f"Method not found: {method}"}}
+        except TypeError as e:
+            return {'jsonrpc': '2.0', 'id': request_id,
+                    'error': {'code': -32602, 'message': f"Invalid params: {e}"}}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': request_id,
+                    'error': {'code': -32000, 'message': str(e)}}
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+
+def make_server(host='127.0.0.1', port=8765, workers=8, db_path=None):
+    """Build (but do not start) an agent server with its own connection pool"""
+    pool = ConnectionPool(db_path) if db_path else ConnectionPool()
+    agent = TravelBookingAgent(pool=pool)
+    return BoundedThreadPoolHTTPServer((host, port), AgentRequestHandler, agent, workers=workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Travel Booking Agent HTTP server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=8, help="worker threads (default: 8)")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.workers)
+    print(f"🚀 Travel Booking Agent server on http://{args.host}:{args.port} ({args.workers} workers)")
+    print("⏹️  Press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Server stopped")
+    finally:
+        server.server_close()
+        server.agent.pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
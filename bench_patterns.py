@@ -0,0 +1,91 @@
+"""
+Micro-benchmark for TravelBookingAgent.parse_natural_language
+Compares the old one-pattern-at-a-time loop with the compiled matcher
+(cold, with the parse cache cleared, and warm)
+"""
+import re
+import timeit
+
+from agent_repl import TravelBookingAgent
+
+# Real phrasings taken from the chat logs, help text and test scripts
+CORPUS = [
+    "show booking 1",
+    "explain booking for id 2",
+    "calculate price 7",
+    "get booking id 12",
+    "show bookings for nikitha",
+    "show me all bookings under Nikitha",
+    "find bookings of john",
+    "get booking for user 'Anupam'",
+    "provide all my bookings",
+    "provide all bookings",
+    "all my bookings",
+    "show my bookings",
+    "total price for user nikitha",
+    "Total Price under user \"Anupam\"",
+    "sum cost of John",
+    "show bookings 1, 2, 3",
+    "explain bookings 4,5",
+    "who owns booking 1",
+    "which user has booking 2",
+    "show all bookings",
+    "list all bookings",
+    "help",
+    "what can you do",
+    "book a ticket from delhi to paris",
+    "random text the agent does not know",
+]
+
+ROUNDS = 2000
+
+
+def legacy_parse(commands, user_input):
+    """The pre-compiled-matcher implementation, kept for comparison"""
+    original_input = user_input.strip()
+    user_input_lower = user_input.lower().strip()
+    for intent, pattern in commands.items():
+        match = re.search(pattern, user_input_lower)
+        if match:
+            if intent in ['booking_by_user', 'user_total']:
+                original_match = re.search(pattern, original_input, re.IGNORECASE)
+                if original_match:
+                    return intent, original_match.groups()
+            return intent, match.groups()
+    return None, None
+
+
+def main():
+    agent = TravelBookingAgent()
+
+    # Both implementations must agree before timing means anything
+    for phrase in CORPUS:
+        assert legacy_parse(agent.commands, phrase) == agent.parse_natural_language(phrase), phrase
+
+    def run_legacy():
+        for phrase in CORPUS:
+            legacy_parse(agent.commands, phrase)
+
+    def run_compiled_cold():
+        agent._parse_cached.cache_clear()
+        for phrase in CORPUS:
+            agent.parse_natural_language(phrase)
+
+    def run_compiled_warm():
+        for phrase in CORPUS:
+            agent.parse_natural_language(phrase)
+
+    print(f"📏 Parsing {len(CORPUS)} phrasings x {ROUNDS} rounds")
+    print("=" * 50)
+    calls = len(CORPUS) * ROUNDS
+    for label, fn in [("legacy loop", run_legacy),
+                      ("compiled (cold cache)", run_compiled_cold),
+                      ("compiled (warm cache)", run_compiled_warm)]:
+        seconds = min(timeit.repeat(fn, number=ROUNDS, repeat=3))
+        print(f"{label:24} {seconds * 1e6 / calls:8.2f} µs/parse")
+    print("=" * 50)
+    print(f"Parse cache: {agent._parse_cached.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
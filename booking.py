@@ -2,7 +2,7 @@
 import sqlite3
 import getpass
 import hashlib
-from datetime import datetime
+from quotes import get_quote_book
 
 def authenticate_user(username, password):
     conn = sqlite3.connect('travel.db')
@@ -29,49 +29,6 @@ def get_route_info(origin, destination):
     else:
         return None
 
-def calculate_final_price(base_price, traveller_type='adult', user_id=None):
-    price = base_price
-    # Apply child discount
-    if traveller_type == 'child':
-        price *= 0.5
-    # Apply best discount from discounts table
-    if user_id is not None:
-        conn = sqlite3.connect('travel.db')
-        c = conn.cursor()
-        # Get user loyalty points
-        c.execute('SELECT loyalty_points FROM users WHERE id=?', (user_id,))
-        user_row = c.fetchone()
-        loyalty_points = user_row[0] if user_row else 0
-        # Find best discount (highest percentage) for this user/traveller_type/points
-        c.execute('''SELECT percentage FROM discounts WHERE (user_type=? OR user_type IS NULL OR user_type='') AND min_points<=? ORDER BY percentage DESC LIMIT 1''', (traveller_type, loyalty_points))
-        discount_row = c.fetchone()
-        if discount_row:
-            discount = discount_row[0]
-            price *= (1 - discount / 100)
-        conn.close()
-    return round(price, 2)
-
-def book_ticket(user_id, route_id, seat_number=None, traveller_type='adult'):
-    conn = sqlite3.connect('travel.db')
-    c = conn.cursor()
-    c.execute('SELECT seats_available, base_price, seats_total FROM routes WHERE id=?', (route_id,))
-    route = c.fetchone()
-    if not route or route[0] <= 0:
-        conn.close()
-        return {'error': 'No seats available'}
-    seats_left, base_price, seats_total = route
-    demand_factor = 1 + (1 - seats_left / seats_total) * 0.5
-    price_paid = round(base_price * demand_factor, 2)
-    final_price = calculate_final_price(price_paid, traveller_type, user_id)
-    booking_time = datetime.now().isoformat()
-    c.execute('INSERT INTO bookings (user_id, route_id, seat_number, price_paid, booking_time, status) VALUES (?, ?, ?, ?, ?, ?)',
-              (user_id, route_id, seat_number, final_price, booking_time, 'confirmed'))
-    c.execute('UPDATE routes SET seats_available = seats_available - 1 WHERE id=?', (route_id,))
-    conn.commit()
-    booking_id = c.lastrowid
-    conn.close()
-    return {'booking_id': booking_id, 'price_paid': final_price, 'status': 'confirmed'}
-
 def main():
     while True:
         print('=== Booking CLI ===')
@@ -127,11 +84,11 @@ def main():
                 print(f"Departure: {departure_time}")
                 print(f"Base price: ${base_price:.2f}")
                 print(f"Traveller type: {traveller_type}")
-                final_price = calculate_final_price(base_price, traveller_type, user_id)
-                print(f"Final price: ${final_price:.2f}")
+                quote = get_quote_book().quote_best(user_id, route_id, traveller_type)
+                print(f"Final price: ${quote.final_price:.2f}")
                 book = input('Do you want to book this ticket? (y/n): ').strip().lower()
                 if book == 'y':
-                    result = book_ticket(user_id, route_id, None, traveller_type)
+                    result = get_quote_book().book(quote.token, user_id)
                     print('Booking result:', result)
                 else:
                     print('Booking cancelled.')
@@ -149,11 +106,11 @@ def main():
                     print(f"Departure: {departure_time}")
                     print(f"Base price: ${base_price:.2f}")
                     print(f"Traveller type: {traveller_type}")
-                    final_price = calculate_final_price(base_price, traveller_type, user_id)
-                    print(f"Final price: ${final_price:.2f}")
+                    quote = get_quote_book().quote_best(user_id, route_id, traveller_type)
+                    print(f"Final price: ${quote.final_price:.2f}")
                     book = input('Do you want to book this ticket? (y/n): ').strip().lower()
                     if book == 'y':
-                        result = book_ticket(user_id, route_id, None, traveller_type)
+                        result = get_quote_book().book(quote.token, user_id)
                         print('Booking result:', result)
                     else:
                         print('Booking cancelled.')
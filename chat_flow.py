@@ -0,0 +1,1186 @@
+"""
+Chat booking flow as a state machine
+
+The Streamlit chat used to be one long if-chain that re-tested every
+keyword list on every message. Here the same flow is a table:
+
+* step rules - a dict from booking_context['step'] to its handler
+* keyword rules - handlers triggered by any of their phrases
+* always-tried rules - handlers with their own test (a bare route number,
+  a paged listing)
+
+Every phrase the flow looks for is compiled into one KeywordMatcher, so a
+turn is one scan of the message plus one dispatch over the few rules it
+can trigger:
+
+    flow = ChatFlow(services)
+    session = ChatSession()
+    reply = flow.respond(session, "login")
+
+RULES keeps the order of the old chain: candidates are tried in that
+order and a handler returning None lets the next one answer, so replies
+are the same as before. Nothing here imports Streamlit. The session can
+be st.session_state or a ChatSession, and the app's lookups and renderers
+come in as ChatServices, so the flow can be tested and timed on its own.
+
+Booking reports are too slow to answer within a turn: their handlers call
+svc.start_report() and reply at once, and the app posts report_reply()
+to the chat when the background job finishes.
+"""
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+from agent_results import AgentMessage, TopUsers
+
+# Keyword rule triggers
+BOOKING_QUERY_WORDS = ("show bookings", "my bookings", "booking history", "bookings for", "all bookings",
+                       "bookings under", "bookings of", "booking queries", "show all booking", "all booking",
+                       "provide all my bookings", "all my bookings", "provide all")
+SYSTEM_BOOKING_WORDS = ("all bookings", "show all bookings", "system bookings", "every booking")
+LOGIN_WORDS = ("login", "log in", "sign in", "signin")
+TRAVEL_WORDS = ("want to go", "travel to", "go to", "trip to", "visit")
+ADD_ROUTE_WORDS = ("add route", "new route", "create route", "route request")
+ADMIN_HELP_WORDS = ("help admin", "admin help", "admin instructions")
+SHOW_ROUTES_WORDS = ("routes", "flights", "show")
+HELP_WORDS = ("help",)
+BOOK_WORDS = ("book", "reserve", "buy", "ticket")
+PRICE_WORDS = ("price", "cost", "how much")
+TOTAL_WORDS = ("total price", "total cost", "total spending", "how much spent")
+GREETING_WORDS = ("hello", "hi", "hey", "good morning", "good afternoon", "good evening")
+
+# Phrases handlers check for themselves
+SYSTEM_REPORT_WORDS = ("provide all", "provide all my bookings", "all my bookings")
+USER_QUALIFIERS = ("for", "under", "of")
+MY_BOOKINGS_WORDS = ("my bookings", "show my bookings")
+EXISTING_ROUTE_WORDS = ("1", "existing", "book existing", "existing routes")
+NEW_ROUTE_WORDS = ("2", "new", "add", "new route")
+BOOK_NOW_WORDS = ("yes", "book", "book this", "book it")
+SHOW_ALL_WORDS = ("show routes", "show all", "all routes")
+ADD_ANOTHER_WORDS = ("add another", "add more")
+CREATE_ROUTE_WORDS = ("yes", "add", "create", "new")
+CHANGE_CITY_WORDS = ("change", "different", "try again", "revise", "badal do", "modify", "edit", "redo")
+POST_BOOKING_QUERY_WORDS = ("show my bookings", "my bookings", "booking history")
+POST_BOOKING_BOOK_WORDS = ("book ticket", "book", "new booking")
+THANKS_WORDS = ("hello", "hi", "thank you", "thanks")
+BOOK_ROUTE_PREFIX = ("book ",)
+
+# Steps where a bare number is an answer, not a route number
+NUMERIC_STEPS = ('new_route_price', 'new_route_seats', 'discount_selection')
+
+_LISTING_PATTERN = re.compile(r'(?:page|after|latest|last|newest|recent|top)\s+\d+')
+
+DEFAULT_REPLY = "🤔 I'm not quite sure what you're looking for, but I'm here to help!\n\n✨ **Here are some things you can try:**\n• Say '**hello**' for a warm welcome\n• Type '**login username password**' to sign in\n• Say '**show routes**' to see available flights\n• Ask '**help**' for detailed options\n• Try '**book from [city] to [city]**' to find tickets\n\n💬 Feel free to ask me anything about travel booking - I'm here to make your journey smooth!"
+
+
+@dataclass
+class ChatSession:
+    """Per-user chat state (st.session_state has the same attributes)"""
+    booking_context: dict = field(default_factory=dict)
+    chat_user_authenticated: bool = False
+    chat_current_user: str = None
+    chat_current_user_id: int = None
+
+
+@dataclass
+class ChatServices:
+    """What the flow needs from the app"""
+    authenticate_user: Callable
+    user_exists: Callable
+    # available_discounts(user_id, traveller_type) -> (loyalty_points, [(id, name, percentage, user_type, min_points)])
+    available_discounts: Callable
+    # add_route(origin, destination, departure_time, base_price, transport_type, seats) -> Route
+    add_route: Callable
+    quote_price: Callable
+    book_quote: Callable
+    get_all_routes: Callable
+    search_routes: Callable
+    extract_locations: Callable
+    parse_command: Callable
+    run_agent: Callable
+    # start_report(command, label, reply, **reply_args) -> job id; the app posts
+    # report_reply(...) to the chat when the job finishes
+    start_report: Callable
+    render_system_report: Callable
+    render_user_bookings: Callable
+    render_user_total: Callable
+    render_top_users: Callable
+    render_booking_listing: Callable
+
+
+class KeywordMatcher:
+    """Finds which of a fixed set of phrases occur in a text, in one regex scan
+
+    The phrases are alternatives of one compiled pattern inside a lookahead,
+    longest first, so every position yields the longest phrase starting
+    there. Shorter phrases that are prefixes of it are added from a table,
+    which gives exactly the phrases for which ``phrase in text`` holds.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = frozenset(phrases)
+        ordered = sorted(self.phrases, key=lambda p: (-len(p), p))
+        self._pattern = re.compile('(?=(' + '|'.join(map(re.escape, ordered)) + '))')
+        self._prefixes = {
+            phrase: frozenset(p for p in self.phrases if phrase.startswith(p))
+            for phrase in self.phrases
+        }
+
+    def scan(self, text):
+        hits = set()
+        for match in self._pattern.finditer(text):
+            hits |= self._prefixes[match.group(1)]
+        return hits
+
+
+def hold_for_login(session):
+    """Put a restored, logged-out session's booking on hold until the user logs in again
+    
+    The session store never keeps the login, so a session picked up by
+    another process (or after a restart) is logged out while its
+    booking_context may be halfway through a booking.
+    """
+    context = session.booking_context or {}
+    if session.chat_user_authenticated or context.get('step') in (None, 'asking_username', 'asking_password'):
+        return False
+    session.booking_context = {'step': 'asking_username', 'resume': context}
+    return True
+
+
+def _any(hits, phrases):
+    return not hits.isdisjoint(phrases)
+
+
+def _asking_username(svc, session, message, hits):
+    # Handle guided login process (must be first!)
+    # User provided username, now ask for password
+    username = message.strip()
+    travel_intent = session.booking_context.get('travel_intent')  # Preserve travel intent
+    session.booking_context = {
+        'step': 'asking_password', 
+        'username': username,
+        'travel_intent': travel_intent,  # Keep the original travel request
+        'resume': session.booking_context.get('resume')
+    }
+    return f"✅ Got it! Username: **{username}**\n\n🔑 **Now, what's your password?**\n\nDon't worry, I'll securely check your credentials."
+
+
+def _asking_password(svc, session, message, hits):
+    # Handle password input
+    password = message.strip()
+    username = session.booking_context.get('username')
+    travel_intent = session.booking_context.get('travel_intent')
+    
+    # Check if user exists first
+    existing_user = svc.user_exists(username)
+    
+    # Authenticate (this will create user if needed)
+    user_id = svc.authenticate_user(username, password)
+    if user_id:
+        session.chat_user_authenticated = True
+        session.chat_current_user = username
+        session.chat_current_user_id = user_id
+        
+        # Determine if this is a new user or existing user
+        welcome_message = ""
+        if not existing_user:
+            welcome_message = f"🎉 **Welcome to the Travel Booking System, {username}!** 🆕\n\n✨ **New account created successfully!** You now have:\n• 0 loyalty points (earn more by booking trips!)\n• Access to all available discounts\n• Secure account with encrypted password\n\n"
+        else:
+            welcome_message = f"🎉 **Welcome back, {username}!** You're now logged in.\n\n"
+        
+        # A restored booking carries on where it was left
+        resume = session.booking_context.get('resume')
+        if resume:
+            session.booking_context = resume
+            return welcome_message + "🔄 **Your booking is where you left it** - just carry on with your last answer."
+        
+        # After successful login, always ask for origin first
+        session.booking_context = {'step': 'asking_origin'}
+        return welcome_message + f"🌍 **Great! Now let's plan your trip!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai' \n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
+    else:
+        session.booking_context = {
+            'step': 'asking_username',
+            'travel_intent': travel_intent,  # Preserve travel intent on retry
+            'resume': session.booking_context.get('resume')
+        }
+        return f"❌ Sorry, I couldn't log you in with those credentials.\n\n🔄 Let's try again! What's your **username**?"
+
+
+def _route_selection(svc, session, message, hits):
+    # Handle route selection (must be before general booking logic)
+    if message.isdigit():
+        route_num = int(message)
+        available_routes = session.booking_context.get('available_routes', [])
+        if 1 <= route_num <= len(available_routes):
+            selected_route = available_routes[route_num - 1]
+            session.booking_context = {
+                'step': 'traveller_type',
+                'route': selected_route
+            }
+            return f"🎫 Great! You selected:\n{selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type 'adult' for adult ticket\n- Type 'child' for child ticket (50% discount)"
+        else:
+            return f"❌ Invalid route number. Please choose between 1 and {len(available_routes)}."
+
+
+def _route_number(svc, session, message, hits):
+    # Handle direct numeric input for route selection (when user types just a number)
+    # BUT ONLY if not in a specific step that expects numeric input
+    if (not message.isdigit() or not session.chat_user_authenticated
+            or session.booking_context.get('step') in NUMERIC_STEPS):
+        return None
+    route_num = int(message)
+    
+    # Check if we're in offer_new_route step (user selecting from available routes)
+    if session.booking_context.get('step') == 'offer_new_route':
+        all_routes = svc.get_all_routes()
+        if 1 <= route_num <= len(all_routes):
+            selected_route = all_routes[route_num - 1]
+            session.booking_context = {
+                'step': 'traveller_type',
+                'route': selected_route
+            }
+            return f"🎫 **Great! You selected:**\n**Route {route_num}**: {selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type '**adult**' for adult ticket\n- Type '**child**' for child ticket (50% discount)"
+        else:
+            return f"❌ Invalid route number. Please choose between 1 and {len(all_routes)}."
+    
+    # General route selection from all routes
+    routes = svc.get_all_routes()
+    if 1 <= route_num <= len(routes):
+        selected_route = routes[route_num - 1]
+        session.booking_context = {
+            'step': 'traveller_type',
+            'route': selected_route
+        }
+        return f"🎫 Great! You selected:\n**Route {route_num}**: {selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type '**adult**' for adult ticket\n- Type '**child**' for child ticket (50% discount)"
+    else:
+        return f"❌ Invalid route number. We have {len(routes)} routes available. Please choose between 1 and {len(routes)}.\n\n💡 Type '**show routes**' to see all available routes again."
+
+
+def _listing(svc, session, message, hits):
+    # Paged listings ("show all bookings page 3", "latest 50 bookings", "top 10 users by spend")
+    # come before the general booking queries so they never dump the whole system
+    if not _LISTING_PATTERN.search(message):
+        return None
+    intent, _ = svc.parse_command(message)
+    if intent in ('bookings_page', 'latest_bookings', 'top_users'):
+        result = svc.run_agent(message)
+        if isinstance(result, AgentMessage):
+            return f"{result.text}\n\nPlease try again or contact support."
+        if isinstance(result, TopUsers):
+            return f"🏆 **Top {result.count} Users by Spend:**\n\n{svc.render_top_users(result)}"
+        if result.heading:
+            title = f"🕒 **Latest {len(result.rows)} Bookings:**"
+        elif result.page is not None:
+            title = f"📋 **All Bookings - Page {result.page}:**"
+        else:
+            title = f"📋 **Bookings after ID {result.after_id}:**"
+        return f"{title}\n\n{svc.render_booking_listing(result)}"
+
+
+def _booking_queries(svc, session, message, hits):
+    # Handle booking queries (show bookings) - MUST be before other logic
+    
+    # Check if this is a request for ALL system bookings (no specific user)
+    if _any(hits, SYSTEM_REPORT_WORDS) and not _any(hits, USER_QUALIFIERS):
+        # This is a request for ALL system bookings with calculations, run in the background
+        return _start_report(svc, 'provide all bookings', "📊 Analysing all bookings...", 'all_bookings')
+    
+    # Handle user-specific booking queries
+    # Enhanced username extraction to catch any username pattern
+    # More flexible regex patterns to catch variations like "booking queries under nikitha"
+    username_match = re.search(r'(?:for|of|under|show bookings? (?:queries? )?of|bookings? for|bookings? of|bookings? under|all bookings? under|show all bookings? under|booking queries? under|all booking queries? under)\s+([a-zA-Z0-9_]+)', message)
+    if username_match:
+        requested_user = username_match.group(1)
+    else:
+        # Check for "my bookings" when user is logged in
+        if _any(hits, MY_BOOKINGS_WORDS) and "provide all" not in hits:
+            if not session.chat_user_authenticated:
+                return "🔐 Please log in first to view your bookings.\n\nType 'login' to get started!"
+            requested_user = session.chat_current_user
+        else:
+            # Also check for pattern like "nikitha bookings" or "john bookings"  
+            username_match = re.search(r'([a-zA-Z0-9_]+)\s+(?:bookings?|booking queries?)', message)
+            if username_match:
+                requested_user = username_match.group(1)
+            else:
+                # If no specific username is mentioned and user is not logged in, ask for username
+                if not session.chat_user_authenticated:
+                    return "🔐 Please specify a username or log in first to view bookings.\n\n💡 **Examples:**\n• 'show bookings for nikitha'\n• 'all bookings under john'\n• 'show all booking queries under nikitha'\n• Or type 'login' to access your bookings"
+                requested_user = session.chat_current_user
+    
+    # Execute REPL command to get detailed booking information, in the background
+    return _start_report(svc, f'show me all bookings under {requested_user}',
+                         f"📊 Loading bookings for {requested_user}...", 'user_bookings',
+                         requested_user=requested_user)
+
+
+def _system_bookings(svc, session, message, hits):
+    # Handle requests for ALL bookings in the system (admin view)
+    if not _any(hits, USER_QUALIFIERS):
+        # This is a request for ALL system bookings, not user-specific
+        return _start_report(svc, 'provide all bookings', "📊 Analysing all bookings...", 'system_bookings')
+
+
+# Heavy reports run as background jobs; their replies are built when they finish
+
+def _start_report(svc, command, label, reply, **reply_args):
+    job_id = svc.start_report(command, label, reply, **reply_args)
+    return f"⏳ **{label}** (report #{job_id})\n\nI'm preparing this in the background - feel free to keep chatting! The report will appear here as soon as it's ready."
+
+
+def _all_bookings_reply(svc, result, error):
+    if error is not None:
+        return f"❌ Error retrieving all system bookings: {str(error)}\n\nPlease try again or contact support."
+    if isinstance(result, AgentMessage):
+        return f"{result.text}\n\nPlease try again or contact support."
+    
+    if result.users:
+        # Format the report nicely for Streamlit
+        response = "� **ALL BOOKINGS IN SYSTEM - Complete Analysis:**\n\n"
+        response += svc.render_system_report(result)
+        response += "� **Want specific user data?** Try:\n"
+        response += "• 'show bookings for [username]' - Individual user analysis\n"
+        response += "• 'total price for [username]' - Quick spending summary"
+        return response
+    else:
+        return "📋 **No bookings found in the system.**\n\nThe system is ready for new bookings! Users can log in and start booking trips."
+
+
+def _system_bookings_reply(svc, result, error):
+    if error is not None:
+        return f"❌ Error retrieving all system bookings: {str(error)}\n\nPlease try again or contact support."
+    if isinstance(result, AgentMessage):
+        return f"{result.text}\n\nPlease try again or contact support."
+    
+    if result.users:
+        return f"📋 **All Bookings in System - Complete Analysis:**\n\n{svc.render_system_report(result)}💡 **Want user-specific bookings?** Try:\n• 'show bookings for [username]' - See specific user's bookings\n• 'total price for [username]' - See spending summary"
+    else:
+        return "📋 No bookings found in the system."
+
+
+def _user_bookings_reply(svc, result, error, requested_user):
+    if error is not None:
+        return f"❌ Error retrieving bookings: {str(error)}\n\nPlease try again or contact support."
+    if isinstance(result, AgentMessage):
+        return f"{result.text}\n\nPlease try again or contact support."
+    
+    response = svc.render_user_bookings(result, requested_user)
+    if result.bookings:
+        # Add interactive suggestions
+        response += f"💡 **Need more analysis?** Try:\n"
+        response += f"• 'total price for {requested_user}' - See spending summary\n"
+        response += f"• 'explain booking [ID]' - Get detailed breakdown for specific booking\n"
+        response += f"• 'book ticket' - Make a new booking"
+    return response
+
+
+REPORT_REPLIES = {
+    'all_bookings': _all_bookings_reply,
+    'system_bookings': _system_bookings_reply,
+    'user_bookings': _user_bookings_reply,
+}
+
+
+def report_reply(svc, reply, result=None, error=None, **reply_args):
+    """Chat text for a finished background report (``reply`` as given to start_report)"""
+    try:
+        return REPORT_REPLIES[reply](svc, result, error, **reply_args)
+    except Exception as e:
+        return f"❌ Error formatting the report: {str(e)}\n\nPlease try again or contact support."
+
+
+def _login(svc, session, message, hits):
+    # Handle login requests (more conversational and guided)
+    if message.startswith("login "):
+        # Direct login format
+        parts = message.split(" ", 2)
+        if len(parts) >= 3:
+            username = parts[1]
+            password = parts[2]
+            user_id = svc.authenticate_user(username, password)
+            if user_id:
+                session.chat_user_authenticated = True
+                session.chat_current_user = username
+                session.chat_current_user_id = user_id
+                return f"🎉 Welcome back, {username}! You're now logged in and ready to book tickets.\n\n🌍 **What would you like to do today?**\n\n**Choose an option:**\n1️⃣ **Book from existing routes** - See available flights and book\n2️⃣ **Add new route** - Request a new route to be added\n\nJust type **'1'** or **'2'** or say **'existing routes'** or **'new route'**"
+            else:
+                return "❌ Hmm, those credentials don't seem right. Please check your username and password and try again.\n\n💡 Format: login username password"
+        else:
+            return "Please provide both username and password.\n\n💡 Format: login username password\n\nFor example: login john mypassword123"
+    else:
+        # Interactive login request - ask for username first
+        session.booking_context = {'step': 'asking_username'}
+        return "👋 Great! I'll help you log in step by step.\n\n🔐 **What's your username?**\n\nJust type your username and I'll ask for your password next."
+
+
+def _travel(svc, session, message, hits):
+    # Handle travel planning requests (natural conversation)
+    if not session.chat_user_authenticated:
+        # Set login context AND save travel intent
+        session.booking_context = {
+            'step': 'asking_username',
+            'travel_intent': message  # Save what they wanted to do
+        }
+        return "🔐 I'd love to help you plan your trip! But first, let me get you logged in.\n\n👋 **What's your username?**\n\nOnce you're logged in, I'll help you find the perfect route!"
+    
+    # User wants to travel - ask what they want to do
+    session.booking_context = {'step': 'choose_action'}
+    return "🌍 **Great! What would you like to do?**\n\n**Choose an option:**\n1️⃣ **Book from existing routes** - See available flights and book\n2️⃣ **Add new route** - Request a new route to be added\n\nJust type **'1'** or **'2'** or say **'existing routes'** or **'new route'**"
+
+
+def _choose_action(svc, session, message, hits):
+    # Handle action choice (existing routes vs new route)
+    if _any(hits, EXISTING_ROUTE_WORDS):
+        # User wants to book existing routes - FIX: Ask for origin first, not destination
+        session.booking_context = {'step': 'asking_origin'}
+        return "🎯 **Great! Let's book from existing routes!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai'\n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
+    elif _any(hits, NEW_ROUTE_WORDS):
+        # User wants to add new route
+        session.booking_context = {'step': 'new_route_origin'}
+        return "🆕 **Perfect! Let's add a new route!**\n\n🏠 **Where should this new route start from?**\nPlease tell me the origin city:\n\nFor example: 'Mumbai', 'Delhi', 'Chennai'"
+    else:
+        return "Please choose an option:\n\n1️⃣ Type **'1'** or **'existing routes'** to book from existing routes\n2️⃣ Type **'2'** or **'new route'** to add a new route\n\nWhat would you like to do?"
+
+
+def _new_route_origin(svc, session, message, hits):
+    # Handle new route creation - asking for origin
+    origin = message.strip().title()
+    session.booking_context = {
+        'step': 'new_route_destination',
+        'new_route_origin': origin
+    }
+    return f"✅ **Origin: {origin}**\n\n🎯 **Where should this route go to?**\nPlease tell me the destination city:\n\nFor example: 'Dubai', 'Singapore', 'London'"
+
+
+def _new_route_destination(svc, session, message, hits):
+    # Handle new route creation - asking for destination
+    destination = message.strip().title()
+    origin = session.booking_context.get('new_route_origin')
+    session.booking_context = {
+        'step': 'new_route_transport',
+        'new_route_origin': origin,
+        'new_route_destination': destination
+    }
+    return f"✅ **Route: {origin} → {destination}**\n\n🚊 **What type of transport?**\nChoose from:\n• **'flight'** - Air travel\n• **'bus'** - Road travel\n• **'train'** - Rail travel\n\nWhat type would you prefer?"
+
+
+def _new_route_transport(svc, session, message, hits):
+    # Handle new route creation - asking for transport type
+    if message.lower() in ['flight', 'bus', 'train']:
+        transport = message.lower()
+        origin = session.booking_context.get('new_route_origin')
+        destination = session.booking_context.get('new_route_destination')
+        session.booking_context = {
+            'step': 'new_route_price',
+            'new_route_origin': origin,
+            'new_route_destination': destination,
+            'new_route_transport': transport
+        }
+        return f"✅ **Transport: {transport.title()}**\n\n💰 **What should be the base price?**\nEnter the price in dollars (just the number):\n\nFor example: 450, 750, 1200"
+    else:
+        return "Please choose a valid transport type:\n• **'flight'**\n• **'bus'**\n• **'train'**"
+
+
+def _new_route_price(svc, session, message, hits):
+    # Handle new route creation - asking for price
+    try:
+        price = float(message.strip())
+        origin = session.booking_context.get('new_route_origin')
+        destination = session.booking_context.get('new_route_destination')
+        transport = session.booking_context.get('new_route_transport')
+        session.booking_context = {
+            'step': 'new_route_seats',
+            'new_route_origin': origin,
+            'new_route_destination': destination,
+            'new_route_transport': transport,
+            'new_route_price': price
+        }
+        return f"✅ **Price: ${price}**\n\n🪑 **How many total seats?**\nEnter the number of seats available:\n\nFor example: 100, 150, 200"
+    except ValueError:
+        return "Please enter a valid price (just numbers):\nFor example: 450, 750, 1200"
+
+
+def _new_route_seats(svc, session, message, hits):
+    # Handle new route creation - asking for seats
+    try:
+        seats = int(message.strip())
+        origin = session.booking_context.get('new_route_origin')
+        destination = session.booking_context.get('new_route_destination')
+        transport = session.booking_context.get('new_route_transport')
+        price = session.booking_context.get('new_route_price')
+        
+        # Add route to database
+        route = svc.add_route(origin, destination, '2025-01-15 10:00:00', price, transport, seats)
+        route_id = route.id
+        
+        # Clear context and offer immediate booking of the new route
+        session.booking_context = {
+            'step': 'offer_immediate_booking',
+            'new_route_id': route_id,
+            'new_route_info': route
+        }
+        
+        return f"🎉 **NEW ROUTE ADDED SUCCESSFULLY!**\n\n📋 **Route Details:**\n• **Route ID:** {route_id}\n• **Route:** {origin} → {destination}\n• **Transport:** {transport.title()}\n• **Price:** ${price}\n• **Seats:** {seats}\n\n✈️ **Would you like to book this route right now?**\n\n**Options:**\n• Type '**yes**' or '**book**' to book this route immediately\n• Type '**show routes**' to see all routes\n• Type '**add another**' to add more routes"
+    except ValueError:
+        return "Please enter a valid number of seats:\nFor example: 100, 150, 200"
+
+
+def _offer_immediate_booking(svc, session, message, hits):
+    # Handle immediate booking after adding new route
+    if _any(hits, BOOK_NOW_WORDS):
+        # User wants to book the newly added route immediately
+        new_route_info = session.booking_context.get('new_route_info')
+        session.booking_context = {
+            'step': 'traveller_type',
+            'route': new_route_info
+        }
+        route_id, origin, destination, departure, price, transport, seats = new_route_info
+        return f"🎫 **Great! You selected the new route:**\n{origin} → {destination} ({transport})\nPrice: ${price:.2f}\n\nPlease choose traveller type:\n- Type '**adult**' for adult ticket\n- Type '**child**' for child ticket (50% discount)"
+    elif _any(hits, SHOW_ALL_WORDS):
+        # Show all routes including the new one
+        routes = svc.get_all_routes()
+        session.booking_context = {}
+        response = "📋 **All Available Routes (including your new route):**\n\n"
+        for i, route in enumerate(routes, 1):
+            response += f"**{i}.** {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
+        response += f"\n💡 Type a route number (1-{len(routes)}) to book!"
+        return response
+    elif _any(hits, ADD_ANOTHER_WORDS):
+        # Start adding another route
+        session.booking_context = {'step': 'new_route_origin'}
+        return "🆕 **Perfect! Let's add another route!**\n\n🏠 **Where should this new route start from?**\nPlease tell me the origin city:\n\nFor example: 'Mumbai', 'Delhi', 'Chennai'"
+    else:
+        return "🤔 I didn't understand that. Please choose:\n• Type '**yes**' or '**book**' to book the route you just added\n• Type '**show routes**' to see all available routes\n• Type '**add another**' to add more routes"
+
+
+def _asking_origin(svc, session, message, hits):
+    # Handle origin input (NEW - always ask origin first after login)
+    origin = message.strip().title()
+    session.booking_context = {
+        'step': 'asking_destination',
+        'origin': origin
+    }
+    return f"✅ **Starting from: {origin}**\n\n🎯 **Where would you like to go?**\nPlease tell me your destination city:\n\nFor example:\n• 'Paris'\n• 'Mumbai'\n• 'Dubai'\n• 'Singapore'\n\nWhat's your destination?"
+
+
+def _asking_destination(svc, session, message, hits):
+    # Handle destination input (UPDATED - now checks for existing routes)
+    destination = message.strip().title()
+    origin = session.booking_context.get('origin')
+    
+    # Safety check: If origin is missing, redirect to asking_origin
+    if not origin:
+        session.booking_context = {'step': 'asking_origin'}
+        return "🔄 **Oops! I need to know where you're starting from first.**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai'\n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
+    
+    # Search for routes between origin and destination
+    matching_routes = svc.search_routes(origin, destination)
+    
+    if matching_routes:
+        # Routes exist - show them for booking
+        response = f"🎉 **Perfect! I found {len(matching_routes)} route(s) from {origin} to {destination}:**\n\n"
+        for i, route in enumerate(matching_routes, 1):
+            response += f"**{i}.** {route[1]} → {route[2]} ({route[5]})\n"
+            response += f"   💰 Price: ${route[4]:.2f} | 🪑 Available seats: {route[6]}\n"
+            response += f"   ⏰ Departure: {route[3]}\n\n"
+        
+        # Dynamic message based on number of routes
+        if len(matching_routes) == 1:
+            response += "**Perfect! This is exactly what you're looking for!**\nJust type **'1'** to book this route!"
+        else:
+            response += "**Which route looks good to you?**\nJust say the number, like '1' or '2'!"
+        
+        # Store matching routes for booking
+        session.booking_context = {
+            'step': 'route_selection',
+            'available_routes': matching_routes,
+            'origin': origin,
+            'destination': destination
+        }
+        return response
+    else:
+        # No routes exist - offer to add new route
+        session.booking_context = {
+            'step': 'offer_new_route',
+            'origin': origin,
+            'destination': destination
+        }
+        
+        # Show what routes ARE available
+        all_routes = svc.get_all_routes()
+        response = f"😔 **No direct routes found from {origin} to {destination}**\n\n"
+        
+        if all_routes:
+            response += "🗺️ **Here are our current available routes:**\n"
+            for i, route in enumerate(all_routes[:5], 1):  # Show first 5 routes
+                response += f"{i}. {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
+            if len(all_routes) > 5:
+                response += f"   ... and {len(all_routes) - 5} more routes\n"
+            response += "\n"
+        
+        response += f"🆕 **Would you like me to help add {origin} → {destination} as a new route?**\n\n"
+        response += "**Options:**\n"
+        response += "• Type '**yes**' or '**add route**' to create this new route\n"
+        response += "• Type '**show all**' to see all available routes\n"
+        response += "• Type '**change**' to try different cities\n"
+        response += f"• Type a **route number** (1-{len(all_routes) if all_routes else 0}) to book existing route\n\n"
+        response += "What would you like to do?"
+        return response
+
+
+def _offer_new_route(svc, session, message, hits):
+    # Handle offer new route responses
+    origin = session.booking_context.get('origin')
+    destination = session.booking_context.get('destination')
+    
+    if _any(hits, CREATE_ROUTE_WORDS):
+        # User wants to add new route
+        session.booking_context = {
+            'step': 'new_route_transport',
+            'new_route_origin': origin,
+            'new_route_destination': destination
+        }
+        return f"🎉 **Great! Let's add the {origin} → {destination} route!**\n\n🚊 **What type of transport?**\nChoose from:\n• **'flight'** - Air travel\n• **'bus'** - Road travel\n• **'train'** - Rail travel\n\nWhat type would you prefer?"
+    elif _any(hits, SHOW_ALL_WORDS):
+        # Show all routes
+        routes = svc.get_all_routes()
+        session.booking_context = {}
+        if not routes:
+            return "📋 No routes available in the system."
+        
+        response = "📋 **All Available Routes:**\n\n"
+        for i, route in enumerate(routes, 1):
+            response += f"**{i}.** {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
+        response += f"\n💡 Type a route number (1-{len(routes)}) to book!"
+        return response
+    elif _any(hits, CHANGE_CITY_WORDS):
+        # Start over with new cities - Enhanced language support
+        session.booking_context = {'step': 'asking_origin'}
+        return "🔄 **Let's try different cities!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):"
+    else:
+        return f"🤔 I didn't understand that. Please choose:\n• Type '**yes**' to add {origin} → {destination} route\n• Type '**show all**' to see available routes\n• Type '**change**', '**revise**', or '**badal do**' to try different cities\n• Type a **route number** to book existing route"
+
+
+def _add_route(svc, session, message, hits):
+    # Handle route addition requests
+    return "🔧 **Route Addition Request**\n\nTo add new routes, an admin needs to:\n\n1. **Access admin panel** (if available)\n2. **Add to database** directly\n3. **Contact system administrator**\n\n💡 **For immediate help:**\n• Tell me which route you need (from where to where)\n• I can provide the exact SQL commands for admin\n• Say 'help admin' for detailed instructions\n\nWhich route would you like to request?"
+
+
+def _admin_help(svc, session, message, hits):
+    # Admin help
+    return """🔧 **Admin Route Management Guide**
+
+**To add a new route to the database:**
+
+**Method 1: SQL Command**
+```sql
+INSERT INTO routes (origin, destination, departure_time, base_price, transport_type, seats_available, seats_total) 
+VALUES ('CityA', 'CityB', '2025-01-15 10:00:00', 500.00, 'flight', 100, 100);
+```
+
+**Method 2: Python Script**
+```python
+import sqlite3
+conn = sqlite3.connect('travel.db')
+c = conn.cursor()
+c.execute("INSERT INTO routes (origin, destination, departure_time, base_price, transport_type, seats_available, seats_total) VALUES (?, ?, ?, ?, ?, ?, ?)", 
+          ('Origin', 'Destination', '2025-01-15 10:00:00', 500.00, 'flight', 100, 100))
+conn.commit()
+conn.close()
+```
+
+**Fields to specify:**
+• origin: Starting city
+• destination: End city  
+• departure_time: Format 'YYYY-MM-DD HH:MM:SS'
+• base_price: Price in dollars
+• transport_type: 'flight', 'bus', 'train'
+• seats_available: Current available seats
+• seats_total: Total seats capacity
+
+Need help with a specific route? Just ask!"""
+
+
+def _show_routes(svc, session, message, hits):
+    # Show routes
+    routes = svc.get_all_routes()
+    if not routes:
+        return "No routes available at the moment."
+    
+    response = "📋 Available Routes:\n\n"
+    for i, route in enumerate(routes, 1):
+        response += f"{i}. {route[1]} → {route[2]} ({route[5]})\n"
+        response += f"   Price: ${route[4]:.2f} | Available seats: {route[6]}\n"
+        response += f"   Departure: {route[3]}\n\n"
+    response += "To book a ticket, say: 'book [route number]' or 'book ticket to [destination]'"
+    return response
+
+
+def _help(svc, session, message, hits):
+    # Help
+    help_text = """Here's what I can help you with:
+
+🔐 **Login**: Type 'login username password'
+✈️ **View Routes**: Say 'show routes' or 'flights'
+🎫 **Book Ticket**: 
+   • 'book [route number]' - book specific route
+   • 'book from [origin] to [destination]' - smart search
+   • 'book ticket from Delhi to Mumbai' - natural language
+💰 **Check Prices**: Say 'price' or 'pricing'
+❓ **Help**: Say 'help'
+
+**Smart Booking Examples:**
+• "I need to book a ticket from Delhi to Mumbai"
+• "Book flight from NYC to LA"
+• "Book from Hyderabad to Chennai"
+
+**If route doesn't exist:**
+• I'll suggest available alternatives
+• Admin can add new routes using admin panel
+• Contact admin to add your desired route
+
+**Booking Process:**
+1. Login with your credentials
+2. Specify your origin and destination OR choose from available routes
+3. Select traveller type (adult/child)
+4. Confirm booking"""
+    return help_text
+
+
+def _book(svc, session, message, hits):
+    # Booking flow - Enhanced with location intelligence
+    if not session.chat_user_authenticated:
+        return "🔐 Oops! Looks like you need to log in first to book tickets.\n\n👋 No worries - it's super easy!\nJust type: **login username password**\n\nFor example: login john mypassword123\n\n✨ Once you're logged in, I'll help you find and book the perfect ticket!"
+    
+    # Extract locations from message
+    origin, destination = svc.extract_locations(message)
+    
+    if origin and destination:
+        # User specified both origin and destination
+        matching_routes = svc.search_routes(origin, destination)
+        
+        if matching_routes:
+            # Routes exist - show available options
+            response = f"✈️ Great! I found routes from {origin.title()} to {destination.title()}:\n\n"
+            for i, route in enumerate(matching_routes, 1):
+                response += f"{i}. {route[1]} → {route[2]} ({route[5]})\n"
+                response += f"   Price: ${route[4]:.2f} | Available seats: {route[6]}\n"
+                response += f"   Departure: {route[3]}\n\n"
+            response += "Which route would you like to book? Say 'book [number]' to select."
+            
+            # Store matching routes for booking
+            session.booking_context = {
+                'step': 'route_selection',
+                'available_routes': matching_routes
+            }
+            return response
+        else:
+            # No routes exist - suggest admin contact with better alternatives
+            all_routes = svc.get_all_routes()
+            response = f"🚫 Sorry, I couldn't find any routes from {origin.title()} to {destination.title()}.\n\n"
+            
+            # Show sample of available routes
+            if all_routes:
+                response += "📋 **Current available routes include:**\n"
+                for route in all_routes[:6]:  # Show first 6 routes
+                    response += f"• {route[1]} → {route[2]} ({route[5]})\n"
+                if len(all_routes) > 6:
+                    response += f"• ... and {len(all_routes) - 6} more\n"
+                response += "\n"
+            
+            response += "💡 **Options for you:**\n"
+            response += f"1. **Book existing route**: Say 'show routes' to see all options\n"
+            response += f"2. **Try nearby cities**: Maybe from Delhi or Bengaluru to {destination.title()}?\n"
+            response += f"3. **New route request**: Admin can add {origin.title()} to {destination.title()}\n\n"
+            response += f"🎯 **The {origin.title()} to {destination.title()} route can be added easily!**\n"
+            response += "Would you like to see available routes instead? Say 'show routes'."
+            return response
+    
+    # Extract route number if specified (improved detection)
+    route_num = None
+    if message.isdigit():
+        # If the entire message is just a number, treat it as route selection
+        route_num = int(message)
+    elif _any(hits, BOOK_ROUTE_PREFIX):
+        parts = message.split()
+        for part in parts:
+            if part.isdigit():
+                route_num = int(part)
+                break
+    
+    # Handle route number selection
+    if route_num:
+        # Check if we're in route selection mode
+        if session.booking_context.get('step') == 'route_selection':
+            available_routes = session.booking_context.get('available_routes', [])
+            if 1 <= route_num <= len(available_routes):
+                selected_route = available_routes[route_num - 1]
+                session.booking_context = {
+                    'step': 'traveller_type',
+                    'route': selected_route
+                }
+                return f"🎫 Great! You selected:\n{selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type 'adult' for adult ticket\n- Type 'child' for child ticket (50% discount)"
+            else:
+                return f"❌ Invalid route number. Please choose between 1 and {len(available_routes)}."
+        else:
+            # General route selection from all routes
+            routes = svc.get_all_routes()
+            if 1 <= route_num <= len(routes):
+                selected_route = routes[route_num - 1]
+                session.booking_context = {
+                    'step': 'traveller_type',
+                    'route': selected_route
+                }
+                return f"🎫 Great! You selected:\n{selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type 'adult' for adult ticket\n- Type 'child' for child ticket (50% discount)"
+            else:
+                return f"❌ Invalid route number. Please choose between 1 and {len(routes)}."
+    else:
+        # Show all available routes for booking
+        routes = svc.get_all_routes()
+        if not routes:
+            return "🚫 No routes available at the moment. Please contact admin to add routes."
+        
+        response = "🎫 **Which route would you like to book?**\n\n"
+        for i, route in enumerate(routes, 1):
+            response += f"**{i}.** {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
+        response += "\n💡 **Tips:**\n"
+        response += "• Type the **route number** (like '11' for Hyd → Bengaluru)\n"
+        response += "• Say 'book from [origin] to [destination]' to search specific routes\n"
+        response += "• If your desired route doesn't exist, contact admin to add it"
+        return response
+
+
+_ROUTE_GONE = "❌ Sorry, that route is no longer available.\n\n💡 Type '**show routes**' to pick another one."
+
+
+def _demand_line(quote):
+    if quote.demand_factor > 1:
+        return f"• Seat demand: +{(quote.demand_factor - 1) * 100:.0f}% ({quote.seats_available} seats left)\n"
+    return ""
+
+
+def _held_line(quote):
+    minutes = max(1, round((quote.expires_at - time.time()) / 60))
+    return f"⏳ This price is held for {minutes} minute(s).\n\n"
+
+
+def _traveller_type(svc, session, message, hits):
+    # Handle traveller type selection
+    if message in ['adult', 'child']:
+        route = session.booking_context['route']
+        traveller_type = message
+        
+        # Get available discounts for this user (by loyalty points)
+        loyalty_points, available_discounts = svc.available_discounts(session.chat_current_user_id, traveller_type)
+        
+        if available_discounts:
+            # Show discount options
+            session.booking_context.update({
+                'step': 'discount_selection',
+                'traveller_type': traveller_type,
+                'available_discounts': available_discounts
+            })
+            
+            response = f"🎉 **Great! You qualify for discounts!**\n\n"
+            response += f"✅ Traveller type: **{traveller_type.title()}**\n"
+            if traveller_type == 'child':
+                response += f"🎈 **Child discount: 50% off** (automatically applied)\n\n"
+            
+            response += f"🎟️ **Choose your preferred discount:**\n\n"
+            for i, discount in enumerate(available_discounts, 1):
+                discount_id, name, percentage, user_type, min_points = discount
+                response += f"**{i}.** Apply `{name}` code - **Save {percentage}%!**"
+                if user_type:
+                    response += f" (for {user_type})"
+                if min_points > 0:
+                    response += f" (requires {min_points}+ points)"
+                response += f"\n"
+            
+            response += f"\n**0.** Skip discounts - Use standard pricing\n\n"
+            response += f"� **Your loyalty points:** {loyalty_points}\n\n"
+            response += f"🎯 **Pick your choice:** Type any number from **0** to **{len(available_discounts)}**\n"
+            response += f"• **0** = No extra discount (pay standard price)\n"
+            response += f"• **1-{len(available_discounts)}** = Apply that specific discount code for maximum savings!"
+            
+            return response
+        else:
+            # No additional discounts available: quote the price booking will charge
+            quote = svc.quote_price(session.chat_current_user_id, route[0], traveller_type, None)
+            if quote is None:
+                session.booking_context = {}
+                return _ROUTE_GONE
+            
+            session.booking_context.update({
+                'step': 'confirm',
+                'traveller_type': traveller_type,
+                'final_price': quote.final_price,
+                'selected_discount': None,
+                'quote': quote.token
+            })
+            
+            response = f"💰 **Price Calculation:**\n• Base price: ${quote.base_price:.2f}\n{_demand_line(quote)}• Traveller type: {traveller_type.title()}\n"
+            if traveller_type == 'child':
+                response += f"• Child discount: 50% OFF\n"
+            response += f"• **Final price: ${quote.final_price:.2f}**\n\n"
+            response += f"💡 No additional discounts available for your profile.\n\n"
+            response += _held_line(quote)
+            response += f"✅ Type **'confirm'** to complete booking or **'cancel'** to abort."
+            
+            return response
+    else:
+        return "Please type **'adult'** or **'child'** to select traveller type.\n\n💡 **Reminder:**\n• Adult: Full price\n• Child: 50% discount\n• Additional discounts may be available based on your profile!"
+
+
+def _discount_selection(svc, session, message, hits):
+    # Handle discount selection
+    if message.isdigit():
+        choice = int(message)
+        available_discounts = session.booking_context.get('available_discounts', [])
+        traveller_type = session.booking_context.get('traveller_type')
+        route = session.booking_context['route']
+        base_price = route[4]
+        
+        selected_discount = None
+        discount_info = "Standard pricing (no discount codes applied)"
+        
+        if choice == 0:
+            # No additional discount
+            selected_discount = None
+            discount_info = "Standard pricing (no discount codes applied)"
+        elif 1 <= choice <= len(available_discounts):
+            # Selected a discount
+            selected_discount = available_discounts[choice - 1]
+            discount_id, name, percentage, user_type, min_points = selected_discount
+            discount_info = f"You chose: {name} discount code ({percentage}% savings!)"
+        else:
+            return f"❌ Invalid choice. Please choose between 0 and {len(available_discounts)}."
+        
+        # Quote the final price with the selected discount (if any); booking charges exactly this
+        quote = svc.quote_price(session.chat_current_user_id, route[0], traveller_type, selected_discount)
+        if quote is None:
+            session.booking_context = {}
+            return _ROUTE_GONE
+        final_price = quote.final_price
+        
+        session.booking_context.update({
+            'step': 'confirm',
+            'traveller_type': traveller_type,
+            'final_price': final_price,
+            'selected_discount': selected_discount,
+            'discount_info': discount_info,
+            'quote': quote.token
+        })
+        
+        response = f"💰 **Final Price Calculation:**\n"
+        response += f"• Base price: ${quote.base_price:.2f}\n"
+        response += _demand_line(quote)
+        response += f"• Traveller type: {traveller_type.title()}\n"
+        if traveller_type == 'child':
+            response += f"• Child discount: 50% OFF\n"
+        if selected_discount:
+            _, name, percentage, user_type, min_points = selected_discount
+            response += f"• Discount code: {name} ({percentage}% OFF)\n"
+        response += f"• **Final price: ${final_price:.2f}**\n\n"
+        response += f"🎟️ {discount_info}\n\n"
+        response += _held_line(quote)
+        response += f"✅ Type **'confirm'** to complete booking or **'cancel'** to abort."
+        
+        return response
+    else:
+        available_discounts = session.booking_context.get('available_discounts', [])
+        return f"🤔 Please choose a valid option!\n\n**Your choices:**\n• Type **'0'** = Skip all discounts (standard price)\n• Type **'1' to '{len(available_discounts)}'** = Apply that specific discount code\n\n💡 **Example:** Type '1' to apply the first discount, '2' for the second, etc.\nOr type '0' if you prefer standard pricing without any discount codes."
+
+
+def _confirm(svc, session, message, hits):
+    # Handle booking confirmation
+    if message == 'confirm':
+        route = session.booking_context['route']
+        traveller_type = session.booking_context['traveller_type']
+        selected_discount = session.booking_context.get('selected_discount')
+        
+        # Book the quoted ticket at the quoted price
+        result = svc.book_quote(session.booking_context.get('quote'), session.chat_current_user_id)
+        
+        if result.get('requote'):
+            # Quote expired or already used: price the same route again
+            session.booking_context = {'step': 'traveller_type', 'route': route}
+            return f"⏳ {result['error']}\n\nType **'adult'** or **'child'** to get a fresh price for {route[1]} → {route[2]}."
+        
+        # Clear booking context and mark as completed
+        session.booking_context = {'step': 'booking_completed'}
+        
+        if 'error' in result:
+            return f"❌ Booking failed: {result['error']}"
+        else:
+            response = f"🎉 **Booking successful!**\n\n"
+            response += f"📋 **Booking Details:**\n"
+            response += f"• **Booking ID:** {result['booking_id']}\n"
+            response += f"• **Route:** {route[1]} → {route[2]}\n"
+            response += f"• **Transport:** {route[5]}\n"
+            response += f"• **Traveller type:** {traveller_type.title()}\n"
+            if selected_discount:
+                _, name, percentage, user_type, min_points = selected_discount
+                response += f"• **Discount applied:** {name} ({percentage}% OFF)\n"
+            response += f"• **Price paid:** ${result['price_paid']:.2f}\n"
+            response += f"• **Status:** {result['status']}\n\n"
+            response += f"🎫 **Thank you for your booking!**\n\n"
+            response += f"✅ **Your booking is complete!** You can now:\n"
+            response += f"• Type '**show my bookings**' to see all your trips\n"
+            response += f"• Type '**book ticket**' to book another trip\n"
+            response += f"• Type '**help**' for more options\n"
+            response += f"• Or simply continue chatting for assistance!\n\n"
+            response += f"🌟 **Enjoy your journey!**"
+            
+            return response
+    
+    elif message == 'cancel':
+        session.booking_context = {}
+        return "❌ Booking cancelled. How else can I help you?"
+    else:
+        return "Please type 'confirm' to complete booking or 'cancel' to abort."
+
+
+def _booking_completed(svc, session, message, hits):
+    # Handle post-booking completion actions
+    # Clear the completion flag after first interaction
+    session.booking_context = {}
+    
+    # Handle the first post-booking action gracefully
+    if _any(hits, POST_BOOKING_QUERY_WORDS):
+        # Process the booking request normally - the existing logic will handle it
+        pass  # Fall through to booking queries handler
+    elif _any(hits, POST_BOOKING_BOOK_WORDS):
+        # Start new booking flow
+        session.booking_context = {'step': 'asking_origin'}
+        return "🌍 **Great! Let's book another trip!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai' \n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
+    elif _any(hits, HELP_WORDS):
+        # Fall through to help handler
+        pass
+    elif _any(hits, THANKS_WORDS):
+        return f"😊 **You're very welcome, {session.chat_current_user}!**\n\nI'm glad I could help you complete your booking. Feel free to ask if you need anything else - I'm always here to assist with your travel needs!\n\n✈️ **Safe travels!**"
+    else:
+        # For any other message, provide helpful guidance
+        return f"👋 **Thanks for using our booking system, {session.chat_current_user}!**\n\nYour booking was successful. If you need anything else:\n\n• Type '**show my bookings**' to see all your trips\n• Type '**book ticket**' to book another trip\n• Type '**help**' for more options\n\nWhat would you like to do next?"
+
+
+def _price(svc, session, message, hits):
+    # Price inquiry
+    return "💰 Ticket prices depend on:\n- Route and destination\n- Traveller type (child = 50% discount)\n- Seat availability (dynamic pricing)\n- Your loyalty points\n\nTo see exact prices, use 'show routes' or start booking with 'book ticket'."
+
+
+def _total(svc, session, message, hits):
+    # Handle total price queries
+    if not session.chat_user_authenticated:
+        return "🔐 Please log in first to view spending information.\n\nType 'login' to get started!"
+    
+    # Extract username if specified, otherwise use current user
+    username_match = re.search(r'(?:for|of|user)\s+(\w+)', message)
+    if username_match:
+        requested_user = username_match.group(1)
+    else:
+        requested_user = session.chat_current_user
+    
+    try:
+        result = svc.run_agent(f'total price for user {requested_user}')
+        if isinstance(result, AgentMessage):
+            return f"{result.text}\n\nPlease try again or contact support."
+        
+        if result.booking_count:
+            return f"💰 **Total Spending Analysis for {requested_user.title()}:**\n\n{svc.render_user_total(result)}💡 Want to see individual bookings? Ask 'show bookings for {requested_user}'"
+        else:
+            return f"❌ No spending information found for {requested_user}."
+            
+    except Exception as e:
+        return f"❌ Error calculating total spending: {str(e)}\n\nPlease try again or contact support."
+
+
+def _greeting(svc, session, message, hits):
+    # Greeting (enhanced and more welcoming)
+    if session.chat_user_authenticated:
+        return f"Hello again, {session.chat_current_user}! 😊\n\n🌍 **What would you like to do today?**\n\n**Choose an option:**\n1️⃣ **Book from existing routes** - See available flights and book\n2️⃣ **Add new route** - Request a new route to be added\n3️⃣ **Check my bookings** - View your booking history\n\nJust type **'1'**, **'2'**, **'3'** or describe what you need!"
+    else:
+        return "👋 **Hello! Welcome to the Travel Booking System!** ✈️\n\nI'm your friendly travel assistant and I'm here to help you:\n• 🎫 **Book tickets** to amazing destinations\n• � **Add new routes** based on your needs\n• 💰 **Get best prices** with automatic discounts\n• 📋 **Manage bookings** easily\n\n🔐 **Ready to start? Please log in first:**\n\nJust say **'login'** and I'll guide you step by step!"
+
+
+STEP, KEYWORDS, ALWAYS = 'step', 'keywords', 'always'
+
+# The flow in priority order: (kind, trigger, handler)
+RULES = [
+    (STEP, 'asking_username', _asking_username),
+    (STEP, 'asking_password', _asking_password),
+    (STEP, 'route_selection', _route_selection),
+    (ALWAYS, None, _route_number),
+    (ALWAYS, None, _listing),
+    (KEYWORDS, BOOKING_QUERY_WORDS, _booking_queries),
+    (KEYWORDS, SYSTEM_BOOKING_WORDS, _system_bookings),
+    (KEYWORDS, LOGIN_WORDS, _login),
+    (KEYWORDS, TRAVEL_WORDS, _travel),
+    (STEP, 'choose_action', _choose_action),
+    (STEP, 'new_route_origin', _new_route_origin),
+    (STEP, 'new_route_destination', _new_route_destination),
+    (STEP, 'new_route_transport', _new_route_transport),
+    (STEP, 'new_route_price', _new_route_price),
+    (STEP, 'new_route_seats', _new_route_seats),
+    (STEP, 'offer_immediate_booking', _offer_immediate_booking),
+    (STEP, 'asking_origin', _asking_origin),
+    (STEP, 'asking_destination', _asking_destination),
+    (STEP, 'offer_new_route', _offer_new_route),
+    (KEYWORDS, ADD_ROUTE_WORDS, _add_route),
+    (KEYWORDS, ADMIN_HELP_WORDS, _admin_help),
+    (KEYWORDS, SHOW_ROUTES_WORDS, _show_routes),
+    (KEYWORDS, HELP_WORDS, _help),
+    (KEYWORDS, BOOK_WORDS, _book),
+    (STEP, 'traveller_type', _traveller_type),
+    (STEP, 'discount_selection', _discount_selection),
+    (STEP, 'confirm', _confirm),
+    (STEP, 'booking_completed', _booking_completed),
+    (KEYWORDS, PRICE_WORDS, _price),
+    (KEYWORDS, TOTAL_WORDS, _total),
+    (KEYWORDS, GREETING_WORDS, _greeting),
+]
+
+# Phrases only handlers look at; the matcher reports them too
+HANDLER_PHRASES = (
+    SYSTEM_REPORT_WORDS + USER_QUALIFIERS + MY_BOOKINGS_WORDS + EXISTING_ROUTE_WORDS + NEW_ROUTE_WORDS
+    + BOOK_NOW_WORDS + SHOW_ALL_WORDS + ADD_ANOTHER_WORDS + CREATE_ROUTE_WORDS + CHANGE_CITY_WORDS
+    + POST_BOOKING_QUERY_WORDS + POST_BOOKING_BOOK_WORDS + THANKS_WORDS + BOOK_ROUTE_PREFIX
+)
+
+
+class ChatFlow:
+    """The booking chat: respond(session, message) -> reply text"""
+
+    def __init__(self, services, rules=RULES, phrases=HANDLER_PHRASES):
+        self.services = services
+        self.steps = {}
+        self.keywords = {}
+        self.always = []
+        for priority, (kind, trigger, handler) in enumerate(rules):
+            if kind == STEP:
+                self.steps[trigger] = (priority, handler)
+            elif kind == KEYWORDS:
+                for phrase in trigger:
+                    self.keywords.setdefault(phrase, []).append((priority, handler))
+            else:
+                self.always.append((priority, handler))
+        self.matcher = KeywordMatcher(list(self.keywords) + list(phrases))
+
+    def candidates(self, step, hits):
+        """Handlers that may answer, in priority order"""
+        found = dict(self.always)
+        if step in self.steps:
+            priority, handler = self.steps[step]
+            found[priority] = handler
+        for phrase in hits:
+            found.update(self.keywords.get(phrase, ()))
+        return [found[priority] for priority in sorted(found)]
+
+    def respond(self, session, message):
+        message = message.lower().strip()
+        hits = self.matcher.scan(message)
+        for handler in self.candidates(session.booking_context.get('step'), hits):
+            reply = handler(self.services, session, message, hits)
+            if reply is not None:
+                return reply
+        return DEFAULT_REPLY
@@ -0,0 +1,116 @@
+"""
+Bounded chat / REPL history
+
+st.session_state.chat_messages and repl_output used to be plain lists that
+grew with every turn, and every rerun rendered all of them. A
+HistoryBuffer keeps only the latest ``live_limit`` entries in memory as
+they are; older ones are spilled in chunks of ``chunk_size`` to
+zlib-compressed JSON held by the same session:
+
+    history = HistoryBuffer()
+    history.append({"role": "user", "content": "show routes"})
+    for message in history.tail(20):
+        ...
+
+It still supports append(), len() and truth testing like the lists it
+replaces. The UI renders tail(window) and pages further back with a "load
+earlier" button. Only the chunks that page reaches are decompressed.
+
+split_preview() cuts long replies (booking reports) into a short preview
+and the rest, so the rest can be rendered collapsed.
+"""
+import json
+import zlib
+from collections import deque
+from itertools import islice
+
+# Entries kept uncompressed per history
+HISTORY_LIVE_LIMIT = 50
+# Entries compressed together when the live part overflows
+SPILL_CHUNK_SIZE = 25
+# Entries shown before "load earlier"
+HISTORY_WINDOW = 20
+# Replies longer than this are shown as a preview plus a collapsed remainder
+COLLAPSE_CHARS = 1200
+
+
+class HistoryBuffer:
+    """Append-only history: recent entries live, older ones compressed"""
+
+    def __init__(self, live_limit=HISTORY_LIVE_LIMIT, chunk_size=SPILL_CHUNK_SIZE):
+        self.live_limit = live_limit
+        self.chunk_size = chunk_size
+        self._live = deque()
+        self._chunks = []  # oldest first; each holds chunk_size entries
+        self.spilled = 0
+
+    def append(self, entry):
+        self._live.append(entry)
+        if len(self._live) >= self.live_limit + self.chunk_size:
+            chunk = [self._live.popleft() for _ in range(self.chunk_size)]
+            self._chunks.append(zlib.compress(json.dumps(chunk).encode('utf-8')))
+            self.spilled += len(chunk)
+
+    def __len__(self):
+        return self.spilled + len(self._live)
+
+    def __bool__(self):
+        return bool(self._live) or self.spilled > 0
+
+    def __iter__(self):
+        for index in range(len(self._chunks)):
+            yield from self._chunk(index)
+        yield from list(self._live)
+
+    def _chunk(self, index):
+        return json.loads(zlib.decompress(self._chunks[index]).decode('utf-8'))
+
+    def tail(self, count):
+        """The last ``count`` entries, oldest first"""
+        live = len(self._live)
+        if count <= live:
+            return list(islice(self._live, live - count, live))
+        entries = list(self._live)
+        index = len(self._chunks)
+        while len(entries) < count and index > 0:
+            index -= 1
+            entries = self._chunk(index) + entries
+        return entries[-count:]
+
+    def clear(self):
+        self._live.clear()
+        self._chunks.clear()
+        self.spilled = 0
+
+    def to_state(self):
+        """The buffer as plain data (chunks stay compressed), for storing it elsewhere"""
+        return {'live_limit': self.live_limit, 'chunk_size': self.chunk_size, 'spilled': self.spilled,
+                'chunks': list(self._chunks), 'live': list(self._live)}
+
+    @classmethod
+    def from_state(cls, state):
+        """A buffer rebuilt from to_state()"""
+        history = cls(state['live_limit'], state['chunk_size'])
+        history._chunks = list(state['chunks'])
+        history._live.extend(state['live'])
+        history.spilled = state['spilled']
+        return history
+
+    def stats(self):
+        """Entry counts and the size of the compressed part"""
+        return {
+            'entries': len(self),
+            'live': len(self._live),
+            'spilled': self.spilled,
+            'compressed_bytes': sum(len(chunk) for chunk in self._chunks),
+        }
+
+
+def split_preview(text, limit=COLLAPSE_CHARS):
+    """(preview, rest) of a long text, cut at a line break; rest is None if it fits"""
+    if len(text) <= limit:
+        return text, None
+    cut = text.rfind('\n', 0, limit)
+    if cut <= 0:
+        cut = limit
+    return text[:cut], text[cut:].lstrip('\n')
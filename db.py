@@ -0,0 +1,66 @@
+"""
+Shared SQLite connections for long-running agent processes (batch mode,
+servers). One-off scripts keep opening their own connection to travel.db.
+
+The app's short-lived connections (quotes, the route catalogue, login) are
+opened with connect(), so code such as perf_stats can watch them through
+on_connect() hooks.
+"""
+import sqlite3
+import threading
+
+DB_PATH = 'travel.db'
+
+_connect_hooks = []
+
+
+def on_connect(hook):
+    """Call hook(conn) for every connection connect() opens; it may return a
+    callable to run when that connection is closed"""
+    _connect_hooks.append(hook)
+
+
+class _HookedConnection(sqlite3.Connection):
+    _on_close = ()
+
+    def close(self):
+        on_close, self._on_close = self._on_close, ()
+        for finish in on_close:
+            finish()
+        super().close()
+
+
+def connect(db_path=DB_PATH, **kwargs):
+    """sqlite3.connect() for a connection the caller closes, seen by the on_connect() hooks"""
+    conn = sqlite3.connect(db_path, factory=_HookedConnection, **kwargs)
+    conn._on_close = [finish for finish in (hook(conn) for hook in _connect_hooks) if finish is not None]
+    return conn
+
+
+class ConnectionPool:
+    """Hands every thread its own reusable connection to the same database"""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get(self):
+        """The calling thread's connection, opened on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # check_same_thread=False only so close_all() can run from any thread;
+            # each connection is still used by the thread that opened it
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
@@ -45,91 +45,224 @@ def fetch_all_bookings_for_user(username):
     return total
 
 import sqlite3
+from dataclasses import dataclass
 
-def fetch_and_explain_booking(booking_id):
-    conn = sqlite3.connect('travel.db')
+@dataclass
+class BookingBreakdown:
+    """Every number behind the final price of one booking"""
+    booking_id: int
+    user_id: int
+    route_id: int
+    origin: str
+    destination: str
+    transport_type: str
+    base_price: float
+    seats_total: int
+    seats_left: int
+    demand_factor: float
+    price_after_demand: float
+    discount: float
+    final_price: float
+    traveller_type: str
+    loyalty_points: int
+    price_paid: float
+    booking_time: str
+    status: str
+
+def compute_final_price(base_price, seats_total, seats_left, traveller_type, discount):
+    """Pricing formula only: returns (demand_factor, price_after_demand, final_price)"""
+    demand_factor = 1 + (1 - seats_left / seats_total) * 0.5
+    price_after_demand = round(base_price * demand_factor, 2)
+    price = price_after_demand * 0.5 if traveller_type == 'child' else price_after_demand
+    final_price = round(price * (1 - discount / 100), 2)
+    return demand_factor, price_after_demand, final_price
+
+def price_booking(booking_id, conn=None):
+    """Number-only pricing of one booking. Returns a BookingBreakdown.
+
+    Raises LookupError (with the message shown to users) when the booking or
+    its route does not exist. Pass conn to reuse an open connection.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect('travel.db')
     c = conn.cursor()
     try:
-        c.execute('SELECT user_id, route_id, price_paid, seat_number, booking_time, status, traveller_type FROM bookings WHERE id=?', (booking_id,))
-        booking = c.fetchone()
-        if not booking:
-            print(f"No booking found with ID {booking_id}")
-            return None
-        user_id, route_id, price_paid, seat_number, booking_time, status, traveller_type = booking
-    except sqlite3.OperationalError as e:
-        if 'traveller_type' in str(e):
-            c.execute('SELECT user_id, route_id, price_paid, seat_number, booking_time, status FROM bookings WHERE id=?', (booking_id,))
+        try:
+            c.execute('SELECT user_id, route_id, price_paid, seat_number, booking_time, status, traveller_type FROM bookings WHERE id=?', (booking_id,))
             booking = c.fetchone()
             if not booking:
-                print(f"No booking found with ID {booking_id}")
-                return None
-            user_id, route_id, price_paid, seat_number, booking_time, status = booking
-            traveller_type = 'adult'
-        else:
-            raise
-    c.execute('SELECT origin, destination, base_price, seats_total, transport_type FROM routes WHERE id=?', (route_id,))
-    route = c.fetchone()
-    if not route:
-        print(f"No route found for booking.")
-        return None
-    origin, destination, base_price, seats_total, transport_type = route
-    c.execute('SELECT COUNT(*) FROM bookings WHERE route_id=? AND id<=?', (route_id, booking_id))
-    booked_so_far = c.fetchone()[0]
+                raise LookupError(f"No booking found with ID {booking_id}")
+            user_id, route_id, price_paid, seat_number, booking_time, status, traveller_type = booking
+        except sqlite3.OperationalError as e:
+            if 'traveller_type' in str(e):
+                c.execute('SELECT user_id, route_id, price_paid, seat_number, booking_time, status FROM bookings WHERE id=?', (booking_id,))
+                booking = c.fetchone()
+                if not booking:
+                    raise LookupError(f"No booking found with ID {booking_id}")
+                user_id, route_id, price_paid, seat_number, booking_time, status = booking
+                traveller_type = 'adult'
+            else:
+                raise
+        c.execute('SELECT origin, destination, base_price, seats_total, transport_type FROM routes WHERE id=?', (route_id,))
+        route = c.fetchone()
+        if not route:
+            raise LookupError("No route found for booking.")
+        origin, destination, base_price, seats_total, transport_type = route
+        c.execute('SELECT COUNT(*) FROM bookings WHERE route_id=? AND id<=?', (route_id, booking_id))
+        booked_so_far = c.fetchone()[0]
+        seats_left = seats_total - booked_so_far + 1
+        c.execute('SELECT loyalty_points FROM users WHERE id=?', (user_id,))
+        row = c.fetchone()
+        loyalty_points = row[0] if row else 0
+        c.execute('''SELECT percentage FROM discounts WHERE (user_type=? OR user_type IS NULL OR user_type='') AND min_points<=? ORDER BY percentage DESC LIMIT 1''', (traveller_type, loyalty_points))
+        discount_row = c.fetchone()
+        discount = discount_row[0] if discount_row else 0
+    finally:
+        if own_conn:
+            conn.close()
+    demand_factor, price_after_demand, final_price = compute_final_price(
+        base_price, seats_total, seats_left, traveller_type, discount)
+    return BookingBreakdown(
+        booking_id=booking_id, user_id=user_id, route_id=route_id,
+        origin=origin, destination=destination, transport_type=transport_type,
+        base_price=base_price, seats_total=seats_total, seats_left=seats_left,
+        demand_factor=demand_factor, price_after_demand=price_after_demand,
+        discount=discount, final_price=final_price, traveller_type=traveller_type,
+        loyalty_points=loyalty_points, price_paid=price_paid,
+        booking_time=booking_time, status=status,
+    )
+
+def traveller_type_column(conn):
+    """SQL for a booking's traveller type; older databases have no such column"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(bookings)')}
+    return 'b.traveller_type' if 'traveller_type' in columns else "'adult'"
+
+def priced_bookings_sql(conn, bookings_filter=None):
+    """One SELECT with every input price_booking needs, for all bookings at once.
+
+    Columns: username, booking_id, user_id, route_id, price_paid, booking_time,
+    status, traveller_type, origin, destination, base_price, seats_total,
+    transport_type, booked_so_far, loyalty_points, discount, has_route.
+    Seats already booked come from a window count over the route's bookings
+    and the discount from a correlated lookup, so wrap this in your own
+    WHERE / ORDER BY instead of querying booking by booking.
+
+    bookings_filter is an optional condition on bookings (alias b) applied
+    before the window count, so it must keep every booking of a route that
+    is counted - e.g. filter by route_id, not by user.
+    """
+    return f'''
+        SELECT u.username, b.id AS booking_id, b.user_id, b.route_id, b.price_paid,
+               b.booking_time, b.status, b.traveller_type,
+               r.origin, r.destination, r.base_price, r.seats_total, r.transport_type,
+               b.booked_so_far, b.loyalty_points,
+               COALESCE((SELECT d.percentage FROM discounts d
+                         WHERE (d.user_type = b.traveller_type OR d.user_type IS NULL OR d.user_type = '')
+                           AND d.min_points <= b.loyalty_points
+                         ORDER BY d.percentage DESC LIMIT 1), 0) AS discount,
+               r.id IS NOT NULL AS has_route
+        FROM (
+            SELECT b.id, b.user_id, b.route_id, b.price_paid, b.booking_time, b.status,
+                   {traveller_type_column(conn)} AS traveller_type,
+                   CASE WHEN u.id IS NULL THEN 0 ELSE u.loyalty_points END AS loyalty_points,
+                   COUNT(*) OVER (PARTITION BY b.route_id ORDER BY b.id) AS booked_so_far
+            FROM bookings b
+            LEFT JOIN users u ON u.id = b.user_id
+            {f"WHERE {bookings_filter}" if bookings_filter else ""}
+        ) b
+        LEFT JOIN users u ON u.id = b.user_id
+        LEFT JOIN routes r ON r.id = b.route_id
+    '''
+
+def breakdown_from_row(row):
+    """BookingBreakdown for one priced_bookings_sql row (same numbers as price_booking)"""
+    (_, booking_id, user_id, route_id, price_paid, booking_time, status, traveller_type,
+     origin, destination, base_price, seats_total, transport_type,
+     booked_so_far, loyalty_points, discount, has_route) = row
+    if not has_route:
+        raise LookupError("No route found for booking.")
     seats_left = seats_total - booked_so_far + 1
-    c.execute('SELECT loyalty_points FROM users WHERE id=?', (user_id,))
-    row = c.fetchone()
-    loyalty_points = row[0] if row else 0
-    demand_factor = 1 + (1 - seats_left / seats_total) * 0.5
+    demand_factor, price_after_demand, final_price = compute_final_price(
+        base_price, seats_total, seats_left, traveller_type, discount)
+    return BookingBreakdown(
+        booking_id=booking_id, user_id=user_id, route_id=route_id,
+        origin=origin, destination=destination, transport_type=transport_type,
+        base_price=base_price, seats_total=seats_total, seats_left=seats_left,
+        demand_factor=demand_factor, price_after_demand=price_after_demand,
+        discount=discount, final_price=final_price, traveller_type=traveller_type,
+        loyalty_points=loyalty_points, price_paid=price_paid,
+        booking_time=booking_time, status=status,
+    )
+
+def register_pricing_functions(conn):
+    """Make final_price(base_price, seats_total, seats_left, traveller_type, discount)
+    callable from SQL on this connection (same formula as compute_final_price)"""
+    conn.create_function(
+        'final_price', 5,
+        lambda *args: compute_final_price(*args)[2],
+        deterministic=True,
+    )
+
+def explain_booking(b):
+    """Human-readable price calculation for a BookingBreakdown"""
     demand_factor_explanation = (
         f"Demand factor = 1 + (1 - seats_left / seats_total) * 0.5\n"
-        f"              = 1 + (1 - {seats_left} / {seats_total}) * 0.5\n"
-        f"              = 1 + ({1 - seats_left / seats_total:.2f}) * 0.5\n"
-        f"              = {demand_factor:.2f}"
+        f"              = 1 + (1 - {b.seats_left} / {b.seats_total}) * 0.5\n"
+        f"              = 1 + ({1 - b.seats_left / b.seats_total:.2f}) * 0.5\n"
+        f"              = {b.demand_factor:.2f}"
     )
-    price_after_demand = round(base_price * demand_factor, 2)
     price_after_demand_explanation = (
         f"Price after demand = base_price * demand_factor\n"
-        f"                  = {base_price} * {demand_factor:.2f}\n"
-        f"                  = {price_after_demand}"
+        f"                  = {b.base_price} * {b.demand_factor:.2f}\n"
+        f"                  = {b.price_after_demand}"
     )
-    c.execute('''SELECT percentage FROM discounts WHERE (user_type=? OR user_type IS NULL OR user_type='') AND min_points<=? ORDER BY percentage DESC LIMIT 1''', (traveller_type, loyalty_points))
-    discount_row = c.fetchone()
-    discount = discount_row[0] if discount_row else 0
+    price_after_demand = b.price_after_demand
     child_discount_explanation = ""
-    if traveller_type == 'child':
-        price_after_demand_before = price_after_demand
-        price_after_demand *= 0.5
+    if b.traveller_type == 'child':
+        price_after_demand = b.price_after_demand * 0.5
         child_discount_explanation = (
             f"Traveller type is 'child', so 50% child discount applies.\n"
-            f"Price after child discount = {price_after_demand_before} * 0.5 = {price_after_demand}"
+            f"Price after child discount = {b.price_after_demand} * 0.5 = {price_after_demand}"
         )
-    final_price = round(price_after_demand * (1 - discount / 100), 2)
     discount_explanation = (
-        f"Discount applied = {discount}%\n"
+        f"Discount applied = {b.discount}%\n"
         f"Final price = price_after_demand * (1 - discount/100)\n"
-        f"           = {price_after_demand} * (1 - {discount}/100)\n"
-        f"           = {final_price}"
+        f"           = {price_after_demand} * (1 - {b.discount}/100)\n"
+        f"           = {b.final_price}"
     )
-    print(f"Booking ID: {booking_id}")
-    print(f"Route: {origin} -> {destination} ({transport_type})")
-    print(f"Base price: {base_price}")
-    print(f"Seats total: {seats_total}")
-    print(f"Seats left at booking: {seats_left}")
-    print("\n--- Calculation Details ---")
-    print(demand_factor_explanation)
-    print("\n" + price_after_demand_explanation)
+    lines = [
+        f"Booking ID: {b.booking_id}",
+        f"Route: {b.origin} -> {b.destination} ({b.transport_type})",
+        f"Base price: {b.base_price}",
+        f"Seats total: {b.seats_total}",
+        f"Seats left at booking: {b.seats_left}",
+        "\n--- Calculation Details ---",
+        demand_factor_explanation,
+        "\n" + price_after_demand_explanation,
+    ]
     if child_discount_explanation:
-        print("\n" + child_discount_explanation)
-    print("\n" + discount_explanation)
-    print("--------------------------\n")
-    print(f"Traveller type: {traveller_type}")
-    print(f"User loyalty points: {loyalty_points}")
-    print(f"Final price paid: {final_price}")
-    print(f"Price recorded in booking: {price_paid}")
-    print(f"Booking time: {booking_time}")
-    print(f"Status: {status}")
-    conn.close()
-    return final_price
+        lines.append("\n" + child_discount_explanation)
+    lines += [
+        "\n" + discount_explanation,
+        "--------------------------\n",
+        f"Traveller type: {b.traveller_type}",
+        f"User loyalty points: {b.loyalty_points}",
+        f"Final price paid: {b.final_price}",
+        f"Price recorded in booking: {b.price_paid}",
+        f"Booking time: {b.booking_time}",
+        f"Status: {b.status}",
+    ]
+    return "\n".join(lines)
+
+def fetch_and_explain_booking(booking_id):
+    try:
+        breakdown = price_booking(booking_id)
+    except LookupError as e:
+        print(e)
+        return None
+    print(explain_booking(breakdown))
+    return breakdown.final_price
 
 if __name__ == "__main__":
     print("Choose calculation mode:")
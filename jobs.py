@@ -0,0 +1,178 @@
+"""
+Background jobs for heavy agent commands
+
+run_agent_with_progress keeps the Streamlit script waiting until the
+command is done, so the session can do nothing else meanwhile. Reports
+go through the JobRunner instead. submit() returns a job id straight
+away, the command runs on the shared AgentScheduler, and the page polls
+the id:
+
+    job_id = get_job_runner().submit(agent, "provide all bookings",
+                                     label="📊 Analysing all bookings...", structured=True)
+    ...
+    job = get_job_runner().get(job_id)
+    job.status, job.progress          # 'running', (120, 400)
+    job.outcome()                     # (result, None) or (None, error) once done
+
+Finished jobs keep their result for JOB_RESULT_TTL seconds, so a report
+can be shown again without running it again. Submitting a command that
+is still queued or running with the same arguments returns the existing
+job instead of starting a second one. Every submit attaches its ``owner``
+(a session) to the job, and cancel(job_id, owner) only detaches that
+owner: the command itself is cancelled once no owner is left, so one
+session cannot cancel a report another session is waiting for.
+"""
+import itertools
+import threading
+import time
+
+from sandbox import CancellationToken
+from scheduler import get_scheduler
+
+# Seconds a finished job's result stays available
+JOB_RESULT_TTL = 600.0
+# Finished jobs kept at most (oldest dropped first)
+JOB_RESULTS_KEPT = 200
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+
+class Job:
+    """One submitted command and its progress"""
+
+    def __init__(self, job_id, command, label, key):
+        self.job_id = job_id
+        self.command = command
+        self.label = label or command
+        self.key = key
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.cancel_token = CancellationToken()
+        self.future = None
+        self.owners = set()
+        self._progress = (0, 0)
+
+    def report(self, done, total):
+        """Progress callback handed to the agent"""
+        self._progress = (done, total)
+
+    @property
+    def progress(self):
+        """(done, total) as last reported; total is 0 until the command reports"""
+        return self._progress
+
+    @property
+    def fraction(self):
+        done, total = self._progress
+        return min(done / total, 1.0) if total else None
+
+    @property
+    def status(self):
+        if self.future.cancelled():
+            return CANCELLED
+        if self.future.done():
+            return FAILED if self.future.exception() is not None else DONE
+        return RUNNING if self.future.running() else QUEUED
+
+    @property
+    def finished(self):
+        return self.future.done()
+
+    def outcome(self):
+        """(result, None) or (None, exception) of a finished job"""
+        if self.future.cancelled():
+            return None, RuntimeError("Cancelled")
+        error = self.future.exception()
+        return (None, error) if error is not None else (self.future.result(), None)
+
+    def cancel(self):
+        self.future.cancel()
+        self.cancel_token.cancel()
+
+
+class JobRunner:
+    """Submits agent commands as jobs and keeps their results for a while"""
+
+    def __init__(self, scheduler=None, ttl=JOB_RESULT_TTL, keep=JOB_RESULTS_KEPT):
+        self._scheduler = scheduler
+        self.ttl = ttl
+        self.keep = keep
+        self._jobs = {}  # job_id -> Job, in submission order
+        self._active = {}  # key -> Job still queued or running
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def scheduler(self):
+        return self._scheduler or get_scheduler()
+
+    def submit(self, agent, command, label=None, owner=None, **kwargs):
+        """Run ``agent.process_command(command, **kwargs)`` in the background; returns the job id
+        
+        ``owner`` identifies the caller for cancel(); without one, each submit is its own owner.
+        """
+        owner = owner if owner is not None else object()
+        key = (id(agent), command, tuple(sorted(kwargs.items())))
+        with self._lock:
+            self._prune()
+            active = self._active.get(key)
+            if active is not None and not active.finished:
+                active.owners.add(owner)
+                return active.job_id
+            job = Job(next(self._ids), command, label, key)
+            job.owners.add(owner)
+            job.future = self.scheduler.submit(agent, command, progress=job.report, cancel=job.cancel_token,
+                                               **kwargs)
+            self._jobs[job.job_id] = self._active[key] = job
+        job.future.add_done_callback(lambda _: self._finished(job))
+        return job.job_id
+
+    def _finished(self, job):
+        job.finished_at = time.time()
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+
+    def get(self, job_id):
+        """The Job with this id, or None once it has been dropped"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id, owner=None):
+        """Detach ``owner`` from a job, cancelling it once nobody else is attached
+        
+        Without an owner the job is cancelled outright. Returns True if it was cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if owner is not None:
+                job.owners.discard(owner)
+                if job.owners:
+                    return False
+        job.cancel()
+        return True
+
+    def _prune(self):
+        """Drop old finished jobs; caller holds the lock"""
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        excess = len(finished) - self.keep
+        for job in finished:
+            if excess > 0 or now - job.finished_at > self.ttl:
+                del self._jobs[job.job_id]
+                excess -= 1
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """The process-wide JobRunner"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
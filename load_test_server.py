@@ -0,0 +1,103 @@
+"""
+Load test for agent_server.py
+
+    python load_test_server.py [--url http://127.0.0.1:8765] [--clients 8] [--requests 2000]
+    python load_test_server.py --spawn      # start a server in this process first
+
+Each client thread keeps one HTTP/1.1 connection alive and cycles through a
+mix of typical queries. Prints requests/second and latency percentiles.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+REQUEST_MIX = [
+    ('GET', '/bookings/1', None),
+    ('GET', '/bookings/5/owner', None),
+    ('GET', '/users/nikitha/total', None),
+    ('POST', '/command', {'command': 'show booking 9'}),
+    ('POST', '/command', {'command': 'total price for user John'}),
+    ('POST', '/rpc', {'jsonrpc': '2.0', 'id': 1, 'method': 'booking_owner', 'params': [3]}),
+]
+
+
+def run_client(host, port, count, offset, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        for i in range(count):
+            method, path, payload = REQUEST_MIX[(offset + i) % len(REQUEST_MIX)]
+            body = json.dumps(payload) if payload is not None else None
+            headers = {'Content-Type': 'application/json'} if body else {}
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(str(e))
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+                continue
+            latencies.append(time.perf_counter() - started)
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the agent HTTP server")
+    parser.add_argument('--url', default='http://127.0.0.1:8765')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000, help="total requests")
+    parser.add_argument('--spawn', action='store_true', help="start a server in this process")
+    parser.add_argument('--workers', type=int, default=8, help="server workers with --spawn")
+    args = parser.parse_args(argv)
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    server = None
+    if args.spawn:
+        from agent_server import make_server
+        server = make_server(host, port, args.workers)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    latencies, errors = [], []
+    per_client = max(1, args.requests // args.clients)
+    threads = [
+        threading.Thread(target=run_client, args=(host, port, per_client, n, latencies, errors))
+        for n in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server.agent.pool.close_all()
+
+    latencies.sort()
+    print(f"📈 {len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s")
+    print(f"⚡ {len(latencies) / elapsed:.1f} requests/second")
+    print(f"⏱️  p50 {percentile(latencies, 0.50) * 1000:.2f} ms | "
+          f"p95 {percentile(latencies, 0.95) * 1000:.2f} ms | "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+    if errors:
+        print(f"❌ {len(errors)} errors, e.g. {errors[:3]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Per-call capture of printed output
+
+Text-mode agent commands print their results (process_command(..., 'local'),
+the system REPL and the fetch_and_calculate helpers). Swapping sys.stdout to
+capture that is process-wide, so concurrent sessions would read each
+other's output. capture_output() routes prints by context instead:
+
+    with capture_output() as out:
+        agent.process_command("show booking 1")
+    text = out.getvalue()
+
+On first use sys.stdout is replaced, once, by a router that writes to the
+sink set in the current contextvars context and to the real stdout
+otherwise. Every thread, and every asyncio task, has its own context, so
+each capture only sees its own prints. Threads started inside a capture
+do not inherit it unless they run in a copied context (the agent scheduler
+does this for the commands it runs).
+"""
+import contextvars
+import io
+import sys
+import threading
+from contextlib import contextmanager
+
+_sink = contextvars.ContextVar('output_sink', default=None)
+_install_lock = threading.Lock()
+
+
+class StdoutRouter(io.TextIOBase):
+    """sys.stdout stand-in that writes to the current context's sink"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def _target(self):
+        sink = _sink.get()
+        return sink if sink is not None else self.fallback
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def writable(self):
+        return True
+
+    @property
+    def encoding(self):
+        return getattr(self.fallback, 'encoding', 'utf-8')
+
+    def fileno(self):
+        return self.fallback.fileno()
+
+    def isatty(self):
+        return self.fallback.isatty()
+
+
+def install_router():
+    """Put a StdoutRouter in front of whatever sys.stdout currently is"""
+    with _install_lock:
+        if not isinstance(sys.stdout, StdoutRouter):
+            sys.stdout = StdoutRouter(sys.stdout)
+        return sys.stdout
+
+
+@contextmanager
+def capture_output(sink=None):
+    """Collect everything printed in this context into ``sink`` (a new StringIO by default)"""
+    install_router()
+    sink = sink if sink is not None else io.StringIO()
+    token = _sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _sink.reset(token)
@@ -0,0 +1,224 @@
+"""
+Per-turn performance counters for the app's admin panel
+
+Operators could not see where a chat turn's time went. A turn run inside
+PerfStats.turn() records its total time, the chat flow's time, the agent
+calls it made and the SQL they ran:
+
+    stats = get_perf_stats()
+    with stats.turn(session_id, step) as turn:
+        with turn.timing('respond_ms'):
+            reply = flow.respond(session, message)
+    turn.render_ms = ...                    # set by the page once it is drawn
+    stats.recent(session_id)                # newest TurnStats first
+
+The shared agent gets a PerfTracer. While a turn is open, _current_turn
+points to it. AgentScheduler runs commands in a copy of the submitter's
+contextvars, so the agent's 'command' span and the statements on its
+connection are added to the turn from the worker thread. The chat flow's
+own SQL (login, quotes and bookings, the route catalogue) runs on
+connections opened with db.connect(), whose on_connect() hook counts them
+in the open turn too. As with tracer.Tracer, SQLite only reports statement
+starts, so a statement's time runs until the next one starts, the agent
+command's execution ends or the connection is closed.
+
+Outside a turn every hook is one ContextVar lookup returning a shared no-op,
+so nothing is counted, and nothing costs anything, while no panel is open.
+Reports started as background jobs finish after their turn is closed and
+are not counted.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from db import on_connect
+
+# Chat users allowed to open the panel (comma-separated usernames)
+PERF_PANEL_ADMINS = frozenset(filter(None, os.environ.get('PERF_PANEL_ADMINS', '').split(',')))
+# Turns kept for the panel, across all sessions
+PERF_TURNS_KEPT = 500
+
+_current_turn = ContextVar('perf_turn', default=None)
+_NOOP = nullcontext()
+
+
+def is_perf_admin(username):
+    return username in PERF_PANEL_ADMINS
+
+
+@dataclass
+class TurnStats:
+    """Timings of one chat turn, in milliseconds"""
+    session_id: str
+    step: str = None
+    started_at: float = field(default_factory=time.time)
+    total_ms: float = 0.0
+    respond_ms: float = 0.0
+    agent_ms: float = 0.0
+    agent_calls: int = 0
+    sql_count: int = 0
+    sql_ms: float = 0.0
+    render_ms: float = None
+    closed: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def dispatch_ms(self):
+        """Time in the chat flow itself, without the agent calls it waited for"""
+        return max(self.respond_ms - self.agent_ms, 0.0)
+
+    @property
+    def store_ms(self):
+        """Time outside the chat flow: reading and writing the session store"""
+        return max(self.total_ms - self.respond_ms, 0.0)
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    @contextmanager
+    def timing(self, name):
+        """Add the time spent in a block to the ``name`` field"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(**{name: (time.perf_counter() - started) * 1000})
+
+
+class _AgentCall:
+    def __init__(self, turn):
+        self.turn = turn
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.turn.add(agent_ms=(time.perf_counter() - self.started) * 1000, agent_calls=1)
+        return False
+
+
+class _CountedConnection:
+    def __init__(self, turn, conn):
+        self.turn = turn
+        self.conn = conn
+        self.last = None
+
+    def start(self):
+        self.conn.set_trace_callback(self._statement)
+
+    def stop(self):
+        self.conn.set_trace_callback(None)
+        if self.last is not None:
+            self.turn.add(sql_ms=(time.perf_counter() - self.last) * 1000)
+            self.last = None
+
+    def _statement(self, statement):
+        now = time.perf_counter()
+        elapsed = (now - self.last) * 1000 if self.last is not None else 0.0
+        self.last = now
+        self.turn.add(sql_count=1, sql_ms=elapsed)
+
+    def __enter__(self):
+        self.start()
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+def _count_turn_sql(conn):
+    """db.on_connect hook: count a connection's statements in the open turn, if any"""
+    turn = _current_turn.get()
+    if turn is None or turn.closed:
+        return None
+    counted = _CountedConnection(turn, conn)
+    counted.start()
+    return counted.stop
+
+
+on_connect(_count_turn_sql)
+
+
+class PerfTracer:
+    """Agent tracer that adds command and SQL timings to the open turn, if any"""
+
+    enabled = False
+    spans = ()
+
+    def span(self, name, **attrs):
+        turn = _current_turn.get()
+        if turn is None or turn.closed or name != 'command':
+            return _NOOP
+        return _AgentCall(turn)
+
+    def trace_connection(self, conn):
+        turn = _current_turn.get()
+        if turn is None or turn.closed:
+            return _NOOP
+        return _CountedConnection(turn, conn)
+
+
+class PerfStats:
+    """The latest timed turns of every session"""
+
+    def __init__(self, keep=PERF_TURNS_KEPT):
+        self._turns = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def turn(self, session_id, step=None):
+        """Time a chat turn; yields its TurnStats"""
+        turn = TurnStats(session_id, step)
+        token = _current_turn.set(turn)
+        started = time.perf_counter()
+        try:
+            yield turn
+        finally:
+            turn.total_ms = (time.perf_counter() - started) * 1000
+            turn.closed = True
+            _current_turn.reset(token)
+            with self._lock:
+                self._turns.append(turn)
+
+    def recent(self, session_id=None, count=10):
+        """The newest turns, of one session or of all"""
+        with self._lock:
+            turns = [t for t in reversed(self._turns) if session_id is None or t.session_id == session_id]
+        return turns[:count]
+
+    def summary(self):
+        """Turn count and mean timings over every kept turn"""
+        with self._lock:
+            turns = list(self._turns)
+        if not turns:
+            return {'turns': 0}
+        rendered = [t.render_ms for t in turns if t.render_ms is not None]
+        return {
+            'turns': len(turns),
+            'total_ms': sum(t.total_ms for t in turns) / len(turns),
+            'dispatch_ms': sum(t.dispatch_ms for t in turns) / len(turns),
+            'agent_ms': sum(t.agent_ms for t in turns) / len(turns),
+            'sql_count': sum(t.sql_count for t in turns) / len(turns),
+            'sql_ms': sum(t.sql_ms for t in turns) / len(turns),
+            'render_ms': sum(rendered) / len(rendered) if rendered else None,
+        }
+
+
+_stats = None
+_stats_lock = threading.Lock()
+
+
+def get_perf_stats():
+    """The process-wide PerfStats"""
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = PerfStats()
+        return _stats
@@ -0,0 +1,117 @@
+"""
+"explain plan" diagnostics for agent commands
+
+    profile total price for user nikitha
+    explain plan show all bookings
+
+runs the wrapped command once on a fresh connection and reports every SQL
+statement it issued: how often it ran, how long it took, how many rows it
+returns and SQLite's EXPLAIN QUERY PLAN for it. Two things get flagged:
+
+* full scans - a plan step that reads a whole table ("SCAN bookings")
+  instead of searching it through an index or primary key
+* N+1 queries - the same statement shape (literals ignored) running
+  N_PLUS_ONE_THRESHOLD times or more within one command, which usually
+  means a query inside a loop
+
+Timings come from the Tracer's SQL spans, so a statement's time runs until
+the next statement starts (it includes fetching its rows).
+"""
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+
+from agent_results import StatementProfile, CommandProfile
+from tracer import Tracer
+
+# Runs of the same statement shape in one command that count as N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def statement_shape(sql):
+    """The statement with its literals replaced by ?, for grouping repeats"""
+    return _LITERALS.sub('?', sql)
+
+
+def _query_plan(conn, sql):
+    """EXPLAIN QUERY PLAN rows as (id, parent, detail)"""
+    return [(node, parent, detail) for node, parent, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def _row_count(conn, sql):
+    return conn.execute(f"SELECT COUNT(*) FROM ({sql})").fetchone()[0]
+
+
+def _full_scans(plan):
+    """Plan steps that read a whole table
+    
+    Plans name tables by their alias, so a table scan is recognized by
+    elimination: a SCAN of anything but a subquery, a constant row or a
+    CTE/co-routine. Inside a co-routine its own name refers to a table again
+    ("CO-ROUTINE b" over "SCAN b" reads the table aliased b).
+    """
+    parents = {node: parent for node, parent, _ in plan}
+    derived = {}
+    scans = []
+    for node, parent, detail in plan:
+        words = detail.split()
+        if words[0] in ('CO-ROUTINE', 'MATERIALIZE') and len(words) > 1:
+            derived[words[1]] = node
+        elif words[0] == 'SCAN' and len(words) > 1:
+            name = words[1]
+            if name.startswith('(') or name == 'CONSTANT':
+                continue
+            if name in derived and not _inside(node, derived[name], parents):
+                continue
+            if detail not in scans:
+                scans.append(detail)
+    return scans
+
+
+def _inside(node, ancestor, parents):
+    while node:
+        node = parents.get(node, 0)
+        if node == ancestor:
+            return True
+    return False
+
+
+def profile_code(command, intent, code, conn, run):
+    """Profile ``run(conn, tracer)`` - the generated ``code`` for one command"""
+    tracer = Tracer()
+    started = time.perf_counter()
+    error = None
+    try:
+        run(conn, tracer)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    groups = OrderedDict()
+    for span in sorted((s for s in tracer.spans if s.name == 'sql'), key=lambda s: s.start):
+        sql = span.attrs['statement']
+        shape = statement_shape(sql)
+        group = groups.get(shape)
+        if group is None:
+            group = groups[shape] = StatementProfile(sql=sql)
+        group.calls += 1
+        group.total_ms = round(group.total_ms + span.duration_ms, 3)
+
+    for statement in groups.values():
+        if not re.match(r'(?:SELECT|WITH)\b', statement.sql, re.IGNORECASE):
+            continue
+        try:
+            plan = _query_plan(conn, statement.sql)
+            statement.rows = _row_count(conn, statement.sql)
+        except sqlite3.Error as e:
+            statement.plan = [f"(no plan: {e})"]
+            continue
+        statement.plan = [detail for _, _, detail in plan]
+        statement.full_scans = _full_scans(plan)
+        statement.n_plus_one = statement.calls >= N_PLUS_ONE_THRESHOLD
+
+    return CommandProfile(command=command, intent=intent, code=code, elapsed_ms=elapsed_ms,
+                          statements=list(groups.values()), error=error)
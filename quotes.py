@@ -0,0 +1,238 @@
+"""
+Signed price quotes
+
+The chat used to price a ticket when the traveller type / discount was
+chosen and the old booking.book_ticket priced it again, with a different formula and
+without the chosen discount. Now pricing issues a Quote and booking
+consumes it:
+
+    book = get_quote_book()
+    quote = book.quote(user_id, route_id, 'child', discount=(3, 'SUMMER', 10))
+    ...show quote.final_price...
+    result = book.book(quote.token, user_id)   # charges quote.final_price
+
+A quote fixes the route, traveller type, discount, the seats left when it
+was made and the final price. Its token carries all of those fields plus
+an HMAC-SHA256 of them under the shared QUOTE_SECRET, so the token alone
+is the quote: any app process (or the same one after a restart) can book
+it, and nothing is kept in memory. The signature is what stops a client
+from editing a token into a cheaper price, another route or user, or a
+later expiry.
+
+Quotes expire after QUOTE_TTL seconds and book once: booking checks the
+signature, expiry and user, then records the quote id in the used_quotes
+table, takes a seat and inserts the booking in one transaction at the
+quoted price - no pricing queries are run again.
+
+QUOTE_SECRET comes from the environment; without it every process on the
+host shares a key generated once into QUOTE_SECRET_FILE.
+
+Price = base price x demand factor (1 + share of seats sold x 0.5),
+halved for children, less the discount's percentage.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass, astuple
+from datetime import datetime
+
+from db import DB_PATH, connect
+from route_catalog import invalidate_routes
+
+# Seconds a quoted price is held
+QUOTE_TTL = 300.0
+# Signing key shared by every app process; set it, or one is generated into QUOTE_SECRET_FILE
+QUOTE_SECRET = os.environ.get('QUOTE_SECRET', '').encode('utf-8')
+QUOTE_SECRET_FILE = os.environ.get('QUOTE_SECRET_FILE', 'quote_secret.key')
+
+
+@dataclass(frozen=True)
+class Quote:
+    quote_id: str
+    user_id: int
+    route_id: int
+    traveller_type: str
+    discount_id: int
+    discount_name: str
+    discount_percentage: float
+    seats_available: int
+    base_price: float
+    demand_factor: float
+    final_price: float
+    expires_at: float
+    token: str = ''
+
+
+def shared_secret(path=QUOTE_SECRET_FILE):
+    """QUOTE_SECRET, or the host's generated key (created on first use)"""
+    if QUOTE_SECRET:
+        return QUOTE_SECRET
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read()
+    key = secrets.token_bytes(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def _sign(secret, body):
+    return hmac.new(secret, body.encode('ascii'), hashlib.sha256).hexdigest()
+
+
+def encode_token(secret, quote):
+    """Token text: <base64 JSON of the quote's fields>.<HMAC of that text>"""
+    fields = json.dumps(astuple(quote)[:-1], separators=(',', ':')).encode('utf-8')
+    body = base64.urlsafe_b64encode(fields).decode('ascii').rstrip('=')
+    return f"{body}.{_sign(secret, body)}"
+
+
+def decode_token(secret, token):
+    """The Quote a token carries, or None if it was not signed with ``secret``"""
+    body, _, signature = (token or '').rpartition('.')
+    if not body or not hmac.compare_digest(signature, _sign(secret, body)):
+        return None
+    fields = json.loads(base64.urlsafe_b64decode(body + '=' * (-len(body) % 4)))
+    return Quote(*fields, token=token)
+
+
+def best_discount(conn, user_id, traveller_type):
+    """(id, name, percentage) of the best discount a user qualifies for, or None"""
+    row = conn.execute('SELECT loyalty_points FROM users WHERE id=?', (user_id,)).fetchone()
+    loyalty_points = row[0] if row else 0
+    return conn.execute('''SELECT id, name, percentage FROM discounts
+                           WHERE (user_type=? OR user_type IS NULL OR user_type='') AND min_points<=?
+                           ORDER BY percentage DESC LIMIT 1''', (traveller_type, loyalty_points)).fetchone()
+
+
+class QuoteBook:
+    """Issues quotes and books them, for one database file"""
+
+    def __init__(self, db_path=DB_PATH, ttl=QUOTE_TTL, secret=None):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._secret = secret
+        self._lock = threading.Lock()
+
+    @property
+    def secret(self):
+        with self._lock:
+            if self._secret is None:
+                self._secret = shared_secret()
+            return self._secret
+
+    def discounts(self, user_id, traveller_type):
+        """(loyalty_points, [(id, name, percentage, user_type, min_points)]): the user's points
+        and the discounts they qualify for, best first"""
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute('SELECT loyalty_points FROM users WHERE id=?', (user_id,)).fetchone()
+            loyalty_points = row[0] if row else 0
+            return loyalty_points, conn.execute('''SELECT id, name, percentage, user_type, min_points FROM discounts
+                                   WHERE (user_type=? OR user_type IS NULL OR user_type='') AND min_points<=?
+                                   ORDER BY percentage DESC''', (traveller_type, loyalty_points)).fetchall()
+        finally:
+            conn.close()
+
+    def quote(self, user_id, route_id, traveller_type='adult', discount=None, conn=None):
+        """Price a ticket; ``discount`` is (id, name, percentage, ...) or None. None if no such route"""
+        own = conn is None
+        conn = conn or connect(self.db_path)
+        try:
+            row = conn.execute('SELECT base_price, seats_available, seats_total FROM routes WHERE id=?',
+                               (route_id,)).fetchone()
+        finally:
+            if own:
+                conn.close()
+        if row is None:
+            return None
+        base_price, seats_available, seats_total = row
+        demand_factor = 1 + (1 - seats_available / seats_total) * 0.5 if seats_total else 1.0
+        price = base_price * demand_factor
+        if traveller_type == 'child':
+            price *= 0.5
+        discount_id, discount_name, percentage = (discount[:3] if discount else (None, None, 0))
+        price *= (1 - percentage / 100)
+
+        quote = Quote(secrets.token_hex(8), user_id, route_id, traveller_type, discount_id, discount_name,
+                      percentage, seats_available, base_price, round(demand_factor, 4), round(price, 2),
+                      round(time.time() + self.ttl, 3))
+        return Quote(*astuple(quote)[:-1], token=encode_token(self.secret, quote))
+
+    def quote_best(self, user_id, route_id, traveller_type='adult'):
+        """Price a ticket with the best discount the user qualifies for"""
+        conn = connect(self.db_path)
+        try:
+            discount = best_discount(conn, user_id, traveller_type) if user_id is not None else None
+            return self.quote(user_id, route_id, traveller_type, discount, conn=conn)
+        finally:
+            conn.close()
+
+    def take(self, token, user_id):
+        """The quote a token carries, if it is genuine, current and this user's; (quote, error)"""
+        quote = decode_token(self.secret, token)
+        if quote is None:
+            return None, 'Invalid quote'
+        if quote.user_id != user_id:
+            return None, 'Quote belongs to another user'
+        if quote.expires_at <= time.time():
+            return None, 'Quote expired - please price the ticket again'
+        return quote, None
+
+    def book(self, token, user_id, seat_number=None):
+        """Book a quoted ticket at the quoted price, in one transaction
+
+        Returns {'booking_id', 'price_paid', 'status'} or {'error'}; errors
+        about the quote itself also carry 'requote': True.
+        """
+        quote, error = self.take(token, user_id)
+        if error:
+            return {'error': error, 'requote': True}
+        conn = connect(self.db_path)
+        try:
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('CREATE TABLE IF NOT EXISTS used_quotes (quote_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+            # Expired quotes are refused anyway, so their ids need not be kept
+            c.execute('DELETE FROM used_quotes WHERE expires_at < ?', (time.time(),))
+            c.execute('INSERT OR IGNORE INTO used_quotes (quote_id, expires_at) VALUES (?, ?)',
+                      (quote.quote_id, quote.expires_at))
+            if c.rowcount == 0:
+                conn.rollback()
+                return {'error': 'Quote already used - please price the ticket again', 'requote': True}
+            c.execute('UPDATE routes SET seats_available = seats_available - 1 WHERE id=? AND seats_available > 0',
+                      (quote.route_id,))
+            if c.rowcount == 0:
+                conn.rollback()
+                return {'error': 'No seats available'}
+            c.execute('INSERT INTO bookings (user_id, route_id, seat_number, price_paid, booking_time, status) '
+                      'VALUES (?, ?, ?, ?, ?, ?)',
+                      (user_id, quote.route_id, seat_number, quote.final_price, datetime.now().isoformat(),
+                       'confirmed'))
+            booking_id = c.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
+        invalidate_routes(self.db_path)
+        return {'booking_id': booking_id, 'price_paid': quote.final_price, 'status': 'confirmed'}
+
+
+_books = {}
+_books_lock = threading.Lock()
+
+
+def get_quote_book(db_path=DB_PATH):
+    """The shared QuoteBook for a database file"""
+    db_path = os.path.realpath(db_path)
+    with _books_lock:
+        book = _books.get(db_path)
+        if book is None:
+            book = _books[db_path] = QuoteBook(db_path)
+        return book
@@ -0,0 +1,127 @@
+"""
+Result cache for TravelBookingAgent commands
+
+Commands are cached by the code the agent generates for them, which already
+normalizes phrasing ("show booking 1" and "explain booking 1" both run
+booking_details(1)). An entry keeps the typed result and, once someone asks
+for it, the rendered CLI text.
+
+Every entry is tagged with the database's data version. The cache holds its
+own read-only connection to the database, and SQLite's PRAGMA data_version
+on that connection changes whenever any other connection commits. When the
+version changes, the whole cache is dropped. Entries also expire after
+``ttl`` seconds, and the least recently used entries are evicted beyond
+``max_entries``.
+
+The agent is shared by every session, so cached records must not be
+shared objects: put() keeps its own deep copy and the agent hands each
+cache hit out as a fresh copy (CacheEntry.copy_result), so a caller that
+changes its record cannot change anyone else's.
+"""
+import copy
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from db import DB_PATH
+
+
+@dataclass
+class CacheEntry:
+    result: object
+    stored_at: float
+    text: str = None
+
+    def copy_result(self):
+        """The cached record as a new object the caller may change"""
+        return copy.deepcopy(self.result)
+
+
+class ResultCache:
+    """Thread-safe LRU cache of command results, invalidated by database writes"""
+
+    def __init__(self, db_path=DB_PATH, max_entries=256, ttl=30.0):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._probe = None
+        self._data_version = None
+        self.hits = self.misses = self.invalidations = self.expirations = self.evictions = 0
+
+    def _check_version(self):
+        """Drop everything if the database changed; caller holds the lock"""
+        if self._probe is None:
+            self._probe = sqlite3.connect(self.db_path, check_same_thread=False)
+        data_version = self._probe.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self._data_version = data_version
+
+    def lookup(self, key):
+        """(CacheEntry or None, data version) for ``key``
+        
+        Pass the version to put() when storing the freshly computed result.
+        """
+        with self._lock:
+            self._check_version()
+            version = self._data_version
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry.stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry, version
+
+    def put(self, key, result, version, text=None):
+        """Store a result computed at data ``version`` (from lookup)
+        
+        Returns the new entry; it is not kept if the database changed meanwhile.
+        """
+        entry = CacheEntry(copy.deepcopy(result), time.monotonic(), text)
+        with self._lock:
+            self._check_version()
+            if version != self._data_version:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self):
+        """Forget every entry (e.g. after a write on the agent's own connection)"""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'expirations': self.expirations,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
@@ -0,0 +1,131 @@
+"""
+Process-wide route catalogue
+
+The chat interface lists or searches routes on nearly every turn. Instead
+of each session re-reading the routes table, they share one in-memory copy
+per database file:
+
+    for route in get_route_catalog().routes():
+        print(route.origin, route.destination, route.base_price)
+
+Routes are Route named tuples, so code that still indexes them positionally
+(route[1] is the origin) keeps working.
+
+The copy is reloaded on the next read after invalidate_routes(), which
+every writer in this app calls:
+* RouteCatalog.add (the chat's new-route flow) and admin.add_route (new routes)
+* QuoteBook.book in quotes.py (seat counts)
+
+Writes made by other processes (or by hand) show up after at most
+``max_age`` seconds.
+"""
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from db import DB_PATH, connect
+from user_directory import normalize
+
+# Seconds before a catalogue is re-read even without an invalidation
+ROUTE_CATALOG_MAX_AGE = 60.0
+
+
+class Route(NamedTuple):
+    id: int
+    origin: str
+    destination: str
+    departure_time: str
+    base_price: float
+    transport_type: str
+    seats_available: int
+
+
+class RouteCatalog:
+    """Cached routes of one database file"""
+
+    def __init__(self, db_path=DB_PATH, max_age=ROUTE_CATALOG_MAX_AGE):
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._routes = None
+        self._by_id = {}
+        self._loaded_at = 0.0
+        self.loads = 0
+
+    def _load(self):
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute('SELECT id, origin, destination, departure_time, base_price, transport_type, '
+                                'seats_available FROM routes').fetchall()
+        finally:
+            conn.close()
+        self._routes = tuple(Route(*row) for row in rows)
+        self._by_id = {route.id: route for route in self._routes}
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+
+    def routes(self):
+        """Every route, in table order"""
+        with self._lock:
+            if self._routes is None or (self.max_age is not None
+                                        and time.monotonic() - self._loaded_at > self.max_age):
+                self._load()
+            return self._routes
+
+    def get(self, route_id):
+        """The route with this id, or None"""
+        self.routes()
+        return self._by_id.get(route_id)
+
+    def search(self, origin=None, destination=None):
+        """Routes whose origin/destination contain the given text, ignoring case"""
+        origin = normalize(origin.lower()) if origin else None
+        destination = normalize(destination.lower()) if destination else None
+        return [
+            route for route in self.routes()
+            if (origin is None or origin in normalize(route.origin))
+            and (destination is None or destination in normalize(route.destination))
+        ]
+
+    def add(self, origin, destination, departure_time, base_price, transport_type, seats):
+        """Insert a route with all its seats free; returns it as a Route"""
+        conn = connect(self.db_path)
+        try:
+            c = conn.cursor()
+            c.execute('INSERT INTO routes (origin, destination, departure_time, base_price, transport_type, '
+                      'seats_available, seats_total) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (origin, destination, departure_time, base_price, transport_type, seats, seats))
+            conn.commit()
+            route_id = c.lastrowid
+        finally:
+            conn.close()
+        self.invalidate()
+        return Route(route_id, origin, destination, departure_time, base_price, transport_type, seats)
+
+    def invalidate(self):
+        """Re-read the routes table on the next access"""
+        with self._lock:
+            self._routes = None
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_route_catalog(db_path=DB_PATH):
+    """The shared RouteCatalog for a database file"""
+    db_path = os.path.realpath(db_path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(db_path)
+        if catalog is None:
+            catalog = _catalogs[db_path] = RouteCatalog(db_path)
+        return catalog
+
+
+def invalidate_routes(db_path=DB_PATH):
+    """Call after adding a route or changing its seats"""
+    with _catalogs_lock:
+        catalog = _catalogs.get(os.path.realpath(db_path))
+    if catalog is not None:
+        catalog.invalidate()
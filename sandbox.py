@@ -0,0 +1,203 @@
+"""
+Execution limits for the agent's generated code
+
+Every command the agent runs goes through an ExecutionLimits guard:
+
+* wall-clock timeout - enforced in-process in two places: a SQLite
+  progress handler interrupts the running query once the deadline passes,
+  and the long-running Python loops (the PROGRESS_FUNCTIONS) check the
+  same Deadline every PROGRESS_EVERY bookings. The agent checks it once
+  more after the generated code returns. Python work outside those loops
+  is not interrupted in-process; isolate=True is the hard limit, since
+  the worker process is killed at the timeout
+* row cap - commands that take a list of booking IDs only run the first
+  ``max_rows`` of them and say how many were skipped
+* output cap - CLI text output is cut at ``max_output_chars``
+* memory limit - with ``isolate=True`` (or ``max_memory_mb`` set) the code
+  runs in a worker process with ``resource`` limits and is killed at the
+  timeout. ``resource`` only exists on Unix; elsewhere the worker still
+  gets the timeout but no memory cap.
+
+A command that hits a limit raises CommandCutOff, which the agent reports
+instead of a result. So does a command whose CancellationToken is cancelled:
+the same progress handler stops the running query, and long commands also
+check the token between batches of rows.
+"""
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# SQLite VM instructions between deadline checks
+PROGRESS_CHECK_INTERVAL = 1000
+
+
+@dataclass
+class ExecutionLimits:
+    """Per-command limits; None disables a limit"""
+    timeout: float = 10.0
+    max_rows: int = 500
+    max_output_chars: int = 200_000
+    max_memory_mb: int = None
+    isolate: bool = False
+
+
+class CommandCutOff(Exception):
+    """A command was stopped because it hit one of its ExecutionLimits"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class CancellationToken:
+    """Handed to a command by whoever waits for it; cancel() asks it to stop"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise CommandCutOff('cancelled', "Command cancelled")
+
+
+class Deadline:
+    """A command's time limit and CancellationToken in one
+    
+    Has the token's interface, so long-running agent functions that check
+    ``cancel.raise_if_cancelled()`` between batches also stop at the deadline.
+    """
+
+    def __init__(self, seconds, cancel=None):
+        self.seconds = seconds
+        self.cancel_token = cancel
+        self.expires = time.monotonic() + seconds if seconds else None
+
+    @property
+    def expired(self):
+        return self.expires is not None and time.monotonic() > self.expires
+
+    @property
+    def cancelled(self):
+        return (self.cancel_token is not None and self.cancel_token.cancelled) or self.expired
+
+    def raise_if_cancelled(self):
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+        if self.expired:
+            raise CommandCutOff('timeout', f"Command stopped after {self.seconds:g}s (time limit)")
+
+
+@contextmanager
+def deadline(conn, seconds, cancel=None):
+    """Interrupt any query on ``conn`` still running after ``seconds`` or once ``cancel`` is cancelled
+    
+    Yields the Deadline, for Python code to check between queries.
+    """
+    limit = Deadline(seconds, cancel)
+    if not seconds and cancel is None:
+        yield limit
+        return
+
+    conn.set_progress_handler(lambda: limit.cancelled, PROGRESS_CHECK_INTERVAL)
+    try:
+        yield limit
+    except Exception as e:
+        # sqlite3 reports the abort as OperationalError('interrupted')
+        if 'interrupted' in str(e):
+            limit.raise_if_cancelled()
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def cap_rows(items, max_rows):
+    """First ``max_rows`` items and how many were left out"""
+    if max_rows is None or len(items) <= max_rows:
+        return items, 0
+    return items[:max_rows], len(items) - max_rows
+
+
+def cap_output(text, max_chars):
+    """Cut text longer than ``max_chars`` and say how much was dropped"""
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    dropped = len(text) - max_chars
+    return text[:max_chars] + f"\n✂️ Output truncated ({dropped} more characters, output limit)"
+
+
+def _apply_resource_limits(limits):
+    if resource is None:
+        return
+    if limits.max_memory_mb:
+        size = limits.max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    if limits.timeout:
+        # Backstop in case the parent cannot kill us; the parent's timer is the real limit
+        cpu = int(limits.timeout) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+
+
+def _isolated_worker(send, code, db_path, limits):
+    from agent_repl import TravelBookingAgent
+    from db import ConnectionPool
+
+    _apply_resource_limits(limits)
+    pool = ConnectionPool(db_path)
+    try:
+        agent = TravelBookingAgent(pool=pool, limits=replace(limits, isolate=False, max_memory_mb=None),
+                                   use_cache=False)
+        send.send(('ok', agent.run_code(code)))
+    except MemoryError:
+        send.send(('cutoff', ('memory', f"Command stopped at {limits.max_memory_mb} MB (memory limit)")))
+    except CommandCutOff as e:
+        send.send(('cutoff', (e.reason, str(e))))
+    except Exception as e:
+        send.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        pool.close_all()
+        send.close()
+
+
+def run_isolated(code, limits, db_path='travel.db', cancel=None):
+    """Run generated code in a worker process and return its ``result``"""
+    receive, send = multiprocessing.Pipe(duplex=False)
+    worker = multiprocessing.Process(target=_isolated_worker, args=(send, code, db_path, limits), daemon=True)
+    worker.start()
+    send.close()
+    expires = time.monotonic() + limits.timeout if limits.timeout else None
+    try:
+        # Wait in short slices so a cancelled command is killed promptly
+        while not receive.poll(0.05):
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if expires is not None and time.monotonic() > expires:
+                raise CommandCutOff('timeout', f"Command stopped after {limits.timeout:g}s (time limit)")
+        try:
+            status, payload = receive.recv()
+        except EOFError:
+            worker.join()
+            raise CommandCutOff('killed', f"Command worker exited with code {worker.exitcode}")
+    finally:
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+        receive.close()
+    if status == 'cutoff':
+        raise CommandCutOff(*payload)
+    if status == 'error':
+        raise RuntimeError(payload)
+    return payload
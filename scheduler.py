@@ -0,0 +1,204 @@
+"""
+Priority scheduler for agent commands
+
+Every Streamlit session runs its commands on the one TravelBookingAgent
+the process shares (streamlit_app.get_agent()). Without a scheduler a few
+"provide all bookings" reports can occupy the machine while someone waits
+for "show booking 5". Commands go through the process-wide AgentScheduler
+instead:
+
+    future = get_scheduler().submit(agent, "show booking 5", structured=True)
+    result = future.result()
+
+Each command is classified from the agent's own intent table: commands
+whose generated call is a long-running function (the PROGRESS_FUNCTIONS,
+top_users and "profile" diagnostics) are BULK, everything else is
+INTERACTIVE. A fixed set of worker threads always takes the oldest queued
+interactive command first. Each class also has its own concurrency limit,
+so bulk work can never take the slots kept for interactive lookups.
+
+stats() reports per class how many commands are queued and running, and
+how long they waited in the queue (p50 / p95 / max) and ran.
+
+Commands run in a copy of the submitter's contextvars context, so output
+captured with output_capture.capture_output() around submit(), and
+perf_stats' open turn, stay with the session that asked for them.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from agent_repl import PROGRESS_FUNCTIONS
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+# Highest priority first
+PRIORITY_ORDER = (INTERACTIVE, BULK)
+DEFAULT_LIMITS = {INTERACTIVE: 4, BULK: 1}
+# Agent functions that read every booking (or every booking of a user)
+BULK_FUNCTIONS = PROGRESS_FUNCTIONS | {'top_users'}
+# Queue-time samples kept per class for percentiles
+METRIC_SAMPLES = 1000
+
+
+@dataclass
+class _Job:
+    agent: object
+    command: str
+    kwargs: dict
+    future: Future
+    priority_class: str
+    # The submitter's contextvars, so e.g. output_capture sinks and perf_stats' open turn follow the command
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+    queued_at: float = field(default_factory=time.perf_counter)
+
+
+class _ClassMetrics:
+    def __init__(self):
+        self.submitted = self.completed = self.failed = 0
+        self.waits = deque(maxlen=METRIC_SAMPLES)
+        self.run_time = 0.0
+
+    def summary(self, queued, running, limit):
+        waits = sorted(self.waits)
+
+        def percentile(fraction):
+            return round(waits[min(len(waits) - 1, int(len(waits) * fraction))] * 1000, 3) if waits else 0.0
+
+        finished = self.completed + self.failed
+        return {
+            'limit': limit,
+            'queued': queued,
+            'running': running,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'queue_ms_p50': percentile(0.50),
+            'queue_ms_p95': percentile(0.95),
+            'queue_ms_max': round(waits[-1] * 1000, 3) if waits else 0.0,
+            'run_ms_avg': round(self.run_time / finished * 1000, 3) if finished else 0.0,
+        }
+
+
+def classify(agent, command, user=None):
+    """INTERACTIVE or BULK for a command, from the agent's intent table"""
+    intent, params = agent.parse_natural_language(command)
+    if intent == 'explain_plan':
+        return BULK
+    if intent is None or intent == 'help':
+        return INTERACTIVE
+    code = agent.generate_code(intent, params, user)
+    function = code.split('(', 1)[0] if code else None
+    return BULK if function in BULK_FUNCTIONS else INTERACTIVE
+
+
+class AgentScheduler:
+    """Runs agent commands on shared worker threads, interactive ones first"""
+
+    def __init__(self, limits=None, workers=None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        # One worker per slot, so a free interactive slot always has a thread
+        self.workers = workers or sum(self.limits.values())
+        self._queues = {name: deque() for name in PRIORITY_ORDER}
+        self._running = dict.fromkeys(PRIORITY_ORDER, 0)
+        self._metrics = {name: _ClassMetrics() for name in PRIORITY_ORDER}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"agent-scheduler-{n}", daemon=True)
+            for n in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, agent, command, priority_class=None, **kwargs):
+        """Queue ``agent.process_command(command, **kwargs)``; returns a Future
+
+        ``priority_class`` overrides the automatic classification.
+        """
+        priority_class = priority_class or classify(agent, command, kwargs.get('user'))
+        job = _Job(agent, command, kwargs, Future(), priority_class)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Scheduler is shut down")
+            self._queues[priority_class].append(job)
+            self._metrics[priority_class].submitted += 1
+            self._cond.notify()
+        return job.future
+
+    def run(self, agent, command, **kwargs):
+        """Submit a command and wait for its result"""
+        return self.submit(agent, command, **kwargs).result()
+
+    def _next_job(self):
+        """Oldest job of the highest-priority class with a free slot; caller holds the lock"""
+        for name in PRIORITY_ORDER:
+            queue = self._queues[name]
+            if queue and self._running[name] < self.limits[name]:
+                self._running[name] += 1
+                return queue.popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._stopping:
+                    self._cond.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+            started = time.perf_counter()
+            metrics = self._metrics[job.priority_class]
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        result = job.context.run(job.agent.process_command, job.command, **job.kwargs)
+                    except BaseException as e:
+                        job.future.set_exception(e)
+                    else:
+                        job.future.set_result(result)
+            finally:
+                with self._cond:
+                    self._running[job.priority_class] -= 1
+                    metrics.waits.append(started - job.queued_at)
+                    metrics.run_time += time.perf_counter() - started
+                    if job.future.cancelled() or job.future.exception() is not None:
+                        metrics.failed += 1
+                    else:
+                        metrics.completed += 1
+                    # A slot opened up: another worker may now take a job of this class
+                    self._cond.notify_all()
+
+    def stats(self):
+        """Queue and run-time metrics per priority class"""
+        with self._cond:
+            return {
+                name: self._metrics[name].summary(len(self._queues[name]), self._running[name], self.limits[name])
+                for name in PRIORITY_ORDER
+            }
+
+    def shutdown(self, wait=True):
+        """Stop taking commands; queued ones still run"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide AgentScheduler, started on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = AgentScheduler()
+        return _scheduler
@@ -0,0 +1,149 @@
+"""
+Chat session store shared by every app process
+
+booking_context and the chat history used to live only in Streamlit's
+in-process session_state, so a second server process (or a restart)
+started every user over. The app now keeps a copy in a session store,
+keyed by a session id carried in the page URL (?sid=...):
+
+    store = get_session_store()
+    session_id = store.create()             # ids are only ever issued here
+    state = store.load(session_id)          # None for an id the store never issued
+    ...
+    store.save(session_id, state)
+    session_id = store.rotate(session_id, state)   # on login and logout
+
+Anyone holding the URL holds the session, so the store never keeps the
+login itself (chat_user_authenticated, chat_current_user, ...): a
+restored session has to log in again before it can book (see
+chat_flow.hold_for_login). Ids a client makes up are not accepted, and
+login and logout move the session to a new id, so an id handed to someone
+beforehand or seen in an old URL stops working.
+
+SQLiteSessionStore is the default; it writes to its own file
+(SESSION_DB_PATH) so session writes never lock travel.db, and any process
+on the host can pick up any session.
+
+pack_state()/unpack_state() turn the SESSION_FIELDS of a session into one
+zlib-compressed JSON blob. The chat history's compressed chunks are kept
+as they are (see HistoryBuffer.to_state). Sessions not saved for
+SESSION_TTL seconds are dropped.
+"""
+import base64
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+
+from chat_history import HistoryBuffer
+
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.db')
+# Seconds an unused session is kept
+SESSION_TTL = 7 * 24 * 3600.0
+
+# Session attributes kept in the store; never the login
+SESSION_FIELDS = ('booking_context', 'chat_messages')
+
+
+def pack_state(session):
+    """SESSION_FIELDS of a session (object or dict) as a compressed blob"""
+    get = session.get if isinstance(session, dict) else lambda name: getattr(session, name, None)
+    state = {name: get(name) for name in SESSION_FIELDS}
+    history = state['chat_messages']
+    if isinstance(history, HistoryBuffer):
+        history = state['chat_messages'] = history.to_state()
+        history['chunks'] = [base64.b64encode(chunk).decode('ascii') for chunk in history['chunks']]
+    return zlib.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack_state(blob):
+    """The fields pack_state() stored (unset ones left out); chat_messages comes back as a HistoryBuffer"""
+    state = json.loads(zlib.decompress(blob).decode('utf-8'))
+    history = state.get('chat_messages')
+    if isinstance(history, dict):
+        history['chunks'] = [base64.b64decode(chunk) for chunk in history['chunks']]
+        state['chat_messages'] = HistoryBuffer.from_state(history)
+    return {name: value for name, value in state.items() if value is not None}
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file, readable by every process on the host"""
+
+    def __init__(self, db_path=SESSION_DB_PATH, ttl=SESSION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS chat_sessions (
+                            session_id TEXT PRIMARY KEY,
+                            state BLOB NOT NULL,
+                            updated_at REAL NOT NULL)''')
+        conn.commit()
+        self.purge()
+
+    def _conn(self):
+        # One connection per thread; Streamlit runs each session's script on its own thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=10)
+        return conn
+
+    def create(self):
+        """Issue a new, empty session; returns its id"""
+        conn = self._conn()
+        session_id = secrets.token_urlsafe(24)
+        conn.execute('INSERT INTO chat_sessions (session_id, state, updated_at) VALUES (?, ?, ?)',
+                     (session_id, pack_state({}), time.time()))
+        conn.commit()
+        return session_id
+
+    def load(self, session_id):
+        """The stored state of a session, or None if the store did not issue this id"""
+        row = self._conn().execute('SELECT state FROM chat_sessions WHERE session_id=?', (session_id,)).fetchone()
+        return unpack_state(row[0]) if row else None
+
+    def save(self, session_id, session):
+        """Store a session's state; ids the store does not know are ignored"""
+        conn = self._conn()
+        conn.execute('UPDATE chat_sessions SET state=?, updated_at=? WHERE session_id=?',
+                     (pack_state(session), time.time(), session_id))
+        conn.commit()
+
+    def rotate(self, session_id, session):
+        """Save the state under a new id and drop the old one; returns the new id"""
+        conn = self._conn()
+        new_id = secrets.token_urlsafe(24)
+        with conn:
+            conn.execute('DELETE FROM chat_sessions WHERE session_id=?', (session_id,))
+            conn.execute('INSERT INTO chat_sessions (session_id, state, updated_at) VALUES (?, ?, ?)',
+                         (new_id, pack_state(session), time.time()))
+        return new_id
+
+    def delete(self, session_id):
+        conn = self._conn()
+        conn.execute('DELETE FROM chat_sessions WHERE session_id=?', (session_id,))
+        conn.commit()
+
+    def purge(self):
+        """Drop sessions not saved for ttl seconds"""
+        conn = self._conn()
+        conn.execute('DELETE FROM chat_sessions WHERE updated_at < ?', (time.time() - self.ttl,))
+        conn.commit()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_session_store(db_path=SESSION_DB_PATH):
+    """The process-wide session store for a database file"""
+    db_path = os.path.realpath(db_path)
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = _stores[db_path] = SQLiteSessionStore(db_path)
+        return store
@@ -2,13 +2,28 @@ import streamlit as st
 import sqlite3
 import hashlib
 import re
+import secrets
+import time
 from datetime import datetime
 from agent_repl import TravelBookingAgent
-from booking import authenticate_user, get_route_info, calculate_final_price, book_ticket
-from fetch_and_calculate import fetch_all_bookings_for_user, fetch_and_explain_booking
-import sys
-import io
-from contextlib import contextmanager
+from db import ConnectionPool, connect
+from booking import authenticate_user, get_route_info
+from fetch_and_calculate import fetch_all_bookings_for_user, fetch_and_explain_booking, explain_booking
+from agent_results import MissingBooking, UserBookings, SystemReport, MultipleBookings, format_result
+from fetch_and_calculate import BookingBreakdown
+from user_directory import get_directory, note_new_user
+from sandbox import CancellationToken
+from scheduler import get_scheduler
+from route_catalog import get_route_catalog
+from chat_flow import ChatFlow, ChatServices, report_reply, hold_for_login
+from jobs import get_job_runner
+from quotes import get_quote_book
+from chat_history import HistoryBuffer, HISTORY_WINDOW, split_preview
+from sessions import get_session_store, pack_state
+from perf_stats import PerfTracer, get_perf_stats, is_perf_admin
+from contextlib import nullcontext
+from concurrent.futures import TimeoutError as FutureTimeout
+from queue import Empty, SimpleQueue
 
 # Page configuration
 st.set_page_config(
@@ -193,19 +208,227 @@ st.markdown("""
 
 # Using custom HTML for chat messages instead of st.chat_message to ensure visibility
 
-@contextmanager
-def capture_stdout():
-    """Context manager to capture stdout output"""
-    old_stdout = sys.stdout
-    sys.stdout = captured_output = io.StringIO()
+# Agent results come back as typed records (agent_results); these helpers
+# turn them into chat Markdown or REPL-page HTML.
+
+def render_booking_markdown(booking):
+    """Chat section for one booking breakdown"""
+    if isinstance(booking, MissingBooking):
+        return f"⚠️ {booking.message}\n\n"
+    return f"## 🎫 **BOOKING ID: {booking.booking_id}**\n\n```\n{explain_booking(booking)}\n```\n\n"
+
+def render_route_totals(route_totals, total_label, total):
+    """Code block with one line per route and a closing total"""
+    lines = [f"Route {route}: {route_total}" for route, route_total in route_totals.items()]
+    lines += ["-" * 30, f"{total_label}: {total}"]
+    return "```\n" + "\n".join(lines) + "\n```\n\n"
+
+def render_user_bookings(result, requested_user):
+    """Chat reply for a UserBookings record"""
+    if not result.bookings:
+        response = f"📋 **No bookings found for {requested_user}**\n\nLooks like {requested_user} hasn't made any bookings yet. Ready to book your first trip? Just say 'book ticket' to get started!"
+        if result.similar_users:
+            response += f"\n\n💡 Did you mean one of these users? {', '.join(result.similar_users)}"
+        return response
+    response = f"📋 **REPL Booking Analysis for {requested_user.title()}:**\n\n"
+    response += ("\n\n" + "=" * 50 + "\n\n").join(render_booking_markdown(b) for b in result.bookings)
+    response += "\n\n" + "=" * 50 + "\n\n"
+    response += "## 💰 **SUMMARY ANALYSIS**\n\n"
+    response += render_route_totals(result.route_totals, f"🎯 TOTAL FOR {result.username}", result.total)
+    return response
+
+def render_system_report(report):
+    """Chat reply body for a SystemReport record"""
+    if not report.users:
+        return ""
+    response = ""
+    for user in report.users:
+        response += f"### 👤 {user.username.upper()} ({len(user.bookings)} bookings)\n\n"
+        response += "".join(render_booking_markdown(b) for b in user.bookings)
+        response += f"💰 **Total for {user.username.upper()}: ${user.total:.2f}**\n\n---\n\n"
+    response += f"🎯 **GRAND TOTAL - ALL USERS: ${report.total:.2f}**\n"
+    response += f"📊 Total bookings: {report.booking_count} | 👥 Users with bookings: {len(report.users)}\n\n"
+    return response
+
+def render_user_total(result):
+    """Chat reply body for a UserTotal record"""
+    if not result.usernames or not result.booking_count:
+        return ""
+    label = f"🎯 GRAND TOTAL FOR ALL '{result.requested_user.upper()}'" if len(result.usernames) > 1 else "🎯 GRAND TOTAL"
+    return f"👥 Users: {', '.join(result.usernames)}\n\n" + render_route_totals(result.route_totals, label, result.grand_total)
+
+@st.cache_resource
+def get_agent():
+    """The one TravelBookingAgent shared by every session
+    
+    Its compiled patterns, result cache and connection pool are warm for
+    everyone. It keeps no per-session state: the logged-in user is passed
+    with each command (see session_user).
+    """
+    return TravelBookingAgent(pool=ConnectionPool(), tracer=PerfTracer())
+
+def session_user():
+    """Username of this session's logged-in chat user, or None"""
+    if st.session_state.get('chat_user_authenticated'):
+        return st.session_state.get('chat_current_user')
+    return None
+
+def run_agent(command):
+    """Run an agent command in structured mode through the shared scheduler"""
+    return get_scheduler().run(get_agent(), command, structured=True, user=session_user())
+
+def run_agent_with_progress(command, label, on_bookings=None):
+    """Run a long agent command in structured mode behind a progress bar.
+    
+    The command runs on the shared scheduler's worker threads, and this
+    script thread only updates the bar. If the user navigates away, Streamlit
+    stops the script at the next bar update. The command is then cancelled
+    instead of being left to finish.
+    
+    With ``on_bookings``, booking reports hand each booking over as soon as
+    it is priced, and on_bookings(list) is called with whatever arrived since
+    the last poll, so the page can show them while the command runs.
+    """
+    bar = st.progress(0.0, text=f"{label} (queued)")
+    latest = {}
+    cancel = CancellationToken()
+    arrived = SimpleQueue()
+    
+    def report(done, total):
+        latest['progress'] = (done, total)
+    
+    def drain(first):
+        batch = [first]
+        while True:
+            try:
+                batch.append(arrived.get_nowait())
+            except Empty:
+                on_bookings(batch)
+                return
+    
+    stream = {'emit': arrived.put} if on_bookings is not None else {}
+    future = get_scheduler().submit(get_agent(), command, structured=True, user=session_user(),
+                                    progress=report, cancel=cancel, **stream)
     try:
-        yield captured_output
+        while True:
+            if on_bookings is not None and not future.done():
+                try:
+                    drain(arrived.get(timeout=0.05))
+                    continue
+                except Empty:
+                    pass
+            try:
+                result = future.result(timeout=0 if on_bookings is not None else 0.1)
+            except FutureTimeout:
+                done, total = latest.get('progress', (0, 0))
+                if total:
+                    bar.progress(min(done / total, 1.0), text=f"{label} {done}/{total}")
+                elif future.running():
+                    bar.progress(0.0, text=label)
+                continue
+            if on_bookings is not None and not arrived.empty():
+                drain(arrived.get_nowait())
+            return result
     finally:
-        sys.stdout = old_stdout
+        future.cancel()
+        cancel.cancel()
+        bar.empty()
+
+def render_booking_listing(result):
+    """Chat reply body for a (paged) BookingListing: a compact table, not a text dump"""
+    if not result.rows:
+        return "📋 No bookings on this page.\n\n"
+    response = "| Booking | User | Route |\n|---|---|---|\n"
+    response += "".join(f"| {row.booking_id} | {row.username} | {row.origin} → {row.destination} |\n" for row in result.rows)
+    if result.next_after is not None:
+        if result.page is not None:
+            response += f"\n➡️ **More:** 'show all bookings page {result.page + 1}' or 'show bookings after {result.next_after}'\n"
+        else:
+            response += f"\n➡️ **More:** 'show bookings after {result.next_after}'\n"
+    return response + "\n"
+
+def render_top_users(result):
+    """Chat reply body for a TopUsers ranking"""
+    if not result.rows:
+        return "No priced bookings found.\n\n"
+    response = "| # | User | Bookings | Spent |\n|---|---|---|---|\n"
+    response += "".join(f"| {rank} | {row.username} | {row.booking_count} | ${row.total:.2f} |\n"
+                        for rank, row in enumerate(result.rows, 1))
+    return response + "\n"
+
+def booking_entries(result):
+    """Booking breakdowns contained in an agent record, in display order"""
+    if isinstance(result, (BookingBreakdown, MissingBooking)):
+        return [result]
+    if isinstance(result, (UserBookings, MultipleBookings)):
+        return result.bookings
+    if isinstance(result, SystemReport):
+        return [b for user in result.users for b in user.bookings]
+    return []
+
+def render_booking_entry_html(booking):
+    """REPL-page card for one booking breakdown"""
+    if isinstance(booking, MissingBooking):
+        return f'<div class="booking-entry">⚠️ {booking.message}</div>\n\n'
+    b = booking
+    return (
+        '<div class="booking-entry">🎫 BOOKING DETAILS:\n'
+        f'Booking ID: {b.booking_id}\n'
+        f'🛤️ Route: {b.origin} -> {b.destination} ({b.transport_type})\n'
+        f'💰 Base price: {b.base_price}\n'
+        f'Seats left at booking: {b.seats_left} of {b.seats_total}\n'
+        f'Demand factor: {b.demand_factor:.2f}\n'
+        f'Discount applied: {b.discount}%\n'
+        f'Traveller type: {b.traveller_type}\n'
+        f'💰 Final price paid: {b.final_price}\n'
+        f'💰 Price recorded in booking: {b.price_paid}\n'
+        f'⏰ Booking time: {b.booking_time}\n'
+        f'✅ Status: {b.status}</div>\n\n'
+    )
+
+def render_repl_totals(result):
+    """The totals that follow a record's booking cards"""
+    html = ""
+    if isinstance(result, UserBookings):
+        html += "\n".join(f"Route {route}: {total}" for route, total in result.route_totals.items())
+        html += f"\n🎯 TOTAL FOR {result.username}: {result.total}"
+    elif isinstance(result, SystemReport):
+        html += "\n".join(f"💰 TOTAL FOR {user.username.upper()}: ${user.total:.2f}" for user in result.users)
+        html += f"\n🎯 GRAND TOTAL - ALL USERS: ${result.total:.2f}"
+    elif isinstance(result, MultipleBookings):
+        html += f"🎯 TOTAL: {result.total}"
+        if result.skipped:
+            html += f"\n✂️ {result.skipped} more booking IDs skipped (row limit)"
+    return html
+
+def run_repl_command(command):
+    """Run a REPL command, showing booking cards as they are priced; returns the record
+    
+    Cards are HTML, so each batch goes to st.markdown rather than
+    st.write_stream (which only renders plain markdown).
+    """
+    st.markdown('<div class="repl-output">📊 REPL Result:</div>', unsafe_allow_html=True)
+    shown = []
+    
+    def show(bookings):
+        shown.extend(bookings)
+        st.markdown("".join(render_booking_entry_html(b) for b in bookings), unsafe_allow_html=True)
+    
+    result = run_agent_with_progress(command, "🔄 Running...", on_bookings=show)
+    entries = booking_entries(result)
+    if not entries:
+        st.markdown(f'<div class="repl-output">{format_result(result)}</div>', unsafe_allow_html=True)
+        return result
+    # Cached results arrive whole, with nothing streamed
+    rest = entries[len(shown):]
+    if rest:
+        show(rest)
+    st.markdown(f'<div class="repl-output">{render_repl_totals(result)}</div>', unsafe_allow_html=True)
+    return result
 
 # Initialize session state
 if "chat_messages" not in st.session_state:
-    st.session_state.chat_messages = []
+    st.session_state.chat_messages = HistoryBuffer()
 if "booking_context" not in st.session_state:
     st.session_state.booking_context = {}
 if "user_authenticated" not in st.session_state:
@@ -223,64 +446,80 @@ if "chat_current_user" not in st.session_state:
 if "chat_current_user_id" not in st.session_state:
     st.session_state.chat_current_user_id = None
 
-# Initialize REPL agent
-if "agent" not in st.session_state:
-    try:
-        from agent_repl import TravelBookingAgent
-        st.session_state.agent = TravelBookingAgent()
-    except ImportError:
-        st.session_state.agent = None
-
 # Initialize REPL output storage
 if "repl_output" not in st.session_state:
-    st.session_state.repl_output = []
+    st.session_state.repl_output = HistoryBuffer()
+
+# Background reports started from the chat: {job_id, reply, reply_args, posted}
+if "report_jobs" not in st.session_state:
+    st.session_state.report_jobs = []
+
+# Session store: the chat state outlives this process and is shared with the others
+def load_chat_session():
+    """Replace this session's chat state with the stored copy
+    
+    The id comes from this Streamlit session or, for a new one, the URL
+    (?sid=...); an id the store did not issue gets a new session instead.
+    """
+    store = get_session_store()
+    restoring = "chat_session_id" not in st.session_state
+    session_id = st.session_state.get("chat_session_id") or st.query_params.get("sid")
+    state = store.load(session_id) if session_id else None
+    if state is None:
+        session_id, state = store.create(), {}
+    st.session_state.chat_session_id = st.query_params["sid"] = session_id
+    for name, value in state.items():
+        st.session_state[name] = value
+    if restoring and hold_for_login(st.session_state):
+        st.session_state.chat_messages.append({"role": "assistant", "content": "🔐 **Welcome back!** Your booking is saved, but please log in again to finish it.\n\n👋 **What's your username?**"})
+        save_chat_session()
+
+def save_chat_session():
+    get_session_store().save(st.session_state.chat_session_id, st.session_state)
+
+def rotate_chat_session():
+    """Move this session to a new id (on login and logout), so an id known before stops working"""
+    session_id = get_session_store().rotate(st.session_state.chat_session_id, st.session_state)
+    st.session_state.chat_session_id = st.query_params["sid"] = session_id
+
+# A new Streamlit session (new tab, another process, a restart) resumes the stored chat
+if "chat_session_id" not in st.session_state:
+    load_chat_session()
 
 # Simple booking functions
 def authenticate_user(username, password):
     """Authenticate user login - creates new user if doesn't exist"""
-    conn = sqlite3.connect('travel.db')
+    conn = connect('travel.db')
     c = conn.cursor()
     hashed = hashlib.sha256(password.encode()).hexdigest()
     
-    # First check if user exists
-    c.execute('SELECT id FROM users WHERE username=? AND password=?', (username, hashed))
-    user = c.fetchone()
+    # Resolve the username in memory; only the password is read from the table
+    user_id = get_directory().user_id(username)
     
-    if user:
-        # User exists and password matches
+    if user_id is not None:
+        c.execute('SELECT password FROM users WHERE id=?', (user_id,))
+        row = c.fetchone()
         conn.close()
-        return user[0]
+        # Username exists: log in if the password matches, otherwise refuse
+        return user_id if row and row[0] == hashed else None
     else:
-        # Check if username exists but password is wrong
-        c.execute('SELECT id FROM users WHERE username=?', (username,))
-        existing_user = c.fetchone()
-        
-        if existing_user:
-            # Username exists but wrong password
+        # User doesn't exist - create new user automatically
+        try:
+            c.execute('INSERT INTO users (username, password, loyalty_points) VALUES (?, ?, ?)', 
+                     (username, hashed, 0))
+            conn.commit()
+            new_user_id = c.lastrowid
+            conn.close()
+            note_new_user(new_user_id, username)
+            return new_user_id
+        except Exception as e:
+            print(f"Error creating user: {e}")
             conn.close()
             return None
-        else:
-            # User doesn't exist - create new user automatically
-            try:
-                c.execute('INSERT INTO users (username, password, loyalty_points) VALUES (?, ?, ?)', 
-                         (username, hashed, 0))
-                conn.commit()
-                new_user_id = c.lastrowid
-                conn.close()
-                return new_user_id
-            except Exception as e:
-                print(f"Error creating user: {e}")
-                conn.close()
-                return None
 
 def get_all_routes():
-    """Get all available routes"""
-    conn = sqlite3.connect('travel.db')
-    c = conn.cursor()
-    c.execute('SELECT id, origin, destination, departure_time, base_price, transport_type, seats_available FROM routes')
-    routes = c.fetchall()
-    conn.close()
-    return routes
+    """Get all available routes (shared, cached catalogue)"""
+    return list(get_route_catalog().routes())
 
 def add_route_suggestion(origin, destination):
     """Generate admin instructions for adding a new route"""
@@ -303,29 +542,7 @@ VALUES ('{origin}', '{destination}', '2025-01-15 10:00:00', 500.00, 'flight', 10
 
 def search_routes(origin=None, destination=None):
     """Search for routes between specific locations"""
-    conn = sqlite3.connect('travel.db')
-    c = conn.cursor()
-    
-    if origin and destination:
-        # Search for exact origin and destination
-        c.execute('''SELECT id, origin, destination, departure_time, base_price, transport_type, seats_available 
-                     FROM routes WHERE LOWER(origin) LIKE ? AND LOWER(destination) LIKE ?''', 
-                  (f'%{origin.lower()}%', f'%{destination.lower()}%'))
-    elif origin:
-        # Search by origin only
-        c.execute('''SELECT id, origin, destination, departure_time, base_price, transport_type, seats_available 
-                     FROM routes WHERE LOWER(origin) LIKE ?''', (f'%{origin.lower()}%',))
-    elif destination:
-        # Search by destination only
-        c.execute('''SELECT id, origin, destination, departure_time, base_price, transport_type, seats_available 
-                     FROM routes WHERE LOWER(destination) LIKE ?''', (f'%{destination.lower()}%',))
-    else:
-        # Get all routes
-        c.execute('SELECT id, origin, destination, departure_time, base_price, transport_type, seats_available FROM routes')
-    
-    routes = c.fetchall()
-    conn.close()
-    return routes
+    return get_route_catalog().search(origin, destination)
 
 def extract_locations_from_message(message):
     """Extract origin and destination from user message"""
@@ -347,50 +564,136 @@ def extract_locations_from_message(message):
     
     return None, None
 
-def calculate_final_price(base_price, traveller_type='adult', user_id=None):
-    """Calculate final price with discounts"""
-    price = base_price
-    # Apply child discount
-    if traveller_type == 'child':
-        price *= 0.5
-    # Apply best discount from discounts table
-    if user_id is not None:
-        conn = sqlite3.connect('travel.db')
-        c = conn.cursor()
-        # Get user loyalty points
-        c.execute('SELECT loyalty_points FROM users WHERE id=?', (user_id,))
-        user_row = c.fetchone()
-        loyalty_points = user_row[0] if user_row else 0
-        # Find best discount
-        c.execute('''SELECT percentage FROM discounts WHERE (user_type=? OR user_type IS NULL OR user_type='') AND min_points<=? ORDER BY percentage DESC LIMIT 1''', (traveller_type, loyalty_points))
-        discount_row = c.fetchone()
-        if discount_row:
-            discount = discount_row[0]
-            price *= (1 - discount / 100)
-        conn.close()
-    return round(price, 2)
+def visible_history(history, key, page=HISTORY_WINDOW):
+    """The newest entries of a HistoryBuffer, with a button that pages further back"""
+    window_key = f"{key}_window"
+    window = st.session_state.get(window_key, page)
+    hidden = len(history) - window
+    if hidden > 0 and st.button(f"⬆️ Load earlier ({hidden} more)", key=f"{key}_load_earlier"):
+        window += page
+        st.session_state[window_key] = window
+    return history.tail(window)
+
+def render_collapsed_rest(rest):
+    """The part of a long reply that split_preview cut off, in an expander"""
+    if rest:
+        with st.expander("📄 Show full reply"):
+            st.markdown(rest)
+
+def report_owner():
+    """This Streamlit session's identity for shared report jobs"""
+    if "report_owner" not in st.session_state:
+        st.session_state.report_owner = secrets.token_hex(8)
+    return st.session_state.report_owner
+
+def start_report(command, label, reply, **reply_args):
+    """Run a heavy agent command as a background job for this session; returns the job id"""
+    job_id = get_job_runner().submit(get_agent(), command, label=label, owner=report_owner(), structured=True,
+                                     user=session_user())
+    if not any(entry['job_id'] == job_id and not entry['posted'] for entry in st.session_state.report_jobs):
+        st.session_state.report_jobs.append(
+            {'job_id': job_id, 'reply': reply, 'reply_args': reply_args, 'posted': False})
+    return job_id
+
+def post_report(entry, job):
+    """Add a finished report's reply to the chat"""
+    result, error = job.outcome()
+    reply = report_reply(get_chat_flow().services, entry['reply'], result, error, **entry['reply_args'])
+    st.session_state.chat_messages.append({"role": "assistant", "content": reply})
+    save_chat_session()
+
+@st.fragment(run_every=1.0)
+def report_jobs_panel():
+    """Progress of this session's running reports; each one is posted to the chat when done"""
+    runner = get_job_runner()
+    posted = False
+    for entry in st.session_state.report_jobs:
+        if entry['posted']:
+            continue
+        job = runner.get(entry['job_id'])
+        if job is None:
+            entry['posted'] = True
+        elif job.finished:
+            post_report(entry, job)
+            entry['posted'] = posted = True
+        else:
+            done, total = job.progress
+            text = f"{job.label} {done}/{total}" if total else f"{job.label} ({job.status})"
+            st.progress(job.fraction or 0.0, text=text)
+            if st.button("✖️ Cancel", key=f"cancel_report_{job.job_id}"):
+                # Other sessions waiting for the same report keep it running
+                runner.cancel(job.job_id, report_owner())
+                reply = report_reply(get_chat_flow().services, entry['reply'], error=RuntimeError("Cancelled"),
+                                     **entry['reply_args'])
+                st.session_state.chat_messages.append({"role": "assistant", "content": reply})
+                save_chat_session()
+                entry['posted'] = entry['cancelled'] = posted = True
+    if posted:
+        st.rerun()
 
-def book_ticket(user_id, route_id, seat_number=None, traveller_type='adult'):
-    """Book a ticket"""
-    conn = sqlite3.connect('travel.db')
-    c = conn.cursor()
-    c.execute('SELECT seats_available, base_price, seats_total FROM routes WHERE id=?', (route_id,))
-    route = c.fetchone()
-    if not route or route[0] <= 0:
-        conn.close()
-        return {'error': 'No seats available'}
-    seats_left, base_price, seats_total = route
-    demand_factor = 1 + (1 - seats_left / seats_total) * 0.5
-    price_paid = round(base_price * demand_factor, 2)
-    final_price = calculate_final_price(price_paid, traveller_type, user_id)
-    booking_time = datetime.now().isoformat()
-    c.execute('INSERT INTO bookings (user_id, route_id, seat_number, price_paid, booking_time, status) VALUES (?, ?, ?, ?, ?, ?)',
-              (user_id, route_id, seat_number, final_price, booking_time, 'confirmed'))
-    c.execute('UPDATE routes SET seats_available = seats_available - 1 WHERE id=?', (route_id,))
-    conn.commit()
-    booking_id = c.lastrowid
-    conn.close()
-    return {'booking_id': booking_id, 'price_paid': final_price, 'status': 'confirmed'}
+def render_report_jobs():
+    """Running reports (polled) and recent ones that can be shown again without re-running"""
+    if any(not entry['posted'] for entry in st.session_state.report_jobs):
+        report_jobs_panel()
+    runner = get_job_runner()
+    recent = [(entry, runner.get(entry['job_id'])) for entry in st.session_state.report_jobs[-5:]
+              if entry['posted'] and not entry.get('cancelled')]
+    recent = [(entry, job) for entry, job in recent if job is not None and job.finished]
+    if recent:
+        with st.sidebar:
+            st.subheader("📚 Recent Reports")
+            for entry, job in reversed(recent):
+                if st.button(f"🔁 {job.label}", key=f"show_report_{job.job_id}"):
+                    post_report(entry, job)
+                    st.rerun()
+    del st.session_state.report_jobs[:-20]
+
+# Admin performance panel
+def perf_tab_id():
+    """This tab's key for the performance panel; unlike the session id it survives login and logout"""
+    if "perf_tab_id" not in st.session_state:
+        st.session_state.perf_tab_id = secrets.token_hex(8)
+    return st.session_state.perf_tab_id
+
+def note_render_time(started):
+    """Credit the chat's render time to the turn that produced it"""
+    turn = st.session_state.get("perf_last_turn")
+    if turn is not None and turn.render_ms is None:
+        turn.render_ms = (time.perf_counter() - started) * 1000
+
+def render_perf_panel():
+    """Sidebar timings for admins (PERF_PANEL_ADMINS); nothing is timed while it is closed"""
+    if not (st.session_state.get("chat_user_authenticated")
+            and is_perf_admin(st.session_state.get("chat_current_user"))):
+        st.session_state.pop("perf_panel", None)
+        return
+    st.divider()
+    if not st.checkbox("📈 Performance panel", key="perf_panel"):
+        st.session_state.pop("perf_last_turn", None)
+        return
+    
+    st.caption("Latest turns in this tab (ms)")
+    rows = ["| Step | Total | Dispatch | Agent | SQL | Store | Render |", "|---|---|---|---|---|---|---|"]
+    for turn in get_perf_stats().recent(perf_tab_id(), count=5):
+        render = f"{turn.render_ms:.1f}" if turn.render_ms is not None else "–"
+        rows.append(f"| {turn.step or '–'} | {turn.total_ms:.1f} | {turn.dispatch_ms:.1f} | "
+                    f"{turn.agent_ms:.1f} ({turn.agent_calls}) | {turn.sql_ms:.1f} ({turn.sql_count}) | "
+                    f"{turn.store_ms:.1f} | {render} |")
+    st.markdown("\n".join(rows))
+    
+    summary = get_perf_stats().summary()
+    if summary['turns']:
+        st.caption(f"Mean over {summary['turns']} timed turns: {summary['total_ms']:.1f} ms total, "
+                   f"{summary['agent_ms']:.1f} ms agent, {summary['sql_count']:.1f} SQL statements")
+    
+    cache = get_agent().cache.stats()
+    st.metric("🗃️ Result cache hit rate", f"{cache['hit_rate']:.0%}",
+              help=f"{cache['hits']} hits, {cache['misses']} misses, {cache['entries']} entries")
+    st.metric("🛤️ Route catalog loads", get_route_catalog().loads)
+    history = st.session_state.chat_messages.stats()
+    st.metric("💾 Session size", f"{len(pack_state(st.session_state)) / 1024:.1f} KB",
+              help=f"{history['entries']} messages, {history['live']} in memory, "
+                   f"{history['compressed_bytes']} compressed bytes of older ones")
 
 # Chat Booking Interface
 def chat_booking_interface():
@@ -411,14 +714,16 @@ def chat_booking_interface():
     # Chat display
     st.subheader("Chat")
     
-    # Display chat messages
-    for message in st.session_state.chat_messages:
+    # Display the latest chat messages; long replies are collapsed
+    render_started = time.perf_counter()
+    for message in visible_history(st.session_state.chat_messages, "chat_messages"):
+        content, rest = split_preview(message["content"])
         if message["role"] == "user":
             # Use markdown with explicit styling for user messages
             st.markdown(f"""
             <div style="background-color: #e3f2fd; padding: 10px; border-radius: 5px; margin: 5px 0; border-left: 4px solid #2196f3;">
                 <strong style="color: #000000;">You:</strong><br>
-                <span style="color: #000000; font-size: 14px;">{message["content"]}</span>
+                <span style="color: #000000; font-size: 14px;">{content}</span>
             </div>
             """, unsafe_allow_html=True)
         else:
@@ -426,9 +731,14 @@ def chat_booking_interface():
             st.markdown(f"""
             <div style="background-color: #f1f8e9; padding: 10px; border-radius: 5px; margin: 5px 0; border-left: 4px solid #4caf50;">
                 <strong style="color: #000000;">Assistant:</strong><br>
-                <span style="color: #000000; font-size: 14px;">{message["content"]}</span>
+                <span style="color: #000000; font-size: 14px;">{content}</span>
             </div>
             """, unsafe_allow_html=True)
+        render_collapsed_rest(rest)
+    note_render_time(render_started)
+    
+    # Reports running in the background for this session
+    render_report_jobs()
     
     # Chat input with better visibility - MOVED TO END
     # (This will be moved after the rerun() calls)
@@ -445,6 +755,7 @@ def chat_booking_interface():
                 st.session_state.chat_current_user = None
                 st.session_state.chat_current_user_id = None
                 st.session_state.booking_context = {}
+                rotate_chat_session()
                 st.rerun()
         else:
             st.info("Login to book tickets")
@@ -454,1134 +765,82 @@ def chat_booking_interface():
         # Quick actions
         st.subheader("Quick Actions")
         if st.button("Show All Routes"):
-            st.session_state.chat_messages.append({"role": "user", "content": "show routes"})
-            response = process_booking_chat("show routes")
-            st.session_state.chat_messages.append({"role": "assistant", "content": response})
+            process_booking_chat("show routes")
             st.rerun()
         
         if st.button("Help"):
-            st.session_state.chat_messages.append({"role": "user", "content": "help"})
-            response = process_booking_chat("help")
-            st.session_state.chat_messages.append({"role": "assistant", "content": response})
+            process_booking_chat("help")
             st.rerun()
         
         if st.button("Clear Chat"):
-            st.session_state.chat_messages = []
+            st.session_state.chat_messages.clear()
+            st.session_state.pop("chat_messages_window", None)
             st.session_state.booking_context = {}
+            save_chat_session()
             st.rerun()
+        
+        render_perf_panel()
     
     # CHAT INPUT AT THE BOTTOM - Now properly fixed
     user_input = st.chat_input("Type your message here...")
     
     if user_input:
-        # Add user message
-        st.session_state.chat_messages.append({"role": "user", "content": user_input})
-        
-        # Process and get response
-        response = process_booking_chat(user_input)
-        
-        # Add assistant response
-        st.session_state.chat_messages.append({"role": "assistant", "content": response})
+        # Add the message and the assistant's response to the chat
+        process_booking_chat(user_input)
         
         st.rerun()
 
-def process_booking_chat(message):
-    """Process chat messages for complete booking flow"""
-    message = message.lower().strip()
-    
-    # PRIORITY 1: Handle guided login process (must be first!)
-    if st.session_state.booking_context.get('step') == 'asking_username':
-        # User provided username, now ask for password
-        username = message.strip()
-        travel_intent = st.session_state.booking_context.get('travel_intent')  # Preserve travel intent
-        st.session_state.booking_context = {
-            'step': 'asking_password', 
-            'username': username,
-            'travel_intent': travel_intent  # Keep the original travel request
-        }
-        return f"✅ Got it! Username: **{username}**\n\n🔑 **Now, what's your password?**\n\nDon't worry, I'll securely check your credentials."
-    
-    # PRIORITY 2: Handle password input
-    if st.session_state.booking_context.get('step') == 'asking_password':
-        password = message.strip()
-        username = st.session_state.booking_context.get('username')
-        travel_intent = st.session_state.booking_context.get('travel_intent')
-        
-        # Check if user exists first
-        conn = sqlite3.connect('travel.db')
-        c = conn.cursor()
-        c.execute('SELECT id FROM users WHERE username=?', (username,))
-        existing_user = c.fetchone()
-        conn.close()
-        
-        # Authenticate (this will create user if needed)
-        user_id = authenticate_user(username, password)
-        if user_id:
-            st.session_state.chat_user_authenticated = True
-            st.session_state.chat_current_user = username
-            st.session_state.chat_current_user_id = user_id
-            
-            # Determine if this is a new user or existing user
-            welcome_message = ""
-            if not existing_user:
-                welcome_message = f"🎉 **Welcome to the Travel Booking System, {username}!** 🆕\n\n✨ **New account created successfully!** You now have:\n• 0 loyalty points (earn more by booking trips!)\n• Access to all available discounts\n• Secure account with encrypted password\n\n"
-            else:
-                welcome_message = f"🎉 **Welcome back, {username}!** You're now logged in.\n\n"
-            
-            # After successful login, always ask for origin first
-            st.session_state.booking_context = {'step': 'asking_origin'}
-            return welcome_message + f"🌍 **Great! Now let's plan your trip!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai' \n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
-        else:
-            st.session_state.booking_context = {
-                'step': 'asking_username',
-                'travel_intent': travel_intent  # Preserve travel intent on retry
-            }
-            return f"❌ Sorry, I couldn't log you in with those credentials.\n\n🔄 Let's try again! What's your **username**?"
-    
-    # PRIORITY 3: Handle route selection (must be before general booking logic)
-    if st.session_state.booking_context.get('step') == 'route_selection':
-        if message.isdigit():
-            route_num = int(message)
-            available_routes = st.session_state.booking_context.get('available_routes', [])
-            if 1 <= route_num <= len(available_routes):
-                selected_route = available_routes[route_num - 1]
-                st.session_state.booking_context = {
-                    'step': 'traveller_type',
-                    'route': selected_route
-                }
-                return f"🎫 Great! You selected:\n{selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type 'adult' for adult ticket\n- Type 'child' for child ticket (50% discount)"
-            else:
-                return f"❌ Invalid route number. Please choose between 1 and {len(available_routes)}."
-    
-    # PRIORITY 3.5: Handle direct numeric input for route selection (when user types just a number)
-    # BUT ONLY if not in a specific step that expects numeric input
-    if (message.isdigit() and st.session_state.chat_user_authenticated and 
-        st.session_state.booking_context.get('step') not in ['new_route_price', 'new_route_seats', 'discount_selection']):
-        route_num = int(message)
-        
-        # Check if we're in offer_new_route step (user selecting from available routes)
-        if st.session_state.booking_context.get('step') == 'offer_new_route':
-            all_routes = get_all_routes()
-            if 1 <= route_num <= len(all_routes):
-                selected_route = all_routes[route_num - 1]
-                st.session_state.booking_context = {
-                    'step': 'traveller_type',
-                    'route': selected_route
-                }
-                return f"🎫 **Great! You selected:**\n**Route {route_num}**: {selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type '**adult**' for adult ticket\n- Type '**child**' for child ticket (50% discount)"
-            else:
-                return f"❌ Invalid route number. Please choose between 1 and {len(all_routes)}."
-        
-        # General route selection from all routes
-        routes = get_all_routes()
-        if 1 <= route_num <= len(routes):
-            selected_route = routes[route_num - 1]
-            st.session_state.booking_context = {
-                'step': 'traveller_type',
-                'route': selected_route
-            }
-            return f"🎫 Great! You selected:\n**Route {route_num}**: {selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type '**adult**' for adult ticket\n- Type '**child**' for child ticket (50% discount)"
-        else:
-            return f"❌ Invalid route number. We have {len(routes)} routes available. Please choose between 1 and {len(routes)}.\n\n💡 Type '**show routes**' to see all available routes again."
-    # PRIORITY 4: Handle booking queries (show bookings) - MUST be before other logic
-    if any(word in message for word in ["show bookings", "my bookings", "booking history", "bookings for", "all bookings", "bookings under", "bookings of", "booking queries", "show all booking", "all booking", "provide all my bookings", "all my bookings", "provide all"]):
-        
-        # Check if this is a request for ALL system bookings (no specific user)
-        if any(phrase in message for phrase in ["provide all", "provide all my bookings", "all my bookings"]) and "for" not in message and "under" not in message and "of" not in message:
-            # This is a request for ALL system bookings with calculations
-            try:
-                # Import the agent if not already available
-                if 'agent' not in st.session_state or st.session_state.agent is None:
-                    from agent_repl import TravelBookingAgent
-                    st.session_state.agent = TravelBookingAgent()
-                
-                # Use the new provide_all_bookings intent directly
-                with capture_stdout() as captured:
-                    result = st.session_state.agent.process_command('provide all bookings', 'local')
-                    agent_output = captured.getvalue()
-                
-                if agent_output.strip():
-                    # Format the output nicely for Streamlit
-                    response = "� **ALL BOOKINGS IN SYSTEM - Complete Analysis:**\n\n"
-                    response += "```\n"
-                    response += agent_output.strip()
-                    response += "\n```\n\n"
-                    response += "� **Want specific user data?** Try:\n"
-                    response += "• 'show bookings for [username]' - Individual user analysis\n"
-                    response += "• 'total price for [username]' - Quick spending summary"
-                    return response
-                else:
-                    return "📋 **No bookings found in the system.**\n\nThe system is ready for new bookings! Users can log in and start booking trips."
-                
-            except Exception as e:
-                return f"❌ Error retrieving all system bookings: {str(e)}\n\nPlease try again or contact support."
-        
-        # Handle user-specific booking queries
-        # Enhanced username extraction to catch any username pattern
-        import re
-        # More flexible regex patterns to catch variations like "booking queries under nikitha"
-        username_match = re.search(r'(?:for|of|under|show bookings? (?:queries? )?of|bookings? for|bookings? of|bookings? under|all bookings? under|show all bookings? under|booking queries? under|all booking queries? under)\s+([a-zA-Z0-9_]+)', message)
-        if username_match:
-            requested_user = username_match.group(1)
-        else:
-            # Check for "my bookings" when user is logged in
-            if any(phrase in message for phrase in ["my bookings", "show my bookings"]) and "provide all" not in message:
-                if not st.session_state.chat_user_authenticated:
-                    return "🔐 Please log in first to view your bookings.\n\nType 'login' to get started!"
-                requested_user = st.session_state.chat_current_user
-            else:
-                # Also check for pattern like "nikitha bookings" or "john bookings"  
-                username_match = re.search(r'([a-zA-Z0-9_]+)\s+(?:bookings?|booking queries?)', message)
-                if username_match:
-                    requested_user = username_match.group(1)
-                else:
-                    # If no specific username is mentioned and user is not logged in, ask for username
-                    if not st.session_state.chat_user_authenticated:
-                        return "🔐 Please specify a username or log in first to view bookings.\n\n💡 **Examples:**\n• 'show bookings for nikitha'\n• 'all bookings under john'\n• 'show all booking queries under nikitha'\n• Or type 'login' to access your bookings"
-                    requested_user = st.session_state.chat_current_user
-        
-        # Execute REPL command to get detailed booking information
-        try:
-            # Import the agent if not already available
-            if 'agent' not in st.session_state or st.session_state.agent is None:
-                from agent_repl import TravelBookingAgent
-                st.session_state.agent = TravelBookingAgent()
-            
-            # Capture REPL output
-            with capture_stdout() as captured:
-                result = st.session_state.agent.process_command(f'show me all bookings under {requested_user}', 'local')
-                agent_output = captured.getvalue()
-            
-            if agent_output.strip():
-                # Format the output for better readability
-                formatted_output = agent_output.strip()
-                
-                # DEBUG: Let's see what we're getting
-                print(f"DEBUG: Agent output contains 'Booking ID:': {'Booking ID:' in formatted_output}")
-                print(f"DEBUG: Agent output first 200 chars: {formatted_output[:200]}")
-                print(f"DEBUG: Full output length: {len(formatted_output)}")
-                
-                # ROBUST detection: Only return "no bookings" if we explicitly see the no bookings message AND no booking IDs
-                has_booking_ids = "Booking ID:" in formatted_output
-                has_no_bookings_msg = "No bookings found" in formatted_output
-                
-                print(f"DEBUG: has_booking_ids = {has_booking_ids}, has_no_bookings_msg = {has_no_bookings_msg}")
-                
-                # If we have booking IDs, proceed with parsing regardless of any other messages
-                if not has_booking_ids and has_no_bookings_msg:
-                    return f"📋 **No bookings found for {requested_user}**\n\nLooks like {requested_user} hasn't made any bookings yet. Ready to book your first trip? Just say 'book ticket' to get started!"
-                
-                # If we have booking IDs, parse and display them
-                if has_booking_ids:
-                    print(f"DEBUG: Entering booking parsing logic with {len(formatted_output)} chars")
-                    
-                    # First, separate the summary section from the booking data
-                    summary_section = ""
-                    booking_data = formatted_output
-                    
-                    # Look for the summary section and extract it
-                    if "ROUTE-WISE SUMMARY" in formatted_output:
-                        # Find the last occurrence of the separator
-                        separator = "=================================================="
-                        last_separator_index = formatted_output.rfind(separator)
-                        
-                        if last_separator_index != -1:
-                            # Everything before the last separator is booking data
-                            booking_data = formatted_output[:last_separator_index].strip()
-                            # Everything after the last separator is summary
-                            summary_section = formatted_output[last_separator_index + len(separator):].strip()
-                        
-                        print(f"DEBUG: After improved split - booking_data length: {len(booking_data)}, summary_section length: {len(summary_section)}")
-                    else:
-                        # No summary section, use all data as booking data
-                        booking_data = formatted_output
-                        print(f"DEBUG: No summary section found, using full data length: {len(booking_data)}")
-                    
-                    print(f"DEBUG: booking_data length: {len(booking_data)}, summary_section length: {len(summary_section)}")
-                    
-                    # Now split the booking data by "Booking ID:" to get individual bookings
-                    booking_parts = booking_data.split("Booking ID:")
-                    print(f"DEBUG: Found {len(booking_parts)} booking parts after split")
-                    
-                    response = f"📋 **REPL Booking Analysis for {requested_user.title()}:**\n\n"
-                    
-                    booking_count = 0
-                    
-                    for i, part in enumerate(booking_parts):
-                        part = part.strip()
-                        print(f"DEBUG: Processing part {i}: length {len(part)}, first 50 chars: {part[:50] if part else 'EMPTY'}")
-                        
-                        if not part:
-                            continue
-                        
-                        # Skip non-booking parts (like headers and user info)
-                        if ("Found EXACT user:" in part or 
-                            "SHOWING ALL BOOKINGS:" in part or 
-                            len(part.split('\n')) < 3):  # Too short to be a real booking
-                            print(f"DEBUG: Skipping part {i} - header or too short")
-                            continue
-                        
-                        # This is a booking - extract the ID and create separate section
-                        lines = part.split('\n')
-                        if lines and lines[0].strip():
-                            # Try to extract booking ID number
-                            first_line = lines[0].strip()
-                            booking_id_parts = first_line.split()
-                            print(f"DEBUG: First line: '{first_line}', parts: {booking_id_parts}")
-                            
-                            if booking_id_parts and booking_id_parts[0].isdigit():
-                                booking_id = booking_id_parts[0]
-                                booking_count += 1
-                                
-                                print(f"DEBUG: Found valid booking ID: {booking_id} (count: {booking_count})")
-                                
-                                # MAXIMUM separation between each booking
-                                if booking_count > 1:
-                                    response += "\n\n" + "="*50 + "\n\n"
-                                
-                                response += f"## 🎫 **BOOKING ID: {booking_id}**\n\n"
-                                response += "```\n"
-                                # Reconstruct the complete booking info for this ID only
-                                response += f"Booking ID: {booking_id}\n"
-                                response += part
-                                response += "\n```\n\n"
-                            else:
-                                print(f"DEBUG: First part not a digit: {booking_id_parts}")
-                    
-                    print(f"DEBUG: Final booking_count: {booking_count}")
-                    
-                    # If no bookings were actually found during parsing
-                    if booking_count == 0:
-                        print("DEBUG: No bookings found during parsing, returning no bookings message")
-                        return f"📋 **No bookings found for {requested_user}**\n\nLooks like {requested_user} hasn't made any bookings yet. Ready to book your first trip? Just say 'book ticket' to get started!"
-                    
-                    # Add summary section if it exists
-                    if summary_section:
-                        response += "\n\n" + "="*50 + "\n\n"
-                        response += "## 💰 **SUMMARY ANALYSIS**\n\n"
-                        response += "```\n"
-                        response += summary_section
-                        response += "\n```\n\n"
-                    
-                    # Add interactive suggestions
-                    response += f"💡 **Need more analysis?** Try:\n"
-                    response += f"• 'total price for {requested_user}' - See spending summary\n"
-                    response += f"• 'explain booking [ID]' - Get detailed breakdown for specific booking\n"
-                    response += f"• 'book ticket' - Make a new booking"
-                    
-                    print(f"DEBUG: Returning response with length: {len(response)}")
-                    return response
-                
-                # Fallback if no booking IDs found
-                return f"📋 **No bookings found for {requested_user}**\n\nLooks like {requested_user} hasn't made any bookings yet. Ready to book your first trip? Just say 'book ticket' to get started!"
-            else:
-                return f"❌ No booking information found for {requested_user}."
-                
-        except Exception as e:
-            return f"❌ Error retrieving bookings: {str(e)}\n\nPlease try again or contact support."
-    
-    # Handle requests for ALL bookings in the system (admin view)
-    if any(phrase in message for phrase in ["all bookings", "show all bookings", "system bookings", "every booking"]):
-        if "for" not in message and "under" not in message and "of" not in message:
-            # This is a request for ALL system bookings, not user-specific
-            try:
-                # Import the agent if not already available
-                if 'agent' not in st.session_state or st.session_state.agent is None:
-                    from agent_repl import TravelBookingAgent
-                    st.session_state.agent = TravelBookingAgent()
-                
-                # Use the new provide_all_bookings intent for detailed analysis
-                with capture_stdout() as captured:
-                    result = st.session_state.agent.process_command('provide all bookings', 'local')
-                    agent_output = captured.getvalue()
-                
-                if agent_output.strip():
-                    return f"📋 **All Bookings in System - Complete Analysis:**\n\n```\n{agent_output.strip()}\n```\n\n💡 **Want user-specific bookings?** Try:\n• 'show bookings for [username]' - See specific user's bookings\n• 'total price for [username]' - See spending summary"
-                else:
-                    return "📋 No bookings found in the system."
-                    
-            except Exception as e:
-                return f"❌ Error retrieving all system bookings: {str(e)}\n\nPlease try again or contact support."
-    
-    
-    # Handle login requests (more conversational and guided)
-    if any(word in message for word in ["login", "log in", "sign in", "signin"]):
-        if message.startswith("login "):
-            # Direct login format
-            parts = message.split(" ", 2)
-            if len(parts) >= 3:
-                username = parts[1]
-                password = parts[2]
-                user_id = authenticate_user(username, password)
-                if user_id:
-                    st.session_state.chat_user_authenticated = True
-                    st.session_state.chat_current_user = username
-                    st.session_state.chat_current_user_id = user_id
-                    return f"🎉 Welcome back, {username}! You're now logged in and ready to book tickets.\n\n🌍 **What would you like to do today?**\n\n**Choose an option:**\n1️⃣ **Book from existing routes** - See available flights and book\n2️⃣ **Add new route** - Request a new route to be added\n\nJust type **'1'** or **'2'** or say **'existing routes'** or **'new route'**"
-                else:
-                    return "❌ Hmm, those credentials don't seem right. Please check your username and password and try again.\n\n💡 Format: login username password"
-            else:
-                return "Please provide both username and password.\n\n💡 Format: login username password\n\nFor example: login john mypassword123"
-        else:
-            # Interactive login request - ask for username first
-            st.session_state.booking_context = {'step': 'asking_username'}
-            return "👋 Great! I'll help you log in step by step.\n\n🔐 **What's your username?**\n\nJust type your username and I'll ask for your password next."
-    
-    # Handle travel planning requests (natural conversation)
-    if any(word in message for word in ["want to go", "travel to", "go to", "trip to", "visit"]):
-        if not st.session_state.chat_user_authenticated:
-            # Set login context AND save travel intent
-            st.session_state.booking_context = {
-                'step': 'asking_username',
-                'travel_intent': message  # Save what they wanted to do
-            }
-            return "🔐 I'd love to help you plan your trip! But first, let me get you logged in.\n\n👋 **What's your username?**\n\nOnce you're logged in, I'll help you find the perfect route!"
-        
-        # User wants to travel - ask what they want to do
-        st.session_state.booking_context = {'step': 'choose_action'}
-        return "🌍 **Great! What would you like to do?**\n\n**Choose an option:**\n1️⃣ **Book from existing routes** - See available flights and book\n2️⃣ **Add new route** - Request a new route to be added\n\nJust type **'1'** or **'2'** or say **'existing routes'** or **'new route'**"
-    
-    
-    # Handle action choice (existing routes vs new route)
-    if st.session_state.booking_context.get('step') == 'choose_action':
-        if any(word in message for word in ["1", "existing", "book existing", "existing routes"]):
-            # User wants to book existing routes - FIX: Ask for origin first, not destination
-            st.session_state.booking_context = {'step': 'asking_origin'}
-            return "🎯 **Great! Let's book from existing routes!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai'\n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
-        elif any(word in message for word in ["2", "new", "add", "new route"]):
-            # User wants to add new route
-            st.session_state.booking_context = {'step': 'new_route_origin'}
-            return "🆕 **Perfect! Let's add a new route!**\n\n🏠 **Where should this new route start from?**\nPlease tell me the origin city:\n\nFor example: 'Mumbai', 'Delhi', 'Chennai'"
-        else:
-            return "Please choose an option:\n\n1️⃣ Type **'1'** or **'existing routes'** to book from existing routes\n2️⃣ Type **'2'** or **'new route'** to add a new route\n\nWhat would you like to do?"
-    
-    # Handle new route creation - asking for origin
-    if st.session_state.booking_context.get('step') == 'new_route_origin':
-        origin = message.strip().title()
-        st.session_state.booking_context = {
-            'step': 'new_route_destination',
-            'new_route_origin': origin
-        }
-        return f"✅ **Origin: {origin}**\n\n🎯 **Where should this route go to?**\nPlease tell me the destination city:\n\nFor example: 'Dubai', 'Singapore', 'London'"
-    
-    # Handle new route creation - asking for destination
-    if st.session_state.booking_context.get('step') == 'new_route_destination':
-        destination = message.strip().title()
-        origin = st.session_state.booking_context.get('new_route_origin')
-        st.session_state.booking_context = {
-            'step': 'new_route_transport',
-            'new_route_origin': origin,
-            'new_route_destination': destination
-        }
-        return f"✅ **Route: {origin} → {destination}**\n\n🚊 **What type of transport?**\nChoose from:\n• **'flight'** - Air travel\n• **'bus'** - Road travel\n• **'train'** - Rail travel\n\nWhat type would you prefer?"
-    
-    # Handle new route creation - asking for transport type
-    if st.session_state.booking_context.get('step') == 'new_route_transport':
-        if message.lower() in ['flight', 'bus', 'train']:
-            transport = message.lower()
-            origin = st.session_state.booking_context.get('new_route_origin')
-            destination = st.session_state.booking_context.get('new_route_destination')
-            st.session_state.booking_context = {
-                'step': 'new_route_price',
-                'new_route_origin': origin,
-                'new_route_destination': destination,
-                'new_route_transport': transport
-            }
-            return f"✅ **Transport: {transport.title()}**\n\n💰 **What should be the base price?**\nEnter the price in dollars (just the number):\n\nFor example: 450, 750, 1200"
-        else:
-            return "Please choose a valid transport type:\n• **'flight'**\n• **'bus'**\n• **'train'**"
-    
-    # Handle new route creation - asking for price
-    if st.session_state.booking_context.get('step') == 'new_route_price':
-        try:
-            price = float(message.strip())
-            origin = st.session_state.booking_context.get('new_route_origin')
-            destination = st.session_state.booking_context.get('new_route_destination')
-            transport = st.session_state.booking_context.get('new_route_transport')
-            st.session_state.booking_context = {
-                'step': 'new_route_seats',
-                'new_route_origin': origin,
-                'new_route_destination': destination,
-                'new_route_transport': transport,
-                'new_route_price': price
-            }
-            return f"✅ **Price: ${price}**\n\n🪑 **How many total seats?**\nEnter the number of seats available:\n\nFor example: 100, 150, 200"
-        except ValueError:
-            return "Please enter a valid price (just numbers):\nFor example: 450, 750, 1200"
-    
-    # Handle new route creation - asking for seats
-    if st.session_state.booking_context.get('step') == 'new_route_seats':
-        try:
-            seats = int(message.strip())
-            origin = st.session_state.booking_context.get('new_route_origin')
-            destination = st.session_state.booking_context.get('new_route_destination')
-            transport = st.session_state.booking_context.get('new_route_transport')
-            price = st.session_state.booking_context.get('new_route_price')
-            
-            # Add route to database
-            conn = sqlite3.connect('travel.db')
-            c = conn.cursor()
-            c.execute('''INSERT INTO routes 
-                         (origin, destination, departure_time, base_price, transport_type, seats_available, seats_total) 
-                         VALUES (?, ?, ?, ?, ?, ?, ?)''', 
-                      (origin, destination, '2025-01-15 10:00:00', price, transport, seats, seats))
-            conn.commit()
-            route_id = c.lastrowid
-            conn.close()
-            
-            # Clear context and offer immediate booking of the new route
-            st.session_state.booking_context = {
-                'step': 'offer_immediate_booking',
-                'new_route_id': route_id,
-                'new_route_info': (route_id, origin, destination, '2025-01-15 10:00:00', price, transport, seats)
-            }
-            
-            return f"🎉 **NEW ROUTE ADDED SUCCESSFULLY!**\n\n📋 **Route Details:**\n• **Route ID:** {route_id}\n• **Route:** {origin} → {destination}\n• **Transport:** {transport.title()}\n• **Price:** ${price}\n• **Seats:** {seats}\n\n✈️ **Would you like to book this route right now?**\n\n**Options:**\n• Type '**yes**' or '**book**' to book this route immediately\n• Type '**show routes**' to see all routes\n• Type '**add another**' to add more routes"
-        except ValueError:
-            return "Please enter a valid number of seats:\nFor example: 100, 150, 200"
-
-    # Handle immediate booking after adding new route
-    if st.session_state.booking_context.get('step') == 'offer_immediate_booking':
-        if any(word in message for word in ["yes", "book", "book this", "book it"]):
-            # User wants to book the newly added route immediately
-            new_route_info = st.session_state.booking_context.get('new_route_info')
-            st.session_state.booking_context = {
-                'step': 'traveller_type',
-                'route': new_route_info
-            }
-            route_id, origin, destination, departure, price, transport, seats = new_route_info
-            return f"🎫 **Great! You selected the new route:**\n{origin} → {destination} ({transport})\nPrice: ${price:.2f}\n\nPlease choose traveller type:\n- Type '**adult**' for adult ticket\n- Type '**child**' for child ticket (50% discount)"
-        elif any(word in message for word in ["show routes", "show all", "all routes"]):
-            # Show all routes including the new one
-            routes = get_all_routes()
-            st.session_state.booking_context = {}
-            response = "📋 **All Available Routes (including your new route):**\n\n"
-            for i, route in enumerate(routes, 1):
-                response += f"**{i}.** {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
-            response += f"\n💡 Type a route number (1-{len(routes)}) to book!"
-            return response
-        elif any(word in message for word in ["add another", "add more"]):
-            # Start adding another route
-            st.session_state.booking_context = {'step': 'new_route_origin'}
-            return "🆕 **Perfect! Let's add another route!**\n\n🏠 **Where should this new route start from?**\nPlease tell me the origin city:\n\nFor example: 'Mumbai', 'Delhi', 'Chennai'"
-        else:
-            return "🤔 I didn't understand that. Please choose:\n• Type '**yes**' or '**book**' to book the route you just added\n• Type '**show routes**' to see all available routes\n• Type '**add another**' to add more routes"
-
-    # Handle origin input (NEW - always ask origin first after login)
-    if st.session_state.booking_context.get('step') == 'asking_origin':
-        origin = message.strip().title()
-        st.session_state.booking_context = {
-            'step': 'asking_destination',
-            'origin': origin
-        }
-        return f"✅ **Starting from: {origin}**\n\n🎯 **Where would you like to go?**\nPlease tell me your destination city:\n\nFor example:\n• 'Paris'\n• 'Mumbai'\n• 'Dubai'\n• 'Singapore'\n\nWhat's your destination?"
-    
-    # Handle destination input (UPDATED - now checks for existing routes)
-    if st.session_state.booking_context.get('step') == 'asking_destination':
-        destination = message.strip().title()
-        origin = st.session_state.booking_context.get('origin')
-        
-        # Safety check: If origin is missing, redirect to asking_origin
-        if not origin:
-            st.session_state.booking_context = {'step': 'asking_origin'}
-            return "🔄 **Oops! I need to know where you're starting from first.**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai'\n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
-        
-        # Search for routes between origin and destination
-        matching_routes = search_routes(origin, destination)
-        
-        if matching_routes:
-            # Routes exist - show them for booking
-            response = f"🎉 **Perfect! I found {len(matching_routes)} route(s) from {origin} to {destination}:**\n\n"
-            for i, route in enumerate(matching_routes, 1):
-                response += f"**{i}.** {route[1]} → {route[2]} ({route[5]})\n"
-                response += f"   💰 Price: ${route[4]:.2f} | 🪑 Available seats: {route[6]}\n"
-                response += f"   ⏰ Departure: {route[3]}\n\n"
-            
-            # Dynamic message based on number of routes
-            if len(matching_routes) == 1:
-                response += "**Perfect! This is exactly what you're looking for!**\nJust type **'1'** to book this route!"
-            else:
-                response += "**Which route looks good to you?**\nJust say the number, like '1' or '2'!"
-            
-            # Store matching routes for booking
-            st.session_state.booking_context = {
-                'step': 'route_selection',
-                'available_routes': matching_routes,
-                'origin': origin,
-                'destination': destination
-            }
-            return response
-        else:
-            # No routes exist - offer to add new route
-            st.session_state.booking_context = {
-                'step': 'offer_new_route',
-                'origin': origin,
-                'destination': destination
-            }
-            
-            # Show what routes ARE available
-            all_routes = get_all_routes()
-            response = f"😔 **No direct routes found from {origin} to {destination}**\n\n"
-            
-            if all_routes:
-                response += "🗺️ **Here are our current available routes:**\n"
-                for i, route in enumerate(all_routes[:5], 1):  # Show first 5 routes
-                    response += f"{i}. {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
-                if len(all_routes) > 5:
-                    response += f"   ... and {len(all_routes) - 5} more routes\n"
-                response += "\n"
-            
-            response += f"🆕 **Would you like me to help add {origin} → {destination} as a new route?**\n\n"
-            response += "**Options:**\n"
-            response += "• Type '**yes**' or '**add route**' to create this new route\n"
-            response += "• Type '**show all**' to see all available routes\n"
-            response += "• Type '**change**' to try different cities\n"
-            response += f"• Type a **route number** (1-{len(all_routes) if all_routes else 0}) to book existing route\n\n"
-            response += "What would you like to do?"
-            return response
-    
-    # Handle origin input
-    if st.session_state.booking_context.get('step') == 'asking_origin':
-        origin = message.strip().title()
-        destination = st.session_state.booking_context.get('destination')
-        
-        # Search for routes
-        matching_routes = search_routes(origin, destination)
-        
-        if matching_routes:
-            # Routes exist - show available options
-            response = f"🎉 **Perfect! I found routes from {origin} to {destination}:**\n\n"
-            for i, route in enumerate(matching_routes, 1):
-                response += f"**{i}.** {route[1]} → {route[2]} ({route[5]})\n"
-                response += f"   💰 Price: ${route[4]:.2f} | 🪑 Available seats: {route[6]}\n"
-                response += f"   ⏰ Departure: {route[3]}\n\n"
-            
-            # Dynamic message based on number of routes
-            if len(matching_routes) == 1:
-                response += "**Perfect! This is exactly what you're looking for!**\nJust type **'1'** to book this route!"
-            else:
-                response += "**Which route looks good to you?**\nJust say the number, like '1' or '2'!"
-            
-            # Store matching routes for booking
-            st.session_state.booking_context = {
-                'step': 'route_selection',
-                'available_routes': matching_routes,
-                'origin': origin,
-                'destination': destination
-            }
-            return response
-        else:
-            # No routes exist - show available alternatives and suggest adding route
-            all_routes = get_all_routes()
-            st.session_state.booking_context = {}
-            
-            response = f"😔 **Sorry, I couldn't find any direct routes from {origin} to {destination}.**\n\n"
-            
-            # Show what routes ARE available
-            if all_routes:
-                response += "� **Here are our current available routes:**\n"
-                for route in all_routes[:8]:  # Show first 8 routes
-                    response += f"• {route[1]} → {route[2]} ({route[5]})\n"
-                if len(all_routes) > 8:
-                    response += f"• ... and {len(all_routes) - 8} more routes\n"
-                response += "\n"
-            
-            response += "🔍 **What you can do:**\n"
-            response += f"1. **Book available route**: Choose from routes above by saying 'book [number]'\n"
-            response += f"2. **Check nearby cities**: Try '{destination}' from Delhi, Bengaluru, or Chennai\n"
-            response += f"3. **Request new route**: I can help you request {origin} to {destination}\n"
-            response += f"4. **See all routes**: Say 'show routes' for complete list\n\n"
-            response += f"💡 **Good news!** Admin can easily add the {origin} to {destination} route you want!\n"
-            response += "**What would you like to do?**"
-            return response
-    
-    # Handle offer new route responses
-    if st.session_state.booking_context.get('step') == 'offer_new_route':
-        origin = st.session_state.booking_context.get('origin')
-        destination = st.session_state.booking_context.get('destination')
-        
-        if any(word in message for word in ["yes", "add", "create", "new"]):
-            # User wants to add new route
-            st.session_state.booking_context = {
-                'step': 'new_route_transport',
-                'new_route_origin': origin,
-                'new_route_destination': destination
-            }
-            return f"🎉 **Great! Let's add the {origin} → {destination} route!**\n\n🚊 **What type of transport?**\nChoose from:\n• **'flight'** - Air travel\n• **'bus'** - Road travel\n• **'train'** - Rail travel\n\nWhat type would you prefer?"
-        elif any(word in message for word in ["show all", "all routes", "show routes"]):
-            # Show all routes
-            routes = get_all_routes()
-            st.session_state.booking_context = {}
-            if not routes:
-                return "📋 No routes available in the system."
-            
-            response = "📋 **All Available Routes:**\n\n"
-            for i, route in enumerate(routes, 1):
-                response += f"**{i}.** {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
-            response += f"\n💡 Type a route number (1-{len(routes)}) to book!"
-            return response
-        elif any(word in message for word in ["change", "different", "try again", "revise", "badal do", "modify", "edit", "redo"]):
-            # Start over with new cities - Enhanced language support
-            st.session_state.booking_context = {'step': 'asking_origin'}
-            return "🔄 **Let's try different cities!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):"
-        else:
-            return f"🤔 I didn't understand that. Please choose:\n• Type '**yes**' to add {origin} → {destination} route\n• Type '**show all**' to see available routes\n• Type '**change**', '**revise**', or '**badal do**' to try different cities\n• Type a **route number** to book existing route"
-    
-    # Handle route addition requests
-    if any(word in message for word in ["add route", "new route", "create route", "route request"]):
-        return "🔧 **Route Addition Request**\n\nTo add new routes, an admin needs to:\n\n1. **Access admin panel** (if available)\n2. **Add to database** directly\n3. **Contact system administrator**\n\n💡 **For immediate help:**\n• Tell me which route you need (from where to where)\n• I can provide the exact SQL commands for admin\n• Say 'help admin' for detailed instructions\n\nWhich route would you like to request?"
-    
-    # Admin help
-    if any(word in message for word in ["help admin", "admin help", "admin instructions"]):
-        return """🔧 **Admin Route Management Guide**
-
-**To add a new route to the database:**
-
-**Method 1: SQL Command**
-```sql
-INSERT INTO routes (origin, destination, departure_time, base_price, transport_type, seats_available, seats_total) 
-VALUES ('CityA', 'CityB', '2025-01-15 10:00:00', 500.00, 'flight', 100, 100);
-```
-
-**Method 2: Python Script**
-```python
-import sqlite3
-conn = sqlite3.connect('travel.db')
-c = conn.cursor()
-c.execute("INSERT INTO routes (origin, destination, departure_time, base_price, transport_type, seats_available, seats_total) VALUES (?, ?, ?, ?, ?, ?, ?)", 
-          ('Origin', 'Destination', '2025-01-15 10:00:00', 500.00, 'flight', 100, 100))
-conn.commit()
-conn.close()
-```
-
-**Fields to specify:**
-• origin: Starting city
-• destination: End city  
-• departure_time: Format 'YYYY-MM-DD HH:MM:SS'
-• base_price: Price in dollars
-• transport_type: 'flight', 'bus', 'train'
-• seats_available: Current available seats
-• seats_total: Total seats capacity
-
-Need help with a specific route? Just ask!"""
-    
-    # Show routes
-    if any(word in message for word in ["routes", "flights", "show"]):
-        routes = get_all_routes()
-        if not routes:
-            return "No routes available at the moment."
-        
-        response = "📋 Available Routes:\n\n"
-        for i, route in enumerate(routes, 1):
-            response += f"{i}. {route[1]} → {route[2]} ({route[5]})\n"
-            response += f"   Price: ${route[4]:.2f} | Available seats: {route[6]}\n"
-            response += f"   Departure: {route[3]}\n\n"
-        response += "To book a ticket, say: 'book [route number]' or 'book ticket to [destination]'"
-        return response
-    
-    # Help
-    if "help" in message:
-        help_text = """Here's what I can help you with:
+@st.cache_resource
+def get_chat_flow():
+    """The booking chat flow, wired to this app's lookups and renderers"""
+    return ChatFlow(ChatServices(
+        authenticate_user=authenticate_user,
+        user_exists=lambda username: get_directory().user_id(username) is not None,
+        available_discounts=get_quote_book().discounts,
+        add_route=get_route_catalog().add,
+        quote_price=get_quote_book().quote,
+        book_quote=get_quote_book().book,
+        get_all_routes=get_all_routes,
+        search_routes=search_routes,
+        extract_locations=extract_locations_from_message,
+        parse_command=lambda message: get_agent().parse_natural_language(message),
+        run_agent=run_agent,
+        start_report=start_report,
+        render_system_report=render_system_report,
+        render_user_bookings=render_user_bookings,
+        render_user_total=render_user_total,
+        render_top_users=render_top_users,
+        render_booking_listing=render_booking_listing,
+    ))
 
-🔐 **Login**: Type 'login username password'
-✈️ **View Routes**: Say 'show routes' or 'flights'
-🎫 **Book Ticket**: 
-   • 'book [route number]' - book specific route
-   • 'book from [origin] to [destination]' - smart search
-   • 'book ticket from Delhi to Mumbai' - natural language
-💰 **Check Prices**: Say 'price' or 'pricing'
-❓ **Help**: Say 'help'
-
-**Smart Booking Examples:**
-• "I need to book a ticket from Delhi to Mumbai"
-• "Book flight from NYC to LA"
-• "Book from Hyderabad to Chennai"
-
-**If route doesn't exist:**
-• I'll suggest available alternatives
-• Admin can add new routes using admin panel
-• Contact admin to add your desired route
-
-**Booking Process:**
-1. Login with your credentials
-2. Specify your origin and destination OR choose from available routes
-3. Select traveller type (adult/child)
-4. Confirm booking"""
-        return help_text
-    
-    # Booking flow - Enhanced with location intelligence
-    if any(word in message for word in ["book", "reserve", "buy", "ticket"]):
-        if not st.session_state.chat_user_authenticated:
-            return "🔐 Oops! Looks like you need to log in first to book tickets.\n\n👋 No worries - it's super easy!\nJust type: **login username password**\n\nFor example: login john mypassword123\n\n✨ Once you're logged in, I'll help you find and book the perfect ticket!"
-        
-        # Extract locations from message
-        origin, destination = extract_locations_from_message(message)
-        
-        if origin and destination:
-            # User specified both origin and destination
-            matching_routes = search_routes(origin, destination)
-            
-            if matching_routes:
-                # Routes exist - show available options
-                response = f"✈️ Great! I found routes from {origin.title()} to {destination.title()}:\n\n"
-                for i, route in enumerate(matching_routes, 1):
-                    response += f"{i}. {route[1]} → {route[2]} ({route[5]})\n"
-                    response += f"   Price: ${route[4]:.2f} | Available seats: {route[6]}\n"
-                    response += f"   Departure: {route[3]}\n\n"
-                response += "Which route would you like to book? Say 'book [number]' to select."
-                
-                # Store matching routes for booking
-                st.session_state.booking_context = {
-                    'step': 'route_selection',
-                    'available_routes': matching_routes
-                }
-                return response
-            else:
-                # No routes exist - suggest admin contact with better alternatives
-                all_routes = get_all_routes()
-                response = f"🚫 Sorry, I couldn't find any routes from {origin.title()} to {destination.title()}.\n\n"
-                
-                # Show sample of available routes
-                if all_routes:
-                    response += "📋 **Current available routes include:**\n"
-                    for route in all_routes[:6]:  # Show first 6 routes
-                        response += f"• {route[1]} → {route[2]} ({route[5]})\n"
-                    if len(all_routes) > 6:
-                        response += f"• ... and {len(all_routes) - 6} more\n"
-                    response += "\n"
-                
-                response += "💡 **Options for you:**\n"
-                response += f"1. **Book existing route**: Say 'show routes' to see all options\n"
-                response += f"2. **Try nearby cities**: Maybe from Delhi or Bengaluru to {destination.title()}?\n"
-                response += f"3. **New route request**: Admin can add {origin.title()} to {destination.title()}\n\n"
-                response += f"🎯 **The {origin.title()} to {destination.title()} route can be added easily!**\n"
-                response += "Would you like to see available routes instead? Say 'show routes'."
-                return response
-        
-        # Extract route number if specified (improved detection)
-        route_num = None
-        if message.isdigit():
-            # If the entire message is just a number, treat it as route selection
-            route_num = int(message)
-        elif "book " in message:
-            parts = message.split()
-            for part in parts:
-                if part.isdigit():
-                    route_num = int(part)
-                    break
-        
-        # Handle route number selection
-        if route_num:
-            # Check if we're in route selection mode
-            if st.session_state.booking_context.get('step') == 'route_selection':
-                available_routes = st.session_state.booking_context.get('available_routes', [])
-                if 1 <= route_num <= len(available_routes):
-                    selected_route = available_routes[route_num - 1]
-                    st.session_state.booking_context = {
-                        'step': 'traveller_type',
-                        'route': selected_route
-                    }
-                    return f"🎫 Great! You selected:\n{selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type 'adult' for adult ticket\n- Type 'child' for child ticket (50% discount)"
-                else:
-                    return f"❌ Invalid route number. Please choose between 1 and {len(available_routes)}."
-            else:
-                # General route selection from all routes
-                routes = get_all_routes()
-                if 1 <= route_num <= len(routes):
-                    selected_route = routes[route_num - 1]
-                    st.session_state.booking_context = {
-                        'step': 'traveller_type',
-                        'route': selected_route
-                    }
-                    return f"🎫 Great! You selected:\n{selected_route[1]} → {selected_route[2]} ({selected_route[5]})\nPrice: ${selected_route[4]:.2f}\n\nPlease choose traveller type:\n- Type 'adult' for adult ticket\n- Type 'child' for child ticket (50% discount)"
-                else:
-                    return f"❌ Invalid route number. Please choose between 1 and {len(routes)}."
-        else:
-            # Show all available routes for booking
-            routes = get_all_routes()
-            if not routes:
-                return "🚫 No routes available at the moment. Please contact admin to add routes."
-            
-            response = "🎫 **Which route would you like to book?**\n\n"
-            for i, route in enumerate(routes, 1):
-                response += f"**{i}.** {route[1]} → {route[2]} ({route[5]}) - ${route[4]:.2f}\n"
-            response += "\n💡 **Tips:**\n"
-            response += "• Type the **route number** (like '11' for Hyd → Bengaluru)\n"
-            response += "• Say 'book from [origin] to [destination]' to search specific routes\n"
-            response += "• If your desired route doesn't exist, contact admin to add it"
-            return response
-    
-    # Handle traveller type selection
-    if st.session_state.booking_context.get('step') == 'traveller_type':
-        if message in ['adult', 'child']:
-            route = st.session_state.booking_context['route']
-            traveller_type = message
-            
-            # Get available discounts for this user
-            conn = sqlite3.connect('travel.db')
-            c = conn.cursor()
-            
-            # Get user loyalty points
-            c.execute('SELECT loyalty_points FROM users WHERE id=?', (st.session_state.chat_current_user_id,))
-            user_row = c.fetchone()
-            loyalty_points = user_row[0] if user_row else 0
-            
-            # Get available discounts
-            c.execute('''SELECT id, name, percentage, user_type, min_points 
-                         FROM discounts 
-                         WHERE (user_type=? OR user_type IS NULL OR user_type='') 
-                         AND min_points<=? 
-                         ORDER BY percentage DESC''', 
-                      (traveller_type, loyalty_points))
-            available_discounts = c.fetchall()
-            conn.close()
-            
-            if available_discounts:
-                # Show discount options
-                st.session_state.booking_context.update({
-                    'step': 'discount_selection',
-                    'traveller_type': traveller_type,
-                    'available_discounts': available_discounts
-                })
-                
-                response = f"🎉 **Great! You qualify for discounts!**\n\n"
-                response += f"✅ Traveller type: **{traveller_type.title()}**\n"
-                if traveller_type == 'child':
-                    response += f"🎈 **Child discount: 50% off** (automatically applied)\n\n"
-                
-                response += f"🎟️ **Choose your preferred discount:**\n\n"
-                for i, discount in enumerate(available_discounts, 1):
-                    discount_id, name, percentage, user_type, min_points = discount
-                    response += f"**{i}.** Apply `{name}` code - **Save {percentage}%!**"
-                    if user_type:
-                        response += f" (for {user_type})"
-                    if min_points > 0:
-                        response += f" (requires {min_points}+ points)"
-                    response += f"\n"
-                
-                response += f"\n**0.** Skip discounts - Use standard pricing\n\n"
-                response += f"� **Your loyalty points:** {loyalty_points}\n\n"
-                response += f"🎯 **Pick your choice:** Type any number from **0** to **{len(available_discounts)}**\n"
-                response += f"• **0** = No extra discount (pay standard price)\n"
-                response += f"• **1-{len(available_discounts)}** = Apply that specific discount code for maximum savings!"
-                
-                return response
-            else:
-                # No additional discounts available, proceed to pricing
-                route_id = route[0]
-                base_price = route[4]
-                final_price = calculate_final_price(base_price, traveller_type, st.session_state.chat_current_user_id)
-                
-                st.session_state.booking_context.update({
-                    'step': 'confirm',
-                    'traveller_type': traveller_type,
-                    'final_price': final_price,
-                    'selected_discount': None
-                })
-                
-                response = f"💰 **Price Calculation:**\n• Base price: ${base_price:.2f}\n• Traveller type: {traveller_type.title()}\n"
-                if traveller_type == 'child':
-                    response += f"• Child discount: 50% OFF\n"
-                response += f"• **Final price: ${final_price:.2f}**\n\n"
-                response += f"💡 No additional discounts available for your profile.\n\n"
-                response += f"✅ Type **'confirm'** to complete booking or **'cancel'** to abort."
-                
-                return response
-        else:
-            return "Please type **'adult'** or **'child'** to select traveller type.\n\n💡 **Reminder:**\n• Adult: Full price\n• Child: 50% discount\n• Additional discounts may be available based on your profile!"
-    
-    # Handle discount selection
-    if st.session_state.booking_context.get('step') == 'discount_selection':
-        if message.isdigit():
-            choice = int(message)
-            available_discounts = st.session_state.booking_context.get('available_discounts', [])
-            traveller_type = st.session_state.booking_context.get('traveller_type')
-            route = st.session_state.booking_context['route']
-            base_price = route[4]
-            
-            selected_discount = None
-            discount_info = "Standard pricing (no discount codes applied)"
-            
-            if choice == 0:
-                # No additional discount
-                selected_discount = None
-                discount_info = "Standard pricing (no discount codes applied)"
-            elif 1 <= choice <= len(available_discounts):
-                # Selected a discount
-                selected_discount = available_discounts[choice - 1]
-                discount_id, name, percentage, user_type, min_points = selected_discount
-                discount_info = f"You chose: {name} discount code ({percentage}% savings!)"
-            else:
-                return f"❌ Invalid choice. Please choose between 0 and {len(available_discounts)}."
-            
-            # Calculate final price with selected discount
-            if selected_discount:
-                # Apply the selected discount manually
-                price = base_price
-                # Apply demand factor first
-                conn = sqlite3.connect('travel.db')
-                c = conn.cursor()
-                c.execute('SELECT seats_available, seats_total FROM routes WHERE id=?', (route[0],))
-                route_info = c.fetchone()
-                conn.close()
-                
-                if route_info:
-                    seats_left, seats_total = route_info
-                    demand_factor = 1 + (1 - seats_left / seats_total) * 0.5
-                    price = base_price * demand_factor
-                
-                # Apply child discount
-                if traveller_type == 'child':
-                    price *= 0.5
-                
-                # Apply selected discount
-                _, name, percentage, user_type, min_points = selected_discount
-                price *= (1 - percentage / 100)
-                final_price = round(price, 2)
-            else:
-                # Use standard calculation (without additional discount codes)
-                final_price = calculate_final_price(base_price, traveller_type, st.session_state.chat_current_user_id)
-            
-            st.session_state.booking_context.update({
-                'step': 'confirm',
-                'traveller_type': traveller_type,
-                'final_price': final_price,
-                'selected_discount': selected_discount,
-                'discount_info': discount_info
-            })
-            
-            response = f"💰 **Final Price Calculation:**\n"
-            response += f"• Base price: ${base_price:.2f}\n"
-            response += f"• Traveller type: {traveller_type.title()}\n"
-            if traveller_type == 'child':
-                response += f"• Child discount: 50% OFF\n"
-            if selected_discount:
-                _, name, percentage, user_type, min_points = selected_discount
-                response += f"• Discount code: {name} ({percentage}% OFF)\n"
-            response += f"• **Final price: ${final_price:.2f}**\n\n"
-            response += f"🎟️ {discount_info}\n\n"
-            response += f"✅ Type **'confirm'** to complete booking or **'cancel'** to abort."
-            
-            return response
-        else:
-            available_discounts = st.session_state.booking_context.get('available_discounts', [])
-            return f"🤔 Please choose a valid option!\n\n**Your choices:**\n• Type **'0'** = Skip all discounts (standard price)\n• Type **'1' to '{len(available_discounts)}'** = Apply that specific discount code\n\n💡 **Example:** Type '1' to apply the first discount, '2' for the second, etc.\nOr type '0' if you prefer standard pricing without any discount codes."
-    
-    # Handle booking confirmation
-    if st.session_state.booking_context.get('step') == 'confirm':
-        if message == 'confirm':
-            route = st.session_state.booking_context['route']
-            traveller_type = st.session_state.booking_context['traveller_type']
-            selected_discount = st.session_state.booking_context.get('selected_discount')
-            
-            # Book the ticket
-            result = book_ticket(
-                st.session_state.chat_current_user_id,
-                route[0],
-                None,
-                traveller_type
-            )
-            
-            # Clear booking context and mark as completed
-            st.session_state.booking_context = {'step': 'booking_completed'}
-            
-            if 'error' in result:
-                return f"❌ Booking failed: {result['error']}"
-            else:
-                response = f"🎉 **Booking successful!**\n\n"
-                response += f"📋 **Booking Details:**\n"
-                response += f"• **Booking ID:** {result['booking_id']}\n"
-                response += f"• **Route:** {route[1]} → {route[2]}\n"
-                response += f"• **Transport:** {route[5]}\n"
-                response += f"• **Traveller type:** {traveller_type.title()}\n"
-                if selected_discount:
-                    _, name, percentage, user_type, min_points = selected_discount
-                    response += f"• **Discount applied:** {name} ({percentage}% OFF)\n"
-                response += f"• **Price paid:** ${result['price_paid']:.2f}\n"
-                response += f"• **Status:** {result['status']}\n\n"
-                response += f"🎫 **Thank you for your booking!**\n\n"
-                response += f"✅ **Your booking is complete!** You can now:\n"
-                response += f"• Type '**show my bookings**' to see all your trips\n"
-                response += f"• Type '**book ticket**' to book another trip\n"
-                response += f"• Type '**help**' for more options\n"
-                response += f"• Or simply continue chatting for assistance!\n\n"
-                response += f"🌟 **Enjoy your journey!**"
-                
-                return response
-        
-        elif message == 'cancel':
-            st.session_state.booking_context = {}
-            return "❌ Booking cancelled. How else can I help you?"
-        else:
-            return "Please type 'confirm' to complete booking or 'cancel' to abort."
-    
-    # Handle post-booking completion actions
-    if st.session_state.booking_context.get('step') == 'booking_completed':
-        # Clear the completion flag after first interaction
-        st.session_state.booking_context = {}
-        
-        # Handle the first post-booking action gracefully
-        if any(word in message for word in ["show my bookings", "my bookings", "booking history"]):
-            # Process the booking request normally - the existing logic will handle it
-            pass  # Fall through to booking queries handler
-        elif any(word in message for word in ["book ticket", "book", "new booking"]):
-            # Start new booking flow
-            st.session_state.booking_context = {'step': 'asking_origin'}
-            return "🌍 **Great! Let's book another trip!**\n\n🏠 **Where will you be traveling from?**\nPlease tell me your origin city (starting point):\n\nFor example:\n• 'Delhi'\n• 'Mumbai' \n• 'Vijayawada'\n• 'Chennai'\n\nWhat's your starting city?"
-        elif any(word in message for word in ["help"]):
-            # Fall through to help handler
-            pass
-        elif any(word in message for word in ["hello", "hi", "thank you", "thanks"]):
-            return f"😊 **You're very welcome, {st.session_state.chat_current_user}!**\n\nI'm glad I could help you complete your booking. Feel free to ask if you need anything else - I'm always here to assist with your travel needs!\n\n✈️ **Safe travels!**"
-        else:
-            # For any other message, provide helpful guidance
-            return f"👋 **Thanks for using our booking system, {st.session_state.chat_current_user}!**\n\nYour booking was successful. If you need anything else:\n\n• Type '**show my bookings**' to see all your trips\n• Type '**book ticket**' to book another trip\n• Type '**help**' for more options\n\nWhat would you like to do next?"
-    
-    # Price inquiry
-    if any(word in message for word in ["price", "cost", "how much"]):
-        return "💰 Ticket prices depend on:\n- Route and destination\n- Traveller type (child = 50% discount)\n- Seat availability (dynamic pricing)\n- Your loyalty points\n\nTo see exact prices, use 'show routes' or start booking with 'book ticket'."
-    
-    # Handle total price queries
-    if any(word in message for word in ["total price", "total cost", "total spending", "how much spent"]):
-        if not st.session_state.chat_user_authenticated:
-            return "🔐 Please log in first to view spending information.\n\nType 'login' to get started!"
-        
-        # Extract username if specified, otherwise use current user
-        import re
-        username_match = re.search(r'(?:for|of|user)\s+(\w+)', message)
-        if username_match:
-            requested_user = username_match.group(1)
-        else:
-            requested_user = st.session_state.chat_current_user
-        
-        try:
-            # Import the agent if not already available
-            if 'agent' not in st.session_state or st.session_state.agent is None:
-                from agent_repl import TravelBookingAgent
-                st.session_state.agent = TravelBookingAgent()
-            
-            # Capture REPL output
-            with capture_stdout() as captured:
-                result = st.session_state.agent.process_command(f'total price for user {requested_user}', 'local')
-                agent_output = captured.getvalue()
-            
-            if agent_output.strip():
-                return f"💰 **Total Spending Analysis for {requested_user.title()}:**\n\n```\n{agent_output.strip()}\n```\n\n💡 Want to see individual bookings? Ask 'show bookings for {requested_user}'"
-            else:
-                return f"❌ No spending information found for {requested_user}."
-                
-        except Exception as e:
-            return f"❌ Error calculating total spending: {str(e)}\n\nPlease try again or contact support."
-    
-    # Greeting (enhanced and more welcoming)
-    if any(word in message for word in ["hello", "hi", "hey", "good morning", "good afternoon", "good evening"]):
-        if st.session_state.chat_user_authenticated:
-            return f"Hello again, {st.session_state.chat_current_user}! 😊\n\n🌍 **What would you like to do today?**\n\n**Choose an option:**\n1️⃣ **Book from existing routes** - See available flights and book\n2️⃣ **Add new route** - Request a new route to be added\n3️⃣ **Check my bookings** - View your booking history\n\nJust type **'1'**, **'2'**, **'3'** or describe what you need!"
-        else:
-            return "👋 **Hello! Welcome to the Travel Booking System!** ✈️\n\nI'm your friendly travel assistant and I'm here to help you:\n• 🎫 **Book tickets** to amazing destinations\n• � **Add new routes** based on your needs\n• 💰 **Get best prices** with automatic discounts\n• 📋 **Manage bookings** easily\n\n🔐 **Ready to start? Please log in first:**\n\nJust say **'login'** and I'll guide you step by step!"
-    
-    # Default response (more helpful and friendly)
-    return "🤔 I'm not quite sure what you're looking for, but I'm here to help!\n\n✨ **Here are some things you can try:**\n• Say '**hello**' for a warm welcome\n• Type '**login username password**' to sign in\n• Say '**show routes**' to see available flights\n• Ask '**help**' for detailed options\n• Try '**book from [city] to [city]**' to find tickets\n\n💬 Feel free to ask me anything about travel booking - I'm here to make your journey smooth!"
+def process_booking_chat(message):
+    """Process chat messages for complete booking flow
+    
+    The turn reads the session from the session store and writes it back,
+    so whichever app process serves the next message carries on from here.
+    Both the message and the reply are added to the chat history.
+    """
+    if st.session_state.get("perf_panel"):
+        # Timed for the admin performance panel
+        with get_perf_stats().turn(perf_tab_id(), st.session_state.booking_context.get('step')) as turn:
+            reply = chat_turn(message, turn)
+        st.session_state.perf_last_turn = turn
+        return reply
+    return chat_turn(message)
+
+def chat_turn(message, turn=None):
+    """One exchange, read from and written back to the session store"""
+    load_chat_session()
+    login = (st.session_state.chat_user_authenticated, st.session_state.chat_current_user_id)
+    st.session_state.chat_messages.append({"role": "user", "content": message})
+    with turn.timing('respond_ms') if turn is not None else nullcontext():
+        reply = get_chat_flow().respond(st.session_state, message)
+    st.session_state.chat_messages.append({"role": "assistant", "content": reply})
+    if (st.session_state.chat_user_authenticated, st.session_state.chat_current_user_id) != login:
+        rotate_chat_session()
+    else:
+        save_chat_session()
+    return reply
 
 
 # REPL Interface (like agent_repl.py)
@@ -1601,13 +860,14 @@ def repl_interface():
     # Display previous REPL output
     if st.session_state.repl_output:
         st.markdown("### 📜 Previous Output:")
-        for i, output in enumerate(st.session_state.repl_output[-5:]):  # Show last 5 outputs
+        for i, output in enumerate(visible_history(st.session_state.repl_output, "repl_output", page=5)):
             if output.startswith("Command:"):
                 st.markdown(f'<div class="command-input">🔸 {output}</div>', unsafe_allow_html=True)
             elif output.startswith("Output:"):
                 # Format the output content
-                formatted_output = output.replace("Output:\n", "").strip()
+                formatted_output, rest = split_preview(output.replace("Output:\n", "").strip())
                 st.markdown(f'<div class="repl-output">📊 REPL Result:\n\n{formatted_output}</div>', unsafe_allow_html=True)
+                render_collapsed_rest(rest)
             elif output.startswith("Error:"):
                 st.markdown(f'<div class="command-output" style="background: linear-gradient(135deg, #ffebee, #ffcdd2); color: #c62828; border-color: #f44336;">❌ {output}</div>', unsafe_allow_html=True)
     
@@ -1618,68 +878,19 @@ def repl_interface():
         if command:
             with st.spinner("🔄 Processing command..."):
                 try:
-                    # Capture the agent's output
-                    with capture_stdout() as captured:
-                        result = st.session_state.agent.process_command(command, 'local')
-                        agent_output = captured.getvalue()
+                    # Display output with enhanced formatting, bookings as they are priced
+                    st.markdown(f'<div class="command-input">🔸 Command: {command}</div>', unsafe_allow_html=True)
+                    result = run_repl_command(command)
+                    
+                    # Store output in session state
+                    st.session_state.repl_output.append(f"Command: {command}")
+                    st.session_state.repl_output.append(f"Output:\n{format_result(result)}")
                     
-                    if agent_output.strip():
-                        # Store output in session state
-                        st.session_state.repl_output.append(f"Command: {command}")
-                        st.session_state.repl_output.append(f"Output:\n{agent_output}")
-                        
-                        # Display output with enhanced formatting
-                        st.markdown(f'<div class="command-input">🔸 Command: {command}</div>', unsafe_allow_html=True)
-                        
-                        # Format the agent output for better readability with booking separation
-                        formatted_output = agent_output.strip()
-                        
-                        # Enhanced formatting for booking details
-                        if "Booking ID:" in formatted_output:
-                            # Split by booking entries and format each one
-                            lines = formatted_output.split('\n')
-                            enhanced_output = ""
-                            current_booking = ""
-                            
-                            for line in lines:
-                                if line.strip().startswith("Booking ID:"):
-                                    # Start new booking entry
-                                    if current_booking:
-                                        enhanced_output += f'<div class="booking-entry">🎫 BOOKING DETAILS:\n{current_booking}</div>\n\n'
-                                    current_booking = line + "\n"
-                                elif current_booking and line.strip():
-                                    # Add to current booking
-                                    if "price" in line.lower() or "$" in line:
-                                        current_booking += f'💰 {line}\n'
-                                    elif "route:" in line.lower():
-                                        current_booking += f'🛤️ {line}\n'
-                                    elif "time:" in line.lower():
-                                        current_booking += f'⏰ {line}\n'
-                                    elif "status:" in line.lower():
-                                        current_booking += f'✅ {line}\n'
-                                    else:
-                                        current_booking += f'{line}\n'
-                                elif not current_booking and line.strip():
-                                    # Regular output (not booking details)
-                                    enhanced_output += line + "\n"
-                            
-                            # Add the last booking if exists
-                            if current_booking:
-                                enhanced_output += f'<div class="booking-entry">🎫 BOOKING DETAILS:\n{current_booking}</div>\n'
-                            
-                            st.markdown(f'<div class="repl-output">📊 REPL Result:\n\n{enhanced_output}</div>', unsafe_allow_html=True)
-                        else:
-                            # Regular formatting for non-booking output
-                            st.markdown(f'<div class="repl-output">📊 REPL Result:\n\n{formatted_output}</div>', unsafe_allow_html=True)
-                        
-                        # Add success indicator
-                        st.success("✅ Command executed successfully!")
-                    else:
-                        st.error("❌ No output generated. Please check your command.")
+                    # Add success indicator
+                    st.success("✅ Command executed successfully!")
                 
                 except Exception as e:
                     error_msg = f"Error: {str(e)}"
-                    st.markdown(f'<div class="command-input">🔸 Command: {command}</div>', unsafe_allow_html=True)
                     st.markdown(f'<div class="command-output" style="background: linear-gradient(135deg, #ffebee, #ffcdd2); color: #c62828; border-color: #f44336;">❌ Error: {error_msg}</div>', unsafe_allow_html=True)
                     st.session_state.repl_output.append(f"Command: {command}")
                     st.session_state.repl_output.append(f"Error: {error_msg}")
@@ -1697,27 +908,24 @@ def main():
         welcome_msg = "👋 Hello! Welcome to your Travel Booking Assistant! ✈️\n\nI'm here to help you find and book the perfect tickets for your journey. To get started, just say **'hello'** and I'll guide you through everything!\n\n✨ Ready to explore the world together?"
         st.session_state.chat_messages.append({"role": "assistant", "content": welcome_msg})
     
-    # Display chat messages
-    for message in st.session_state.chat_messages:
-        if message["role"] == "user":
-            with st.chat_message("user"):
-                st.write(message["content"])
-        else:
-            with st.chat_message("assistant"):
-                st.write(message["content"])
+    # Display the latest chat messages; long replies are collapsed
+    render_started = time.perf_counter()
+    for message in visible_history(st.session_state.chat_messages, "chat_messages"):
+        content, rest = split_preview(message["content"])
+        with st.chat_message("user" if message["role"] == "user" else "assistant"):
+            st.write(content)
+            render_collapsed_rest(rest)
+    note_render_time(render_started)
+    
+    # Reports running in the background for this session
+    render_report_jobs()
     
     # Chat input
     user_input = st.chat_input("Type your message here...")
     
     if user_input:
-        # Add user message
-        st.session_state.chat_messages.append({"role": "user", "content": user_input})
-        
-        # Process and get response
-        response = process_booking_chat(user_input)
-        
-        # Add assistant response
-        st.session_state.chat_messages.append({"role": "assistant", "content": response})
+        # Add the message and the assistant's response to the chat
+        process_booking_chat(user_input)
         
         st.rerun()
     
@@ -1733,6 +941,7 @@ def main():
                 st.session_state.current_user = None
                 st.session_state.current_user_id = None
                 st.session_state.booking_context = {}
+                rotate_chat_session()
                 st.rerun()
         else:
             st.info("Login to book tickets")
@@ -1742,21 +951,21 @@ def main():
         # Quick actions
         st.subheader("Quick Actions")
         if st.button("Show All Routes"):
-            st.session_state.chat_messages.append({"role": "user", "content": "show routes"})
-            response = process_booking_chat("show routes")
-            st.session_state.chat_messages.append({"role": "assistant", "content": response})
+            process_booking_chat("show routes")
             st.rerun()
         
         if st.button("Help"):
-            st.session_state.chat_messages.append({"role": "user", "content": "help"})
-            response = process_booking_chat("help")
-            st.session_state.chat_messages.append({"role": "assistant", "content": response})
+            process_booking_chat("help")
             st.rerun()
         
         if st.button("Clear Chat"):
-            st.session_state.chat_messages = []
+            st.session_state.chat_messages.clear()
+            st.session_state.pop("chat_messages_window", None)
             st.session_state.booking_context = {}
+            save_chat_session()
             st.rerun()
+        
+        render_perf_panel()
 
 if __name__ == "__main__":
     main()
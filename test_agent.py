@@ -38,3 +38,785 @@ def test_agent():
 
 if __name__ == "__main__":
     test_agent()
+
+
+def test_batch_mode_preserves_order():
+    """Batch results come back one JSON line per command, in input order"""
+    import io
+    import json
+    from agent_repl import run_batch
+    from db import ConnectionPool
+
+    commands = ["show booking 1", "", "# skipped", "who owns booking 2", "help"] * 5
+    pool = ConnectionPool()
+    output = io.StringIO()
+    try:
+        count = run_batch(TravelBookingAgent(pool=pool), commands, output, workers=4, chunk_size=3)
+    finally:
+        pool.close_all()
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert count == len(records) == 15
+    assert [r['command'] for r in records] == [c for c in commands if c and not c.startswith('#')]
+    assert records[0]['result']['type'] == 'BookingBreakdown'
+
+
+def test_execution_limits_cut_off_commands():
+    """Row caps trim long ID lists; a command past its time limit is reported, not run to the end"""
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    import time
+    from agent_results import AgentMessage
+    from db import ConnectionPool
+    from sandbox import ExecutionLimits
+
+    agent = TravelBookingAgent(limits=ExecutionLimits(max_rows=2))
+    result = agent.process_command("explain bookings 1, 2, 3, 4", structured=True)
+    assert [b.booking_id for b in result.bookings] == [1, 2]
+    assert result.skipped == 2
+
+    # Thousands of bookings priced one by one run far past a realistic limit
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'travel.db')
+        shutil.copy('travel.db', db_path)
+        conn = sqlite3.connect(db_path)
+        user_id = conn.execute("SELECT id FROM users WHERE username='nikitha'").fetchone()[0]
+        route_id = conn.execute("SELECT id FROM routes LIMIT 1").fetchone()[0]
+        conn.executemany('INSERT INTO bookings (user_id, route_id, price_paid, booking_time, status) '
+                         'VALUES (?, ?, 100.0, ?, ?)', [(user_id, route_id, '2024-01-01T00:00:00', 'confirmed')] * 5000)
+        conn.commit()
+        conn.close()
+        pool = ConnectionPool(db_path)
+        try:
+            agent = TravelBookingAgent(pool=pool, limits=ExecutionLimits(timeout=0.25), use_cache=False)
+            started = time.perf_counter()
+            result = agent.process_command("show bookings for nikitha", structured=True)
+            assert isinstance(result, AgentMessage) and result.error
+            assert "time limit" in result.text and time.perf_counter() - started < 2
+        finally:
+            pool.close_all()
+
+
+def test_system_report_matches_per_booking_pricing():
+    """The single-scan system report prices every booking exactly like price_booking"""
+    import sqlite3
+    from agent_commands import system_report, booking_details
+
+    conn = sqlite3.connect('travel.db')
+    try:
+        report = system_report(conn)
+        for user in report.users:
+            for booking in user.bookings:
+                assert booking == booking_details(booking.booking_id, conn)
+        assert [user.username for user in report.users] == sorted(user.username for user in report.users)
+    finally:
+        conn.close()
+
+
+def test_user_total_matches_per_booking_sum():
+    """The GROUP BY totals equal adding up each booking's price one by one, to the cent"""
+    import sqlite3
+    from agent_commands import user_total, user_bookings
+
+    conn = sqlite3.connect('travel.db')
+    try:
+        for (username,) in conn.execute("SELECT username FROM users ORDER BY id").fetchall():
+            detailed = user_bookings(username, conn)
+            totals = user_total(username, conn)
+            if len(totals.usernames) == 1:
+                assert totals.route_totals == {route: round(total, 2) for route, total in detailed.route_totals.items()}
+                assert list(totals.route_totals) == list(detailed.route_totals)
+                assert totals.grand_total == round(detailed.total, 2)
+    finally:
+        conn.close()
+
+
+def test_bookings_pages_cover_every_booking_once():
+    """Walking next_after cursors visits each booking once, in ID order"""
+    from agent_commands import bookings_page, list_all_bookings
+
+    expected = [row.booking_id for row in list_all_bookings().rows]
+    seen = []
+    listing = bookings_page(page_size=6)
+    while True:
+        seen += [row.booking_id for row in listing.rows]
+        if listing.next_after is None:
+            break
+        listing = bookings_page(after_id=listing.next_after, page_size=6)
+    assert seen == expected
+    assert [row.booking_id for row in bookings_page(2, page_size=6).rows] == expected[6:12]
+
+
+def test_user_directory_matches_sql_lookups():
+    """Directory lookups agree with the SQL queries they replace"""
+    import sqlite3
+    from user_directory import UserDirectory
+
+    directory = UserDirectory('travel.db')
+    conn = sqlite3.connect('travel.db')
+    try:
+        for (username,) in conn.execute("SELECT username FROM users").fetchall():
+            for name in (username, username.upper(), username.lower()):
+                expected = conn.execute("SELECT id, username FROM users WHERE lower(username) = lower(?) ORDER BY id",
+                                        (name,)).fetchall()
+                assert directory.matching(name) == expected
+                exact = conn.execute("SELECT id FROM users WHERE username = ?", (name,)).fetchone()
+                assert directory.user_id(name) == (exact[0] if exact else None)
+        assert 'nikitha' in directory.suggestions('nik')
+    finally:
+        conn.close()
+        directory.close()
+
+
+def test_tracer_records_stages_and_sql():
+    """An agent with a tracer records every pipeline stage and the SQL it ran"""
+    from tracer import Tracer
+
+    tracer = Tracer()
+    agent = TravelBookingAgent(tracer=tracer)
+    agent.process_command("who owns booking 3", structured=True)
+    names = [span.name for span in tracer.spans]
+    for stage in ('command', 'parse', 'generate', 'execute', 'sql'):
+        assert stage in names
+    command = next(span for span in tracer.spans if span.name == 'command')
+    assert all(span.parent_id is not None for span in tracer.spans if span is not command)
+    assert tracer.to_chrome()['traceEvents'][0]['ph'] == 'X'
+
+
+def test_multiple_bookings_keeps_request_order_and_repeats():
+    """Set-based pricing returns the requested IDs in order, repeats and misses included"""
+    import sqlite3
+    from agent_commands import multiple_bookings, booking_details
+
+    ids = [5, 3, 99999, 3, 1]
+    conn = sqlite3.connect('travel.db')
+    try:
+        result = multiple_bookings(ids, conn)
+        expected = [booking_details(bid, conn) for bid in ids]
+    finally:
+        conn.close()
+    assert result.bookings == expected
+    assert result.total == sum(b.final_price or 0 for b in expected)
+
+
+def test_result_cache_reuses_results_until_the_database_changes():
+    """Repeated commands hit the cache; any committed write invalidates it"""
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    from db import ConnectionPool
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'travel.db')
+        shutil.copy('travel.db', db_path)
+        pool = ConnectionPool(db_path)
+        agent = TravelBookingAgent(pool=pool)
+        try:
+            first = agent.process_command("total price for user teja", structured=True)
+            hit = agent.process_command("total price for user teja", structured=True)
+            assert hit == first and hit is not first
+            # Each caller gets its own copy, so changing one cannot change the cache
+            expected = (first.booking_count, dict(first.route_totals))
+            first.booking_count = -1
+            hit.route_totals.clear()
+            again = agent.process_command("total price for user teja", structured=True)
+            assert (again.booking_count, again.route_totals) == expected
+            first.booking_count = expected[0]
+            conn = sqlite3.connect(db_path)
+            conn.execute("INSERT INTO bookings (user_id, route_id, seat_number, price_paid, booking_time, status) "
+                         "VALUES (9, 1, '1', 1.0, '2025-01-01T00:00:00', 'confirmed')")
+            conn.commit()
+            conn.close()
+            again = agent.process_command("total price for user teja", structured=True)
+            assert again is not first and again.booking_count == first.booking_count + 1
+            assert agent.cache.stats()['hits'] == 2 and agent.cache.stats()['invalidations'] == 1
+        finally:
+            agent.cache.close()
+            pool.close_all()
+
+
+def test_progress_and_cancellation():
+    """Long commands report progress and stop once their token is cancelled"""
+    from agent_results import AgentMessage
+    from sandbox import CancellationToken
+
+    agent = TravelBookingAgent(use_cache=False)
+    seen = []
+    report = agent.process_command("provide all bookings", structured=True,
+                                   progress=lambda done, total: seen.append((done, total)))
+    assert seen and seen[-1][0] == seen[-1][1] == sum(len(user.bookings) for user in report.users)
+
+    token = CancellationToken()
+    token.cancel()
+    result = agent.process_command("provide all bookings", structured=True, cancel=token)
+    assert isinstance(result, AgentMessage) and result.error and "cancelled" in result.text
+
+
+def test_explain_plan():
+    """'profile ...' lists the SQL a command runs and flags repeated queries"""
+    from agent_results import CommandProfile
+
+    agent = TravelBookingAgent(use_cache=False)
+    profile = agent.process_command("profile show bookings for nikitha", structured=True)
+    assert isinstance(profile, CommandProfile) and profile.intent == 'booking_by_user'
+    assert profile.error is None and profile.statements
+    assert any(s.n_plus_one for s in profile.statements)
+    assert all(s.plan for s in profile.statements if s.sql.startswith('SELECT'))
+
+    report = agent.process_command("explain plan show all bookings", structured=True)
+    assert report.intent == 'provide_all_bookings' and not any(s.n_plus_one for s in report.statements)
+
+
+def test_scheduler():
+    """Commands are classified from the intent table and run through the scheduler"""
+    from scheduler import AgentScheduler, classify, INTERACTIVE, BULK
+
+    agent = TravelBookingAgent(use_cache=False)
+    assert classify(agent, "show booking 5") == INTERACTIVE
+    assert classify(agent, "provide all bookings") == BULK
+    assert classify(agent, "profile show booking 5") == BULK
+
+    scheduler = AgentScheduler()
+    try:
+        futures = [scheduler.submit(agent, command, structured=True)
+                   for command in ["provide all bookings", "show booking 5", "total price for user nikitha"]]
+        results = [future.result(timeout=10) for future in futures]
+        assert results[1].final_price == agent.process_command("show booking 5", structured=True).final_price
+        stats = scheduler.stats()
+        assert stats[BULK]['completed'] == 1 and stats[INTERACTIVE]['completed'] == 2
+    finally:
+        scheduler.shutdown()
+
+
+def test_route_catalog_matches_routes_table():
+    """Cached routes and searches match SQL until invalidated, then reload"""
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    from route_catalog import get_route_catalog, invalidate_routes
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'travel.db')
+        shutil.copy('travel.db', db_path)
+        catalog = get_route_catalog(db_path)
+        conn = sqlite3.connect(db_path)
+        columns = 'id, origin, destination, departure_time, base_price, transport_type, seats_available'
+        assert list(catalog.routes()) == conn.execute(f'SELECT {columns} FROM routes').fetchall()
+        assert catalog.search('Vijay', None) == conn.execute(
+            f'SELECT {columns} FROM routes WHERE LOWER(origin) LIKE ?', ('%vijay%',)).fetchall()
+
+        route_id = catalog.routes()[0].id
+        conn.execute('UPDATE routes SET seats_available = seats_available + 5 WHERE id=?', (route_id,))
+        conn.commit()
+        loads = catalog.loads
+        invalidate_routes(db_path)
+        assert catalog.get(route_id).seats_available == conn.execute(
+            'SELECT seats_available FROM routes WHERE id=?', (route_id,)).fetchone()[0]
+        assert catalog.loads == loads + 1
+
+        added = catalog.add('Pune', 'Goa', '2025-01-15 10:00:00', 300.0, 'bus', 40)
+        assert catalog.get(added.id) == added and catalog.loads == loads + 2
+        assert conn.execute('SELECT seats_total FROM routes WHERE id=?', (added.id,)).fetchone() == (40,)
+        conn.close()
+
+
+def test_capture_output_is_per_thread():
+    """Concurrent text-mode commands each capture only their own output, also through the scheduler"""
+    from concurrent.futures import ThreadPoolExecutor
+    from output_capture import capture_output
+    from scheduler import AgentScheduler
+
+    agent = TravelBookingAgent(use_cache=False)
+    commands = ["show booking 1", "who owns booking 5", "total price for user teja", "show booking 3"] * 5
+
+    def run(command):
+        with capture_output() as out:
+            agent.process_command(command)
+        return out.getvalue()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        outputs = list(pool.map(run, commands))
+    for command, output in zip(commands, outputs):
+        assert output == run(command)
+    assert outputs[0] != outputs[3] and "Booking ID: 1" in outputs[0]
+
+    # A capture around the scheduler follows the command onto its worker thread
+    scheduler = AgentScheduler()
+    try:
+        with capture_output() as out:
+            scheduler.run(agent, "show booking 1")
+        assert out.getvalue() == outputs[0]
+    finally:
+        scheduler.shutdown()
+
+
+
+def test_shared_agent_takes_the_user_per_command():
+    """One agent serves every session; "my bookings" uses the caller's user"""
+    from agent_results import AgentMessage, UserBookings
+
+    agent = TravelBookingAgent()
+    assert isinstance(agent.process_command("get my bookings", structured=True), AgentMessage)
+    mine = agent.process_command("get my bookings", structured=True, user='teja')
+    assert isinstance(mine, UserBookings) and mine.username == 'teja'
+    # Same generated call as asking by name, so sessions share the cached result (each gets a copy)
+    hits = agent.cache.hits
+    assert agent.process_command("show bookings for teja", structured=True) == mine
+    assert agent.cache.hits == hits + 1
+
+
+def test_chat_flow_runs_without_streamlit():
+    """The booking chat is a table of handlers driven by one keyword scan"""
+    from chat_flow import ChatFlow, ChatServices, ChatSession, KeywordMatcher, DEFAULT_REPLY
+    from route_catalog import Route
+
+    matcher = KeywordMatcher(["book", "book it", "ok", "hi", "his"])
+    # Same answer as `phrase in text` for each phrase, overlaps included
+    assert matcher.scan("this book it") == {"book", "book it", "ok", "hi", "his"}
+
+    route = Route(1, 'Delhi', 'Mumbai', '2025-01-15 10:00:00', 100.0, 'flight', 10)
+    unused = lambda *args: None
+    added = []
+    # Every database read and write goes through the services
+    flow = ChatFlow(ChatServices(
+        authenticate_user=lambda username, password: 1, user_exists=lambda username: username == 'teja',
+        available_discounts=lambda user_id, traveller_type: (0, [(1, 'SAVE10', 10.0, None, 0)]),
+        add_route=lambda *fields: added.append(fields) or route, quote_price=unused, book_quote=unused,
+        get_all_routes=lambda: [route], search_routes=lambda origin, destination: [route],
+        extract_locations=lambda message: (None, None), parse_command=lambda message: (None, {}),
+        run_agent=unused, start_report=unused, render_system_report=unused,
+        render_user_bookings=unused, render_user_total=unused, render_top_users=unused,
+        render_booking_listing=unused,
+    ))
+    session = ChatSession(chat_user_authenticated=True, chat_current_user='teja', chat_current_user_id=1)
+
+    assert flow.respond(session, "Login").startswith("👋")
+    assert session.booking_context == {'step': 'asking_username'}
+    session.booking_context = {'step': 'asking_origin'}
+    flow.respond(session, "delhi")
+    assert session.booking_context == {'step': 'asking_destination', 'origin': 'Delhi'}
+    assert "1 route(s)" in flow.respond(session, "mumbai")
+    assert session.booking_context['step'] == 'route_selection'
+    flow.respond(session, "1")
+    assert session.booking_context == {'step': 'traveller_type', 'route': route}
+    flow.respond(session, "adult")
+    assert session.booking_context['step'] == 'discount_selection'
+    assert session.booking_context['available_discounts'] == [(1, 'SAVE10', 10.0, None, 0)]
+
+    session.booking_context = {'step': 'new_route_seats', 'new_route_origin': 'Delhi', 'new_route_destination': 'Mumbai',
+                               'new_route_transport': 'flight', 'new_route_price': 100.0}
+    assert "NEW ROUTE ADDED" in flow.respond(session, "10")
+    assert added == [('Delhi', 'Mumbai', '2025-01-15 10:00:00', 100.0, 'flight', 10)]
+    assert session.booking_context['new_route_info'] == route
+
+    session = ChatSession(booking_context={'step': 'asking_password', 'username': 'teja'})
+    assert "Welcome back, teja" in flow.respond(session, "secret")
+    assert session.chat_user_authenticated and session.chat_current_user_id == 1
+    assert flow.respond(ChatSession(), "maybe later") == DEFAULT_REPLY
+
+
+def test_history_buffer_keeps_order_and_bounds_live_entries():
+    """Older history is compressed away but still pages back in order"""
+    from chat_history import HistoryBuffer, split_preview
+
+    history = HistoryBuffer(live_limit=10, chunk_size=4)
+    entries = [{"role": "user", "content": f"message {n}"} for n in range(57)]
+    for entry in entries:
+        history.append(entry)
+    assert len(history) == 57 and history.stats()['live'] < 14
+    assert list(history) == entries
+    for count in (1, 10, 13, 30, 57, 100):
+        assert history.tail(count) == entries[-count:]
+
+    history.clear()
+    assert not history and history.tail(5) == []
+
+    report = "\n".join(f"line {n}" for n in range(500))
+    preview, rest = split_preview(report, limit=100)
+    assert len(preview) <= 100 and preview + "\n" + rest == report
+    assert split_preview("short") == ("short", None)
+
+
+def test_quote_is_the_price_booked():
+    """A quote books once, at its own price, and only for its own user"""
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    from dataclasses import replace
+    from quotes import QuoteBook, encode_token
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'travel.db')
+        shutil.copy('travel.db', db_path)
+        conn = sqlite3.connect(db_path)
+        route_id, seats = conn.execute(
+            'SELECT id, seats_available FROM routes WHERE seats_available > 1 LIMIT 1').fetchone()
+        book = QuoteBook(db_path, secret=b'test secret')
+
+        quote = book.quote(1, route_id, 'child', discount=(None, 'Test', 20.0))
+        assert book.book(quote.token, 2).get('requote')
+        quote = book.quote(1, route_id, 'child', discount=(None, 'Test', 20.0))
+        # The token is the quote: another process with the same secret books it
+        result = QuoteBook(db_path, secret=b'test secret').book(quote.token, 1)
+        assert result['price_paid'] == quote.final_price
+        assert conn.execute('SELECT price_paid FROM bookings WHERE id=?',
+                            (result['booking_id'],)).fetchone()[0] == quote.final_price
+        assert conn.execute('SELECT seats_available FROM routes WHERE id=?', (route_id,)).fetchone()[0] == seats - 1
+        assert book.book(quote.token, 1)['error'].startswith('Quote already used')
+
+        quote = book.quote(1, route_id)
+        # A token edited to a cheaper price, or signed with another key, is refused
+        forged = encode_token(b'test secret', replace(quote, final_price=1.0)).split('.')[0]
+        assert book.book(forged + '.' + quote.token.split('.')[1], 1)['error'] == 'Invalid quote'
+        assert QuoteBook(db_path, secret=b'other').book(quote.token, 1)['error'] == 'Invalid quote'
+        stale = QuoteBook(db_path, ttl=-1, secret=b'test secret')
+        assert stale.book(stale.quote(1, route_id).token, 1)['error'].startswith('Quote expired')
+        conn.close()
+
+
+def test_job_runner_runs_reports_in_the_background():
+    """Jobs return an id at once, share a running duplicate and keep results"""
+    import threading
+    import time
+    from jobs import JobRunner, DONE, RUNNING
+    from scheduler import AgentScheduler
+
+    release = threading.Event()
+
+    class SlowAgent:
+        def parse_natural_language(self, command):
+            return None, {}
+
+        def process_command(self, command, progress=None, cancel=None):
+            progress(1, 2)
+            release.wait(5)
+            return command.upper()
+
+    scheduler = AgentScheduler()
+    runner = JobRunner(scheduler)
+    agent = SlowAgent()
+    job_id = runner.submit(agent, "report", label="Report", owner="session A")
+    assert runner.submit(agent, "report", owner="session B") == job_id
+    job = runner.get(job_id)
+    deadline = time.time() + 5
+    while job.progress != (1, 2) and time.time() < deadline:
+        time.sleep(0.01)
+    assert job.status == RUNNING and job.fraction == 0.5
+
+    # A's cancel only detaches A; B still gets the report
+    assert not runner.cancel(job_id, "session A")
+    assert job.status == RUNNING and not job.cancel_token.cancelled
+    other = runner.submit(agent, "other report", owner="session C")
+    assert runner.cancel(other, "session C") and runner.get(other).cancel_token.cancelled
+
+    release.set()
+    job.future.result(5)
+    assert job.status == DONE and job.outcome() == ("REPORT", None)
+    assert runner.submit(agent, "report") != job_id
+    # The finished job is still there to show again
+    assert runner.get(job_id).outcome() == ("REPORT", None)
+    scheduler.shutdown()
+
+
+def test_booking_reports_emit_each_booking_as_it_is_priced():
+    """emit gets every booking of a report, in the order the record lists them"""
+    agent = TravelBookingAgent(use_cache=False)
+    for command in ("show bookings for nikitha", "provide all bookings", "explain bookings 3, 1, 3"):
+        emitted = []
+        result = agent.process_command(command, structured=True, emit=emitted.append)
+        listed = result.bookings if hasattr(result, 'bookings') else [b for u in result.users for b in u.bookings]
+        assert emitted and emitted == listed
+
+
+def test_session_store_survives_a_new_process():
+    """A chat session saved by one store is picked up by another on the same file"""
+    import tempfile
+    import os
+    from chat_flow import ChatSession, hold_for_login
+    from chat_history import HistoryBuffer
+    from sessions import SQLiteSessionStore
+
+    session = ChatSession(booking_context={'step': 'traveller_type', 'route': [3, 'Hyderabad', 'Delhi']},
+                          chat_user_authenticated=True, chat_current_user='nikitha', chat_current_user_id=1)
+    session.chat_messages = HistoryBuffer(live_limit=4, chunk_size=2)
+    for i in range(9):
+        session.chat_messages.append({"role": "user", "content": f"message {i}"})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sessions.db')
+        store = SQLiteSessionStore(path)
+        session_id = store.create()
+        store.save(session_id, session)
+        state = SQLiteSessionStore(path).load(session_id)
+        assert state['booking_context'] == session.booking_context
+        assert list(state['chat_messages']) == list(session.chat_messages)
+        assert state['chat_messages'].stats() == session.chat_messages.stats()
+
+        # The login is never stored, and made-up or rotated-away ids are not accepted
+        assert 'chat_user_authenticated' not in state and 'chat_current_user_id' not in state
+        store.save('chosen-by-attacker', session)
+        assert store.load('chosen-by-attacker') is None
+        new_id = store.rotate(session_id, session)
+        assert store.load(session_id) is None and store.load(new_id)['booking_context'] == session.booking_context
+
+        # A restored session is logged out: its booking waits for a new login
+        restored = ChatSession(booking_context=state['booking_context'])
+        assert hold_for_login(restored) and restored.booking_context['step'] == 'asking_username'
+        assert restored.booking_context['resume'] == session.booking_context
+
+
+def test_perf_stats_count_agent_work_of_open_turns_only():
+    """A timed turn gets the agent calls and SQL it causes, also through the scheduler and the chat flow's own lookups"""
+    from perf_stats import PerfStats, PerfTracer
+    from quotes import QuoteBook
+    from scheduler import AgentScheduler
+
+    agent = TravelBookingAgent(tracer=PerfTracer(), use_cache=False)
+    stats = PerfStats()
+    scheduler = AgentScheduler()
+    try:
+        with stats.turn('s1', 'asking_origin') as turn:
+            with turn.timing('respond_ms'):
+                agent.process_command("show bookings for nikitha", structured=True)
+                scheduler.run(agent, "show booking 1", structured=True)
+        assert turn.agent_calls == 2 and turn.sql_count > 0
+        assert 0 < turn.sql_ms <= turn.agent_ms <= turn.respond_ms <= turn.total_ms
+
+        counted = turn.sql_count
+        agent.process_command("show bookings for nikitha", structured=True)
+        assert turn.sql_count == counted and turn.agent_calls == 2
+        assert stats.recent('s1') == [turn] and stats.recent('other') == []
+        assert stats.summary()['turns'] == 1
+
+        # The chat flow's own lookups count too, on connections opened with db.connect()
+        quotes = QuoteBook(secret=b'test secret')
+        with stats.turn('s2', 'traveller_type') as turn:
+            quotes.discounts(1, 'adult')
+        assert turn.sql_count == 2 and turn.sql_ms > 0 and turn.agent_calls == 0
+        quotes.discounts(1, 'adult')
+        assert turn.sql_count == 2
+    finally:
+        scheduler.shutdown()
+
+
+def test_agent_server_routes_rpc_and_bounded_pool():
+    """Every REST route and JSON-RPC answer over HTTP; busy workers hold new connections back"""
+    import http.client
+    import json
+    import socket
+    import threading
+    import time
+    from agent_server import make_server
+
+    server = make_server(port=0, workers=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    def get(conn, path):
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    def post(conn, path, body):
+        conn.request('POST', path, body=body.encode('utf-8'), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None
+
+    first = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    second = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        assert get(first, '/health')[1]['status'] == 'ok'
+        status, page = get(first, '/bookings?size=2')
+        assert status == 200 and [r['booking_id'] for r in page['rows']] == [1, 2]
+        assert [r['booking_id'] for r in get(first, '/bookings?after=2&size=2')[1]['rows']] == [3, 4]
+        assert get(first, '/bookings/latest?n=2')[1]['type'] == 'BookingListing'
+        assert get(first, '/users/top?n=1')[1]['type'] == 'TopUsers'
+        assert get(first, '/bookings/1')[1]['booking_id'] == 1
+        assert get(first, '/bookings/1/owner')[1]['type'] == 'BookingOwner'
+        assert get(first, '/users/nikitha/bookings')[1]['username'] == 'nikitha'
+        assert get(first, '/users/nikitha/total')[1]['type'] == 'UserTotal'
+        assert get(first, '/nope')[0] == 404
+        assert post(first, '/command', '{"command": "show booking 1"}')[1]['result']['booking_id'] == 1
+
+        rpc = post(first, '/rpc', '{"jsonrpc": "2.0", "id": 7, "method": "booking_owner", "params": [1]}')[1]
+        assert rpc['id'] == 7 and rpc['result']['booking_id'] == 1
+        assert post(first, '/rpc', '{"jsonrpc": "2.0", "method": "booking_owner", "params": [1]}') == (204, None)
+        assert post(first, '/rpc', '{"jsonrpc": "2.0", "method": "no_such"}') == (204, None)
+        assert post(first, '/rpc', '{"jsonrpc": "2.0", "id": 8, "method": "no_such"}')[1]['error']['code'] == -32601
+        parse_error = post(first, '/rpc', '{not json')[1]
+        assert parse_error['id'] is None and parse_error['error']['code'] == -32700
+
+        # Both workers are now held by kept-alive connections; a third waits for one to close
+        assert get(second, '/health')[0] == 200
+        third = socket.create_connection(('127.0.0.1', port), timeout=0.3)
+        third.sendall(b'GET /health HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+        try:
+            third.recv(1)
+            assert False, "served beyond the worker pool"
+        except socket.timeout:
+            pass
+        first.close()
+        third.settimeout(5)
+        assert third.recv(64).startswith(b'HTTP/1.1 200')
+        third.close()
+    finally:
+        first.close()
+        server.shutdown()
+        # `second` is still idle in keep-alive; closing must not wait out its timeout
+        started = time.perf_counter()
+        server.server_close()
+        assert time.perf_counter() - started < 5
+        second.close()
+        server.agent.pool.close_all()
+
+
+def test_structured_records_match_text_mode():
+    """Structured records carry what text mode prints and returns, missing bookings included"""
+    import contextlib
+    import io
+    import sqlite3
+    from agent_results import BookingBreakdown, MissingBooking, MultipleBookings, format_result, result_to_dict, result_value
+    from fetch_and_calculate import compute_final_price, explain_booking, price_booking
+
+    conn = sqlite3.connect('travel.db')
+    try:
+        booking = price_booking(1, conn)
+        assert isinstance(booking, BookingBreakdown) and booking.booking_id == 1
+        assert compute_final_price(booking.base_price, booking.seats_total, booking.seats_left,
+                                   booking.traveller_type, booking.discount)[2] == booking.final_price
+        assert f"Final price paid: {booking.final_price}" in explain_booking(booking)
+        try:
+            price_booking(99999, conn)
+            assert False, "priced a booking that does not exist"
+        except LookupError as e:
+            assert str(e) == "No booking found with ID 99999"
+    finally:
+        conn.close()
+
+    agent = TravelBookingAgent(use_cache=False)
+    for command in ("show booking 1", "show booking 99999", "explain bookings 1, 99999",
+                    "total price for user nikitha", "show bookings for nikitha", "who booked booking 2"):
+        result = agent.process_command(command, structured=True)
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            value = agent.process_command(command)
+        assert value == result_value(result)
+        assert format_result(result) in printed.getvalue()
+        assert result_to_dict(result)['type'] == type(result).__name__
+
+    assert agent.process_command("show booking 1", structured=True) == booking
+    missing = agent.process_command("show booking 99999", structured=True)
+    assert missing == MissingBooking(99999, "No booking found with ID 99999") and result_value(missing) is None
+    both = agent.process_command("explain bookings 1, 99999", structured=True)
+    assert isinstance(both, MultipleBookings) and both.bookings == [booking, missing]
+    assert both.total == booking.final_price
+
+
+def test_latest_and_top_counts_stay_within_the_row_limit():
+    """Latest-N-bookings and top-N-users counts, from the agent and the server, are clamped to max_rows"""
+    import http.client
+    import json
+    import sqlite3
+    import threading
+    from agent_commands import user_bookings
+    from agent_server import make_server
+    from sandbox import ExecutionLimits
+
+    agent = TravelBookingAgent(limits=ExecutionLimits(max_rows=2), use_cache=False)
+    assert agent.parse_natural_language("show the latest 5 bookings") == ('latest_bookings', ('5',))
+    assert agent.parse_natural_language("top 3 users") == ('top_users', ('3',))
+
+    conn = sqlite3.connect('travel.db')
+    try:
+        newest = [row[0] for row in conn.execute("SELECT id FROM bookings ORDER BY id DESC LIMIT 2")]
+        latest = agent.process_command("latest 5 bookings", structured=True)
+        assert [row.booking_id for row in latest.rows] == newest and "LATEST 2" in latest.heading
+
+        top = agent.process_command("top 5 users", structured=True)
+        assert top.count == 2 and len(top.rows) == 2 and top.rows[0].total >= top.rows[1].total
+        for row in top.rows:
+            spent = user_bookings(row.username, conn)
+            assert row.total == round(spent.total, 2)
+            assert row.booking_count == sum(1 for b in spent.bookings if b.final_price)
+    finally:
+        conn.close()
+
+    server = make_server(port=0, workers=1)
+    server.agent.limits = ExecutionLimits(max_rows=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+
+    def get(path):
+        client.request('GET', path)
+        response = client.getresponse()
+        return response.status, json.loads(response.read())
+
+    try:
+        assert [row['booking_id'] for row in get('/bookings/latest?n=50')[1]['rows']] == newest
+        assert len(get('/bookings/latest?n=0')[1]['rows']) == 1
+        assert get('/users/top?n=50')[1]['count'] == 2
+        assert get('/users/top?n=-3')[1]['count'] == 1
+        assert get('/users/top?n=lots')[0] == 400
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+        server.agent.pool.close_all()
+
+
+def test_rpc_calls_get_the_command_limits():
+    """Agent functions called over JSON-RPC are capped and timed like natural-language commands"""
+    import http.client
+    import json
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    import threading
+    import time
+    from agent_server import make_server
+    from sandbox import ExecutionLimits
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'travel.db')
+        shutil.copy('travel.db', db_path)
+        conn = sqlite3.connect(db_path)
+        user_id = conn.execute("SELECT id FROM users WHERE username='nikitha'").fetchone()[0]
+        route_id = conn.execute("SELECT id FROM routes LIMIT 1").fetchone()[0]
+        conn.executemany('INSERT INTO bookings (user_id, route_id, price_paid, booking_time, status) '
+                         'VALUES (?, ?, 100.0, ?, ?)', [(user_id, route_id, '2024-01-01T00:00:00', 'confirmed')] * 5000)
+        conn.commit()
+        conn.close()
+
+        server = make_server(port=0, workers=1, db_path=db_path)
+        server.agent.limits = ExecutionLimits(max_rows=2, timeout=0.25)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+
+        def rpc(method, *params, **named):
+            body = {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': named or list(params)}
+            client.request('POST', '/rpc', body=json.dumps(body))
+            return json.loads(client.getresponse().read())
+
+        try:
+            picked = rpc('multiple_bookings', [1, 2, 3, 4])['result']
+            assert [b['booking_id'] for b in picked['bookings']] == [1, 2] and picked['skipped'] == 2
+            assert len(rpc('bookings_page', page_size=1000)['result']['rows']) == 2
+            assert len(rpc('latest_bookings', 100)['result']['rows']) == 2
+            assert rpc('top_users', 100)['result']['count'] == 2
+            assert rpc('list_all_bookings')['error']['code'] == -32601
+            assert rpc('booking_details', 1, conn=None)['error']['code'] == -32602
+
+            started = time.perf_counter()
+            cut_off = rpc('user_bookings', 'nikitha')
+            assert "time limit" in cut_off['error']['message'] and time.perf_counter() - started < 2
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            server.agent.pool.close_all()
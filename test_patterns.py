@@ -38,3 +38,11 @@ try:
     print(f"Result: {result}")
 except Exception as e:
     print(f"Error: {e}")
+
+
+def test_compiled_matcher_matches_legacy_loop():
+    """The single compiled matcher must pick the same intent as the old loop"""
+    from bench_patterns import CORPUS, legacy_parse
+    phrases = CORPUS + test_phrases + ["SHOW BOOKINGS FOR Nikitha", "help me show booking 1"]
+    for phrase in phrases:
+        assert agent.parse_natural_language(phrase) == legacy_parse(agent.commands, phrase), phrase
@@ -0,0 +1,186 @@
+"""
+Opt-in tracing for the agent pipeline
+
+    tracer = Tracer()
+    agent = TravelBookingAgent(tracer=tracer)
+    agent.process_command("total price for user nikitha")
+    tracer.export("trace.json")     # Chrome trace-event format (chrome://tracing, Perfetto)
+    tracer.export("trace.jsonl")    # one JSON span per line
+
+The agent records a span for each stage of a command (parse, generate,
+execute, format) and one per SQL statement, captured with
+sqlite3.Connection.set_trace_callback. SQLite only reports when a statement
+starts, so a statement's span runs until the next statement starts or the
+enclosing stage ends.
+
+Agents without a tracer use NULL_TRACER, whose span() hands back one shared
+no-op context manager, so tracing costs next to nothing when it is off.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field, asdict
+from itertools import count
+
+# Line comments are dropped so a statement still parses once it is joined onto one line
+_SQL_COMMENT = re.compile(r'--[^\n]*')
+
+
+@dataclass
+class Span:
+    span_id: int
+    name: str
+    start: float
+    end: float = None
+    parent_id: int = None
+    thread_id: int = 0
+    attrs: dict = field(default_factory=dict)
+
+    @property
+    def duration_ms(self):
+        return round(((self.end or self.start) - self.start) * 1000, 3)
+
+
+class _ActiveSpan:
+    """Context manager for one open span"""
+
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._close(self.span, exc)
+        return False
+
+
+class Tracer:
+    """Collects spans from any number of threads; keeps the newest max_spans"""
+
+    enabled = True
+
+    def __init__(self, max_spans=100_000):
+        self.spans = deque(maxlen=max_spans)
+        self._ids = count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, **attrs):
+        """Time a block: ``with tracer.span('parse', command=text): ...``"""
+        stack = self._stack()
+        self._end_sql()
+        span = Span(next(self._ids), name, time.perf_counter(),
+                    parent_id=stack[-1].span_id if stack else None,
+                    thread_id=threading.get_ident(), attrs=attrs)
+        stack.append(span)
+        return _ActiveSpan(self, span)
+
+    def _close(self, span, exc=None):
+        self._end_sql()
+        span.end = time.perf_counter()
+        if exc is not None:
+            span.attrs['error'] = f"{type(exc).__name__}: {exc}"
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        with self._lock:
+            self.spans.append(span)
+
+    def _end_sql(self):
+        sql = getattr(self._local, 'sql', None)
+        if sql is not None:
+            self._local.sql = None
+            sql.end = time.perf_counter()
+            with self._lock:
+                self.spans.append(sql)
+
+    def sql(self, statement):
+        """sqlite3 trace callback: one span per statement"""
+        self._end_sql()
+        stack = self._stack()
+        self._local.sql = Span(next(self._ids), 'sql', time.perf_counter(),
+                               parent_id=stack[-1].span_id if stack else None,
+                               thread_id=threading.get_ident(),
+                               attrs={'statement': ' '.join(_SQL_COMMENT.sub('', statement).split())})
+
+    def trace_connection(self, conn):
+        """Context manager that records every statement run on ``conn``"""
+        return _TracedConnection(self, conn)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def to_chrome(self):
+        """Spans as a Chrome trace-event document (complete 'X' events, microseconds)"""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        return {'traceEvents': [
+            {
+                'name': s.name if s.name != 'sql' else s.attrs['statement'][:60],
+                'cat': 'sql' if s.name == 'sql' else 'agent',
+                'ph': 'X',
+                'ts': round(s.start * 1e6, 3),
+                'dur': round(((s.end or s.start) - s.start) * 1e6, 3),
+                'pid': pid,
+                'tid': s.thread_id,
+                'args': s.attrs,
+            }
+            for s in spans
+        ], 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        """Write spans to ``path``: JSON lines for *.jsonl, Chrome trace JSON otherwise"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                with self._lock:
+                    spans = list(self.spans)
+                for s in spans:
+                    f.write(json.dumps({**asdict(s), 'duration_ms': s.duration_ms}, ensure_ascii=False) + "\n")
+            else:
+                json.dump(self.to_chrome(), f, ensure_ascii=False)
+
+
+class _TracedConnection:
+    def __init__(self, tracer, conn):
+        self.tracer = tracer
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.set_trace_callback(self.tracer.sql)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.set_trace_callback(None)
+        self.tracer._end_sql()
+        return False
+
+
+class NullTracer:
+    """Tracer that records nothing"""
+
+    enabled = False
+    spans = ()
+    _noop = nullcontext()
+
+    def span(self, name, **attrs):
+        return self._noop
+
+    def trace_connection(self, conn):
+        return self._noop
+
+
+NULL_TRACER = NullTracer()
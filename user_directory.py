@@ -0,0 +1,145 @@
+"""
+In-memory username directory
+
+Resolves usernames without scanning the users table:
+
+* exact (case-sensitive) names -> id in a dict
+* case-insensitive matches through a dict keyed by the normalized name
+  (ASCII lowercase, the same folding as SQLite's lower())
+* "did you mean" suggestions from a sorted prefix index, with difflib
+  close matches as a fallback
+
+The directory is loaded once per database file and kept current: in-process
+inserts call note_new_user(), and rows added by other processes are picked
+up incrementally (id > last seen id) whenever SQLite's data_version says the
+file changed. Users are never deleted or renamed by this app, so neither is
+tracked.
+"""
+import difflib
+import os
+import sqlite3
+import string
+import threading
+from bisect import bisect_left, insort
+
+from db import DB_PATH
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def normalize(username):
+    """Case-folded key for a username (matches SQLite's lower())"""
+    return username.translate(_ASCII_LOWER)
+
+
+class UserDirectory:
+    """Username lookups for one database file"""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._last_id = 0
+        self._ids = {}          # exact username -> id
+        self._folded = {}       # normalized name -> [(id, username)] in id order
+        self._prefix_keys = []  # sorted normalized names
+
+    def _add(self, user_id, username):
+        if self._ids.get(username) == user_id:
+            return
+        self._ids[username] = user_id
+        key = normalize(username)
+        matches = self._folded.get(key)
+        if matches is None:
+            self._folded[key] = [(user_id, username)]
+            insort(self._prefix_keys, key)
+        else:
+            insort(matches, (user_id, username))
+
+    def _refresh(self):
+        """Load users added since the last look; caller holds the lock"""
+        if self._conn is None:
+            # Only this thread-safe object touches the connection, under the lock
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        rows = self._conn.execute(
+            "SELECT id, username FROM users WHERE id > ? ORDER BY id", (self._last_id,)).fetchall()
+        for user_id, username in rows:
+            self._add(user_id, username)
+        if rows:
+            # Advanced only here: a user noted by this process may have a
+            # higher id than rows other processes committed just before it
+            self._last_id = rows[-1][0]
+
+    def note_new_user(self, user_id, username):
+        """Record a user this process just inserted"""
+        with self._lock:
+            self._add(user_id, username)
+
+    def user_id(self, username):
+        """Id of the user with exactly this name, or None"""
+        with self._lock:
+            self._refresh()
+            return self._ids.get(username)
+
+    def matching(self, username):
+        """[(id, username)] of users with this name in any case, in id order"""
+        with self._lock:
+            self._refresh()
+            return list(self._folded.get(normalize(username), ()))
+
+    def suggestions(self, username, limit=5):
+        """Usernames that start with, or look like, the given name"""
+        key = normalize(username)
+        with self._lock:
+            self._refresh()
+            keys = self._prefix_keys
+            found = []
+            start = bisect_left(keys, key)
+            for candidate in keys[start:]:
+                if not candidate.startswith(key) or len(found) >= limit:
+                    break
+                found.append(candidate)
+            if len(found) < limit:
+                for candidate in difflib.get_close_matches(key, keys, n=limit):
+                    if candidate not in found:
+                        found.append(candidate)
+            return [name for candidate in found[:limit] for _, name in self._folded[candidate]]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+def get_directory(db_path=DB_PATH):
+    """The shared UserDirectory for a database file"""
+    db_path = os.path.realpath(db_path)
+    with _directories_lock:
+        directory = _directories.get(db_path)
+        if directory is None:
+            directory = _directories[db_path] = UserDirectory(db_path)
+        return directory
+
+
+def directory_for(conn):
+    """The shared UserDirectory for the file ``conn`` is open on (None for in-memory databases)"""
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return get_directory(path) if path else None
+
+
+def note_new_user(user_id, username, db_path=DB_PATH):
+    """Tell an already-loaded directory about a user inserted by this process"""
+    with _directories_lock:
+        directory = _directories.get(os.path.realpath(db_path))
+    if directory is not None:
+        directory.note_new_user(user_id, username)